@@ -39,6 +39,21 @@ class Fs(BaseModel):
     max_parallel: int = 3
     chunk_size: int = 1024 * 1024 * 30
     skip_files: str = ""
+    io_workers: int = 8
+    index_rebuild_interval: int = 3600
+    watch_mode: str = "auto"
+    watch_interval: int = 30
+    job_parallel: int = 1
+    trash: bool = True
+    trash_retention: int = 30
+    purge_rate: int = 1000
+    sendfile: bool = True
+    folder_zip: str = "store"
+    write_behind: bool = False
+    instant_upload: bool = True
+    dedup_hardlink: bool = False
+    upload_sha256: bool = True
+    upload_flush_interval: int = 2
 
 
 class Config(BaseModel):
@@ -13,6 +13,13 @@ from config import AppConfig
 from src.utils.authenticator import Auth
 from src.utils.cache_store import MemCache
 from src.utils.filesystem import VFS
+from src.utils.filesystem.executor import FSExecutor
+from src.utils.filesystem.index import MetaIndex
+from src.utils.filesystem.jobs import JobManager
+from src.utils.filesystem.trash import Trash
+from src.utils.filesystem.upload_registry import UploadRegistry
+from src.utils.filesystem.walker import TreeWalker
+from src.utils.filesystem.watcher import ChangeWatcher
 from src.utils.jinja_extend import conf_app
 
 # 创建工作文件夹
@@ -73,6 +80,9 @@ register_tortoise(
             "src.model.upload_task",
             "src.model.user",
             "src.model.share",
+            "src.model.fs_job",
+            "src.model.trash",
+            "src.model.file_digest",
         ]
     },
     generate_schemas=True
@@ -86,17 +96,68 @@ app.blueprint(router)
 app.static("/static", "resources/static", name="uploads")
 
 
+# 初始化文件系统线程池
+@app.before_server_start
+async def setup_executor(app_: Sanic):
+    FSExecutor.initialize(AppConfig.config.fs.io_workers)
+    TreeWalker.initialize(AppConfig.config.fs.io_workers)
+
+
+@app.after_server_stop
+async def release_executor(app_: Sanic):
+    ChangeWatcher.stop_all()
+    JobManager.shutdown()
+    Trash.shutdown()
+    FSExecutor.shutdown()
+    TreeWalker.shutdown()
+
+
 # 挂载vfs
 @app.before_server_start
 async def setup_vfs(app_: Sanic):
     from src.model.storage import Storage
+    from src.utils import thumbnail
+    ChangeWatcher.configure(AppConfig.config.fs.watch_mode, AppConfig.config.fs.watch_interval)
+    ChangeWatcher.subscribe(MetaIndex.on_change)
+    ChangeWatcher.subscribe(thumbnail.on_change)
     storages = await Storage.filter(activated=True).all()
     for s in storages:
         os.chmod(s.root_path, stat.S_IRWXG)
         VFS.mount(s.mount_name, OSFS(s.root_path, create=True))
+        MetaIndex.mount(s.mount_name, s.root_path)
+        app_.add_task(MetaIndex.build(s.mount_name))
+        ChangeWatcher.start(s.mount_name, s.root_path)
+    app_.add_task(MetaIndex.rebuild_forever(AppConfig.config.fs.index_rebuild_interval))
     print("挂载目录 ->", VFS.listdir("/"))
 
 
+# 继续未完成的复制/移动任务
+@app.after_server_start
+async def resume_jobs(app_: Sanic):
+    JobManager.configure(AppConfig.config.fs.job_parallel)
+    await JobManager.resume_all()
+
+
+# 回收站后台清理
+@app.after_server_start
+async def start_purge(app_: Sanic):
+    Trash.configure(AppConfig.config.fs.trash_retention, AppConfig.config.fs.purge_rate)
+    app_.add_task(Trash.purge_forever())
+
+
+# 上传任务状态定期写入数据库
+@app.after_server_start
+async def start_upload_flush(app_: Sanic):
+    UploadRegistry.configure(AppConfig.config.fs.upload_flush_interval)
+    app_.add_task(UploadRegistry.flush_forever())
+
+
+# 停止前写入未保存的上传任务状态
+@app.before_server_stop
+async def flush_uploads(app_: Sanic):
+    await UploadRegistry.shutdown()
+
+
 # 挂载缓存库
 @app.before_server_start
 async def setup_cache(app_: Sanic):
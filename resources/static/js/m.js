@@ -77,9 +77,59 @@ const fsCopy = (src_dir, dst_dir, name) => {
   });
 };
 
-// 清理空文件夹
-const fsClearEmptyDir = (path) => {
-  return request.post("/fs/clear_empty_dir", { path: path });
+// 复制/移动任务列表
+const fsJobList = (status) => {
+  return request.post("/fs/job/list", { status: status });
+};
+
+// 复制/移动任务详情
+const fsJobInfo = (job_id) => {
+  return request.post("/fs/job/info", { job_id: job_id });
+};
+
+// 取消复制/移动任务
+const fsJobCancel = (job_id) => {
+  return request.post("/fs/job/cancel", { job_id: job_id });
+};
+
+// 继续复制/移动任务
+const fsJobResume = (job_id) => {
+  return request.post("/fs/job/resume", { job_id: job_id });
+};
+
+// 回收站列表
+const fsTrashList = (mount_name) => {
+  return request.post("/fs/trash/list", { mount_name: mount_name });
+};
+
+// 从回收站还原
+const fsTrashRestore = (ids) => {
+  return request.post("/fs/trash/restore", { ids: ids });
+};
+
+// 彻底删除回收站条目
+const fsTrashDelete = (ids) => {
+  return request.post("/fs/trash/delete", { ids: ids });
+};
+
+// 清空回收站
+const fsTrashEmpty = (mount_name) => {
+  return request.post("/fs/trash/empty", { mount_name: mount_name });
+};
+
+// 清理空文件夹, dry_run为true时只生成报告
+const fsClearEmptyDir = (path, dry_run = false) => {
+  return request.post("/fs/clear_empty_dir", { path: path, dry_run: dry_run });
+};
+
+// 下载吞吐统计
+const fsDownloadMetrics = () => {
+  return request.post("/fs/download/metrics");
+};
+
+// 清理任务报告
+const fsJobReport = (job_id) => {
+  return request.post("/fs/job/report", { job_id: job_id });
 };
 
 // 删除文件/文件夹
@@ -224,9 +274,11 @@ const uploadTaskCreate = (
   modified,
   mime_type,
   mode,
-  wipe
+  wipe,
+  sha256 = null,
+  sample = null
 ) => {
-  return request.post("/upload_task/create", {
+  let data = {
     path: path,
     web_path: web_path,
     name: name,
@@ -235,7 +287,13 @@ const uploadTaskCreate = (
     mime_type: mime_type,
     mode: mode,
     wipe: wipe
-  });
+  };
+  // 秒传: 文件与抽样块的SHA-256
+  if (sha256 && sample) {
+    data.sha256 = sha256;
+    data.sample = sample;
+  }
+  return request.post("/upload_task/create", data);
 };
 
 // 上传任务列表
@@ -2,12 +2,21 @@ const request = axios.create({
   baseURL: "/api",
 });
 
+// 列表/详情接口的ETag缓存, 数据未变化时服务端返回304, 直接复用本地数据
+const etagUrls = ["/fs/list", "/fs/dirs", "/fs/detail"];
+const etagCache = new Map();
+
 // 添加请求拦截器
 request.interceptors.request.use(
   function (config) {
     // 在发送请求之前做些什么
     const csrf = Cookies.get("csrf");
     if (csrf) config.headers["X-CSRF-Token"] = csrf;
+    if (etagUrls.includes(config.url)) {
+      config.etagKey = config.url + "|" + JSON.stringify(config.data || {});
+      const cached = etagCache.get(config.etagKey);
+      if (cached) config.headers["If-None-Match"] = cached.etag;
+    }
     return config;
   },
   function (error) {
@@ -22,6 +31,11 @@ request.interceptors.response.use(
     // 2xx 范围内的状态码都会触发该函数。
     // 对响应数据做点什么
     const code = response.data.code;
+    const etag = response.headers["etag"];
+    if (code === 200 && etag && response.config.etagKey) {
+      if (etagCache.size >= 200) etagCache.delete(etagCache.keys().next().value);
+      etagCache.set(response.config.etagKey, { etag: etag, data: JSON.stringify(response.data) });
+    }
     
     switch (code) {
       case 410:
@@ -55,6 +69,10 @@ request.interceptors.response.use(
   function (error) {
     // 超出 2xx 范围的状态码都会触发该函数。
     // 对响应错误做点什么
+    if (error.response && error.response.status === 304) {
+      const cached = etagCache.get(error.config.etagKey);
+      if (cached) return { ...error.response, data: JSON.parse(cached.data) };
+    }
     return Promise.reject(error.response);
   }
 );
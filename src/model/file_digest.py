@@ -0,0 +1,15 @@
+from tortoise import Model, fields
+
+
+class FileDigest(Model):
+    id = fields.IntField(pk=True)
+    mount_name = fields.CharField(index=True, null=False, max_length=200, description="存储空间挂载名称")
+    path = fields.CharField(null=False, max_length=500, description="文件路径, 相对存储空间根目录")
+    size = fields.BigIntField(description="文件大小")
+    mtime_ns = fields.BigIntField(description="记录时的修改时间, 与当前不一致说明内容可能已改变")
+    sha256 = fields.CharField(index=True, null=True, max_length=64, description="内容SHA-256, 未计算时为空")
+    xxh3 = fields.CharField(null=True, max_length=32, description="内容xxh3-128, 未计算时为空")
+    created = fields.FloatField(description="记录时间")
+
+    class Meta:
+        unique_together = (("mount_name", "path"),)
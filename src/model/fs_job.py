@@ -0,0 +1,42 @@
+from enum import Enum
+
+from tortoise import Model, fields
+
+
+class JobKind(str, Enum):
+    COPY = "COPY"
+    MOVE = "MOVE"
+    CLEAN = "CLEAN"
+    CLEAN_DRY_RUN = "CLEAN_DRY_RUN"
+
+
+class JobStatus(str, Enum):
+    PENDING = "PENDING"
+    RUNNING = "RUNNING"
+    SUCCESS = "SUCCESS"
+    FAILED = "FAILED"
+    CANCELED = "CANCELED"
+
+
+class FsJob(Model):
+    id = fields.IntField(pk=True)
+    job_id = fields.CharField(index=True, unique=True, null=False, max_length=64, description="任务标识")
+    kind = fields.CharEnumField(JobKind, description="任务类型: 复制/移动/清理空文件夹")
+    status = fields.CharEnumField(JobStatus, default=JobStatus.PENDING, description="任务状态")
+    src_dir = fields.CharField(null=False, max_length=200, description="源文件夹, 清理任务为待清理的文件夹")
+    dst_dir = fields.CharField(null=False, max_length=200, description="目标文件夹, 清理任务与源文件夹相同")
+    names = fields.JSONField(description="文件/文件夹名称列表")
+    bytes_total = fields.BigIntField(default=0, description="总字节数")
+    bytes_done = fields.BigIntField(default=0, description="已完成字节数")
+    files_total = fields.IntField(default=0, description="总文件数")
+    files_done = fields.IntField(default=0, description="已完成文件数")
+    throughput = fields.FloatField(default=0, description="速度 字节/秒")
+    message = fields.CharField(null=True, max_length=500, description="错误信息, 成功时为各复制方式的文件数")
+    created = fields.FloatField(description="创建时间")
+    finished = fields.FloatField(null=True, description="结束时间")
+
+
+class FsJobReport(Model):
+    id = fields.IntField(pk=True)
+    job_id = fields.CharField(index=True, unique=True, null=False, max_length=64, description="任务标识")
+    paths = fields.JSONField(description="清理任务删除(预览时为将删除)的空文件夹")
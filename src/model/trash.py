@@ -0,0 +1,14 @@
+from tortoise import Model, fields
+
+
+class TrashItem(Model):
+    id = fields.IntField(pk=True)
+    trash_id = fields.CharField(index=True, unique=True, null=False, max_length=64, description="回收站内名称")
+    mount_name = fields.CharField(index=True, null=False, max_length=200, description="存储空间挂载名称")
+    path = fields.CharField(null=False, max_length=500, description="原路径, 相对存储空间根目录")
+    name = fields.CharField(null=False, max_length=200, description="文件/文件夹名称")
+    is_dir = fields.BooleanField(description="是否为目录")
+    size = fields.BigIntField(default=0, description="占用空间")
+    num = fields.IntField(default=0, description="文件数量")
+    deleted = fields.FloatField(description="删除时间")
+    purging = fields.BooleanField(default=False, description="是否等待彻底删除")
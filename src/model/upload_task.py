@@ -1,11 +1,14 @@
+import base64
 from enum import Enum
-from typing import Type, Optional
+from typing import Type, Optional, Dict
 
 from pydantic import BaseModel
 from tortoise import Model, fields, BaseDBAsyncClient
+from fs.path import forcedir
 from tortoise.signals import post_delete
 
 from src.utils.filesystem import VFS
+from src.utils.filesystem.index import MetaIndex
 
 
 class UploadStatus(str, Enum):
@@ -22,7 +25,55 @@ class UploadMode(str, Enum):
 class ChunkInfo(BaseModel):
     chunk_size: int
     chunk_total: int
+    # 最小的未完成分片序号
     chunk_cur: int
+    # 已完成分片的位图(base64), 第i个分片对应第i//8字节的第i%8位; 旧任务为空, 按chunk_cur之前均已完成处理
+    bitmap: str = ""
+    # 各分片的摘要, 序号 -> {算法: 十六进制摘要}
+    digests: Dict[str, Dict[str, str]] = {}
+
+    @classmethod
+    def new(cls, chunk_size: int, chunk_total: int) -> "ChunkInfo":
+        bitmap = base64.b64encode(bytes((chunk_total + 7) // 8)).decode()
+        return cls(chunk_size=chunk_size, chunk_total=chunk_total, chunk_cur=0, bitmap=bitmap)
+
+    def bits(self) -> bytearray:
+        if not self.bitmap:
+            bits = bytearray((self.chunk_total + 7) // 8)
+            for i in range(self.chunk_cur):
+                bits[i >> 3] |= 1 << (i & 7)
+            return bits
+        return bytearray(base64.b64decode(self.bitmap))
+
+    def is_done(self, index: int) -> bool:
+        return bool(self.bits()[index >> 3] & (1 << (index & 7)))
+
+    def mark(self, index: int):
+        bits = self.bits()
+        bits[index >> 3] |= 1 << (index & 7)
+        self.bitmap = base64.b64encode(bits).decode()
+        while self.chunk_cur < self.chunk_total and bits[self.chunk_cur >> 3] & (1 << (self.chunk_cur & 7)):
+            self.chunk_cur += 1
+
+    def fill(self):
+        """标记所有分片已完成"""
+        bits = bytearray(b"\xff" * ((self.chunk_total + 7) // 8))
+        self.bitmap = base64.b64encode(bits).decode()
+        self.chunk_cur = self.chunk_total
+
+    @property
+    def complete(self) -> bool:
+        return self.chunk_cur >= self.chunk_total
+
+    def uploaded(self, size: int) -> int:
+        """已完成分片的字节数"""
+        bits = self.bits()
+        done = sum(bin(b).count("1") for b in bits)
+        total = done * self.chunk_size
+        last = self.chunk_total - 1
+        if bits[last >> 3] & (1 << (last & 7)):
+            total -= self.chunk_total * self.chunk_size - size
+        return total
 
 
 class UploadTask(Model):
@@ -48,3 +99,4 @@ async def upload_task_post_delete(
         sub = VFS.opendir(instance.path)
         if sub.exists(instance.name):
             sub.remove(instance.name)
+            await MetaIndex.remove(forcedir(instance.path) + instance.name)
@@ -1,45 +1,61 @@
+import fnmatch
+import functools
 import mimetypes
 import os
 import re
 import stat
-from datetime import datetime
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Union
+from typing import Union, Callable, Optional, Iterator
 
-import shortuuid
 from aiofiles import os as async_os
-from pydantic import BaseModel
-from repro_zipfile import ReproducibleZipFile
 from sanic import Blueprint, Request, HTTPResponse, json, empty
-from sanic.compat import stat_async
-from sanic.handlers import ContentRangeHandler
-from sanic.response import file_stream
+from sanic.response import file_stream, ResponseStream
 from voluptuous.error import Invalid
 
 from config import AppConfig, PaginationMode
-from fs.subfs import SubFS
-from src.model.storage import Storage
+from fs.errors import FSError
+from fs.path import basename, dirname, join, normpath
+from src.model.fs_job import FsJob, FsJobReport, JobKind
+from src.model.storage import Storage, OrderBy
+from src.model.trash import TrashItem
 from src.model.user import Role
-from src.routers.resp import Resp
+from src.routers.resp import Resp, fast_json, dumps, make_etag, not_modified, DownloadMetrics, chunk_stream
+from src.routers.resp import file_validators, request_ranges, apply_ranges
 from src.routers.resp import file_stream as my_file_stream
 # 工具函数
 from src.schemas.fs import action_path_schema, ActionPathSchema
+from src.schemas.fs import clear_empty_dir_schema, ClearEmptyDirSchema
 from src.schemas.fs import copy_and_move_schema, CopyAndMoveSchema
+from src.schemas.fs import job_id_schema, JobIDSchema
+from src.schemas.fs import job_list_schema, JobListSchema
 from src.schemas.fs import lists_schema, ListsSchema
 from src.schemas.fs import name_list_one_dir_schema, NameListOneDirSchema
 from src.schemas.fs import path_schema, PathSchema
 from src.schemas.fs import search_schema, SearchSchema
+from src.schemas.fs import trash_ids_schema, TrashIDsSchema
+from src.schemas.fs import trash_list_schema, TrashListSchema
 # 数据校验
 from src.schemas.validator import validate as validate
 from src.utils.authenticator import token_required
 from src.utils.filesystem import VFS
 from src.utils.filesystem import hum_convert
-from src.utils.thumbnail import get_thumbnail, set_thumbnail
+from src.utils.filesystem.executor import FSExecutor, iterate_in_thread
+from src.utils.filesystem.index import MetaIndex, SearchMode, encode_cursor, page_rows, scan_dir, in_trash
+from src.utils.filesystem.jobs import JobManager
+from src.utils.filesystem.trash import Trash
+from src.utils.filesystem.vzip import VirtualZip, VirtualEntry
+from src.utils.filesystem.walker import WalkEntry
+from src.utils.filesystem.zipstream import stream_zip, ZipSource
+from src.utils.thumbnail import get_thumbnail, set_thumbnail, resolve_thumbnails, ThumbManifest
 
 fs_b = Blueprint("FS", url_prefix="/fs")
 
 
-class FInfo(BaseModel):
+@dataclass
+class FInfo:
+    """列表条目, 不做字段校验, 由fast_json直接序列化"""
+    __slots__ = ("name", "size", "is_dir", "modified", "file_type", "raw_path", "parent_dir", "thumbnail")
     name: str
     size: Union[int, None]
     is_dir: bool
@@ -47,7 +63,128 @@ class FInfo(BaseModel):
     file_type: Union[str, None]
     raw_path: Union[str, None]
     parent_dir: Union[str, None]
-    thumbnail: Union[str, None] = None
+    thumbnail: Union[str, None]
+
+
+async def entry_thumbnail(request: Request, syspath: str) -> Union[str, None]:
+    if not AppConfig.config.preview.thumbnail:
+        return None
+    thumb = await get_thumbnail(syspath)
+    if thumb is None:
+        request.app.add_task(set_thumbnail(syspath))
+    return thumb
+
+
+# 批量解析一组索引行的缩略图
+def row_thumbnails(request: Request, rows: list, syspath_of: Callable, generate: bool = True) -> dict:
+    if not AppConfig.config.preview.thumbnail:
+        return {}
+    if generate:
+        return resolve_thumbnails(rows, syspath_of, lambda p: request.app.add_task(set_thumbnail(p)))
+    return resolve_thumbnails(rows, syspath_of, lambda p: None)
+
+
+def path_validator(path: str, deep: bool = False) -> Optional[tuple]:
+    """索引就绪时取索引修改计数, 否则取目录修改时间和条目数; deep表示结果依赖整个子树"""
+    index, _ = MetaIndex.ready(path)
+    if index:
+        return index.token, index.generation
+    try:
+        syspath = VFS.getsyspath(path)
+        st = os.stat(syspath)
+        if not stat.S_ISDIR(st.st_mode):
+            return st.st_ino, st.st_mtime_ns, st.st_size
+        if deep:
+            return None
+        return st.st_mtime_ns, len(os.listdir(syspath))
+    except (OSError, FSError):
+        return None
+
+
+async def path_etag(path: str, *parts, deep: bool = False) -> Optional[str]:
+    validator = path_validator(path, deep)
+    if validator is None:
+        return None
+    storage = await Storage.get_or_none(mount_name=path.split("/")[1], activated=True)
+    order = (storage.order_field, storage.reverse) if storage else None
+    thumbs = None
+    if AppConfig.config.preview.thumbnail:
+        syspath = VFS.syspath_or_none(path)
+        thumbs = ThumbManifest.dir_version(syspath) if syspath else None
+    return make_etag(path, validator, order, thumbs, AppConfig.config.fs.pagination_size, *parts)
+
+
+def with_etag(response: HTTPResponse, etag: Optional[str]) -> HTTPResponse:
+    if etag:
+        response.headers["ETag"] = etag
+    return response
+
+
+def walk_rows(path: str) -> Iterator[dict]:
+    """索引未就绪时遍历目录树, 生成与索引相同结构的文件行"""
+    for e in VFS.walk_entries(path):
+        if e.is_dir:
+            continue
+        name = basename(e.path)
+        yield {
+            "path": join(path, e.path[1:]), "name": name, "size": e.stat.st_size, "modified": e.stat.st_mtime,
+            "is_dir": 0, "mime": mimetypes.guess_type(name)[0],
+            "dev": e.stat.st_dev, "ino": e.stat.st_ino, "syspath": e.syspath
+        }
+
+
+def sort_entries(file_list: list, storage: Storage):
+    if not storage.reverse:
+        file_list.sort(key=lambda r: (-r.is_dir, getattr(r, storage.order_field)))
+    else:
+        file_list.sort(key=lambda r: (r.is_dir, getattr(r, storage.order_field)), reverse=True)
+
+
+# 键集分页列出目录, 只处理当前页的条目
+async def list_page(request: Request, body: ListsSchema, dirs_only: bool) -> HTTPResponse:
+    limit = body.limit or AppConfig.config.fs.pagination_size
+    if body.path == "/":
+        file_list = [
+            FInfo(
+                name=entry.name, size=entry.size, is_dir=True, modified=entry.modified.timestamp(),
+                file_type=None, raw_path=body.path + entry.name, parent_dir=body.path, thumbnail=None
+            )
+            for entry in VFS.scandir(body.path, namespaces=["basic", "details"])
+        ]
+        return fast_json(Resp.ok_data(Resp.cursor_paginate(len(file_list), file_list)))
+
+    mount_name = body.path.split("/")[1]
+    storage = await Storage.get(mount_name=mount_name, activated=True)
+    order_field = OrderBy(storage.order_field).value
+    index, index_path = MetaIndex.ready(body.path)
+    if index:
+        rows = index.list_page(index_path, order_field, storage.reverse, limit + 1, body.cursor, dirs_only)
+        total = index.count_dir(index_path, dirs_only)
+    else:
+        rows = scan_dir(VFS.getsyspath(body.path), index_path)
+        if dirs_only:
+            rows = [r for r in rows if r["is_dir"]]
+        total = len(rows)
+        rows = page_rows(rows, order_field, storage.reverse, limit + 1, body.cursor)
+
+    next_cursor = encode_cursor(rows[limit - 1], order_field) if len(rows) > limit else None
+    dir_syspath = VFS.getsyspath(body.path)
+    rows = rows[:limit]
+    thumbs = row_thumbnails(request, rows, lambda r: os.path.join(dir_syspath, r["name"]))
+    file_list = []
+    for row in rows:
+        entry_ = FInfo(
+            name=row["name"],
+            size=row["size"],
+            is_dir=bool(row["is_dir"]),
+            modified=row["modified"],
+            file_type=row["mime"],
+            raw_path=body.path + row["name"],
+            parent_dir=body.path,
+            thumbnail=thumbs.get(row["path"])
+        )
+        file_list.append(entry_)
+    return fast_json(Resp.ok_data(Resp.cursor_paginate(total, file_list, next_cursor)))
 
 
 # 列出目录列表
@@ -57,43 +194,154 @@ class FInfo(BaseModel):
 async def lists(
         request: Request, body: ListsSchema, token
 ) -> HTTPResponse:
+    # 目录未变化时直接返回304, 不再扫描和序列化
+    etag = await path_etag(body.path, "list", body.page, body.cursor, body.limit)
+    if not_modified(request, etag):
+        return empty(status=304, headers={"ETag": etag})
+    if body.cursor or body.limit:
+        return with_etag(await list_page(request, body, dirs_only=False), etag)
     file_list = list()
 
-    for entry in VFS.scandir(body.path, namespaces=["basic", "details"]):
-        if not entry.is_dir:
-            syspath = VFS.opendir(body.path).getsyspath(entry.name)
-            # 如果文件无法写入，则设置写入权限
-            if not os.access(syspath, os.W_OK):
-                os.chmod(syspath, stat.S_IWRITE)
-            if AppConfig.config.preview.thumbnail:
-                thumb = await get_thumbnail(syspath)
-                if thumb is None:
-                    request.app.add_task(set_thumbnail(syspath))
+    index, index_path = MetaIndex.ready(body.path)
+    if index:
+        rows = index.list_dir(index_path)
+        thumbs = row_thumbnails(request, rows, lambda r: index.getsyspath(r["path"]))
+        for row in rows:
+            entry_ = FInfo(
+                name=row["name"],
+                size=row["size"],
+                is_dir=bool(row["is_dir"]),
+                modified=row["modified"],
+                file_type=row["mime"],
+                raw_path=body.path + row["name"],
+                parent_dir=body.path,
+                thumbnail=thumbs.get(row["path"])
+            )
+            file_list.append(entry_)
+    else:
+        for entry in VFS.scandir(body.path, namespaces=["basic", "details"]):
+            if in_trash(body.path + entry.name):
+                continue
+            if not entry.is_dir:
+                syspath = VFS.opendir(body.path).getsyspath(entry.name)
+                # 如果文件无法写入，则设置写入权限
+                if not os.access(syspath, os.W_OK):
+                    os.chmod(syspath, stat.S_IWRITE)
+                thumb = await entry_thumbnail(request, syspath)
             else:
                 thumb = None
-        else:
-            thumb = None
-        entry_ = FInfo(
-            name=entry.name,
-            size=entry.size,
-            is_dir=entry.is_dir,
-            modified=entry.modified.timestamp(),
-            file_type=mimetypes.guess_type(entry.name)[0],
-            raw_path=body.path + entry.name,
-            parent_dir=body.path,
-            thumbnail=thumb
-        )
-        file_list.append(entry_.model_dump())
+            entry_ = FInfo(
+                name=entry.name,
+                size=entry.size,
+                is_dir=entry.is_dir,
+                modified=entry.modified.timestamp(),
+                file_type=mimetypes.guess_type(entry.name)[0],
+                raw_path=body.path + entry.name,
+                parent_dir=body.path,
+                thumbnail=thumb
+            )
+            file_list.append(entry_)
 
     if body.path != "/":
         mount_name = body.path.split("/")[1]
         storage = await Storage.get(mount_name=mount_name, activated=True)
-        if not storage.reverse:
-            file_list.sort(key=lambda r: (-r["is_dir"], r[storage.order_field]))
+        sort_entries(file_list, storage)
+
+    return with_etag(
+        fast_json(Resp.ok_data(Resp.paginate(body.page, len(file_list), file_list, PaginationMode.All.value))), etag
+    )
+
+
+# 以NDJSON流式返回目录下所有文件, 边遍历边输出
+def stream_files(request: Request, body: PathSchema) -> ResponseStream:
+    index, index_path = MetaIndex.ready(body.path)
+
+    def walk():
+        if index:
+            for row in index.iter_files(index_path):
+                item = dict(row)
+                item["path"] = "/" + index.mount_name + row["path"]
+                item["syspath"] = index.getsyspath(row["path"])
+                yield item
         else:
-            file_list.sort(key=lambda r: (r["is_dir"], r[storage.order_field]), reverse=True)
+            yield from walk_rows(body.path)
+
+    async def _streaming_fn(response):
+        batches = iterate_in_thread(walk)
+        try:
+            async for items in batches:
+                thumbs = row_thumbnails(request, items, lambda r: r["syspath"], generate=False)
+                lines = []
+                for item in items:
+                    entry_ = FInfo(
+                        name=item["name"],
+                        size=item["size"],
+                        is_dir=False,
+                        modified=item["modified"],
+                        file_type=item["mime"],
+                        raw_path=item["path"],
+                        parent_dir=item["path"][0:len(item["path"]) - len(item["name"])],
+                        thumbnail=thumbs.get(item["path"])
+                    )
+                    lines.append(dumps(entry_))
+                await response.write(b"\n".join(lines) + b"\n")
+        finally:
+            # 客户端断开时停止遍历线程
+            await batches.aclose()
+
+    return ResponseStream(streaming_fn=_streaming_fn, content_type="application/x-ndjson")
+
+
+def entry_opener(path: str, e: WalkEntry) -> Callable:
+    if e.syspath:
+        return functools.partial(open, e.syspath, "rb")
+    return functools.partial(VFS.openbin, join(path, e.path[1:]))
+
+
+# 文件夹边读取边压缩下载, 长度未知, 不支持断点续传
+def stream_folder_zip(path: str) -> ResponseStream:
+    prefix = basename(normpath(path))
+
+    def sources() -> Iterator[ZipSource]:
+        for e in VFS.walk_entries(path):
+            if not e.is_dir:
+                yield ZipSource(prefix + e.path, e.stat.st_size, e.stat.st_mtime, entry_opener(path, e))
+
+    return chunk_stream(
+        prefix + ".zip",
+        lambda: stream_zip(sources()),
+        headers={"Content-Disposition": f'Attachment; filename="{prefix}.zip"'},
+        content_type="application/zip"
+    )
+
 
-    return json(Resp.ok_data(Resp.paginate(body.page, len(file_list), file_list, PaginationMode.All.value)))
+# 文件夹按确定布局的STORE压缩包下载: 长度由文件列表算出, 支持Range断点续传
+async def virtual_folder_zip(request: Request, path: str) -> Union[ResponseStream, HTTPResponse]:
+    prefix = basename(normpath(path))
+
+    def build() -> VirtualZip:
+        entries = []
+        for e in VFS.walk_entries(path):
+            if e.is_dir:
+                continue
+            st = e.stat
+            key = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns or int(st.st_mtime * 1e9))
+            entries.append(VirtualEntry(prefix + e.path, st.st_size, st.st_mtime, key, entry_opener(path, e)))
+        return VirtualZip(entries)
+
+    vz = await FSExecutor.run(build)
+    etag = f'"{vz.digest[:20]}"'
+    if not_modified(request, etag):
+        return empty(status=304, headers={"ETag": etag})
+    headers = {"Content-Disposition": f'Attachment; filename="{prefix}.zip"', "ETag": etag}
+    ranges = request_ranges(request, vz.size, etag)
+    status, content_type, multipart = apply_ranges(ranges, vz.size, "application/zip", headers)
+    start, size = ranges[0].start if ranges else 0, int(headers["Content-Length"])
+    if multipart:
+        factory = functools.partial(multipart.chunks, vz.read)
+    else:
+        factory = functools.partial(vz.read, start, start + size)
+    return chunk_stream(prefix + ".zip", factory, status, headers, content_type, start, size)
 
 
 # 获取目录下所有文件
@@ -101,30 +349,44 @@ async def lists(
 @token_required(allow=[Role.Admin])
 @validate(json=(path_schema, PathSchema))
 async def get_files(request: Request, body: PathSchema, token):
+    if "application/x-ndjson" in request.headers.get("accept", ""):
+        return stream_files(request, body)
     file_list = []
-    for entry in VFS.walk.info(body.path, namespaces=["basic", "details"]):
-        path_ = entry[0]
-        info_ = entry[1]
-        if not info_.is_dir:
-            if AppConfig.config.preview.thumbnail:
-                syspath = VFS.getsyspath(path_)
-                thumb = await get_thumbnail(syspath)
-            else:
-                thumb = None
+    index, index_path = MetaIndex.ready(body.path)
+    if index:
+        rows = index.files(index_path)
+        thumbs = row_thumbnails(request, rows, lambda r: index.getsyspath(r["path"]), generate=False)
+        for row in rows:
+            thumb = thumbs.get(row["path"])
+            raw_path = "/" + index.mount_name + row["path"]
             entry_ = FInfo(
-                name=info_.name,
-                size=info_.size,
-                is_dir=info_.is_dir,
-                modified=info_.modified.timestamp(),
-                file_type=mimetypes.guess_type(info_.name)[0],
-                raw_path=path_,
-                parent_dir=path_[0:len(path_) - len(info_.name)],
+                name=row["name"],
+                size=row["size"],
+                is_dir=False,
+                modified=row["modified"],
+                file_type=row["mime"],
+                raw_path=raw_path,
+                parent_dir=raw_path[0:len(raw_path) - len(row["name"])],
                 thumbnail=thumb
             )
-            file_list.append(entry_.model_dump())
-        else:
-            continue
-    return json(Resp.ok_data(file_list))
+            file_list.append(entry_)
+        return fast_json(Resp.ok_data(file_list))
+
+    rows = await FSExecutor.run(lambda: list(walk_rows(body.path)))
+    thumbs = row_thumbnails(request, rows, lambda r: r["syspath"], generate=False)
+    for row in rows:
+        entry_ = FInfo(
+            name=row["name"],
+            size=row["size"],
+            is_dir=False,
+            modified=row["modified"],
+            file_type=row["mime"],
+            raw_path=row["path"],
+            parent_dir=row["path"][0:len(row["path"]) - len(row["name"])],
+            thumbnail=thumbs.get(row["path"])
+        )
+        file_list.append(entry_)
+    return fast_json(Resp.ok_data(file_list))
 
 
 # 列出目录列表
@@ -134,32 +396,53 @@ async def get_files(request: Request, body: PathSchema, token):
 async def dirs(
         request: Request, body: ListsSchema, token
 ) -> HTTPResponse:
+    etag = await path_etag(body.path, "dirs", body.page, body.cursor, body.limit)
+    if not_modified(request, etag):
+        return empty(status=304, headers={"ETag": etag})
+    if body.cursor or body.limit:
+        return with_etag(await list_page(request, body, dirs_only=True), etag)
     file_list = list()
-    for entry in VFS.scandir(body.path, namespaces=["basic", "details"]):
-        if entry.is_dir:
+    index, index_path = MetaIndex.ready(body.path)
+    if index:
+        for row in index.list_dir(index_path):
+            if not row["is_dir"]:
+                continue
             entry_ = FInfo(
-                name=entry.name,
-                size=entry.size,
-                is_dir=entry.is_dir,
-                modified=entry.modified.timestamp(),
+                name=row["name"],
+                size=row["size"],
+                is_dir=True,
+                modified=row["modified"],
                 file_type=None,
-                raw_path=body.path + entry.name,
+                raw_path=body.path + row["name"],
                 parent_dir=body.path,
                 thumbnail=None
             )
-            file_list.append(entry_.model_dump())
-        else:
-            continue
+            file_list.append(entry_)
+    else:
+        for entry in VFS.scandir(body.path, namespaces=["basic", "details"]):
+            if entry.is_dir and not in_trash(body.path + entry.name):
+                entry_ = FInfo(
+                    name=entry.name,
+                    size=entry.size,
+                    is_dir=entry.is_dir,
+                    modified=entry.modified.timestamp(),
+                    file_type=None,
+                    raw_path=body.path + entry.name,
+                    parent_dir=body.path,
+                    thumbnail=None
+                )
+                file_list.append(entry_)
+            else:
+                continue
 
     if body.path != "/":
         mount_name = body.path.split("/")[1]
         storage = await Storage.get(mount_name=mount_name, activated=True)
-        if not storage.reverse:
-            file_list.sort(key=lambda r: (-r["is_dir"], r[storage.order_field]))
-        else:
-            file_list.sort(key=lambda r: (r["is_dir"], r[storage.order_field]), reverse=True)
+        sort_entries(file_list, storage)
 
-    return json(Resp.ok_data(Resp.paginate(body.page, len(file_list), file_list, PaginationMode.All.value)))
+    return with_etag(
+        fast_json(Resp.ok_data(Resp.paginate(body.page, len(file_list), file_list, PaginationMode.All.value))), etag
+    )
 
 
 # 新建文件夹
@@ -170,7 +453,10 @@ async def mkdir(
         request: Request, body: ActionPathSchema, token
 ) -> HTTPResponse:
     path_ = body.path + body.name
+    if in_trash(path_):
+        return json(Resp.err_msg(f"名称不可用: {body.name}"))
     VFS.makedirs(path_)
+    await MetaIndex.refresh(path_)
     entry = VFS.getinfo(path_, namespaces=['basic', 'details'])
 
     entry_ = FInfo(
@@ -184,7 +470,7 @@ async def mkdir(
         thumbnail=None
     )
 
-    return json(Resp.ok_data(entry_.model_dump()))
+    return fast_json(Resp.ok_data(entry_))
 
 
 # 重命名文件/文件夹
@@ -196,10 +482,14 @@ async def rename(request: Request, body: ActionPathSchema, token) -> HTTPRespons
     old_sys_path = VFS.getsyspath(path_)
 
     new_sys_path = Path(old_sys_path).parent.joinpath(body.name)
+    if in_trash(join(dirname(normpath(path_)), body.name)):
+        return json(Resp.err_msg(f"名称不可用: {body.name}"))
     if new_sys_path.exists():
         return json(Resp.err_msg(f"路径'{path_}'中已有同名文件/文件夹"))
 
     await async_os.rename(old_sys_path, new_sys_path)
+    await MetaIndex.remove(path_)
+    await MetaIndex.refresh(join(dirname(normpath(path_)), body.name))
 
     return json(Resp.ok_msg(f"重命名文件/文件夹成功"))
 
@@ -209,6 +499,25 @@ async def rename(request: Request, body: ActionPathSchema, token) -> HTTPRespons
 @token_required(allow=[Role.Admin])
 @validate(json=(path_schema, PathSchema))
 async def detail(request: Request, body: PathSchema, token) -> HTTPResponse:
+    etag = await path_etag(body.path, "detail", deep=True)
+    if not_modified(request, etag):
+        return empty(status=304, headers={"ETag": etag})
+    index, index_path = MetaIndex.ready(body.path)
+    row = index.get(index_path) if index else None
+    if row:
+        thumb = await get_thumbnail(index.getsyspath(index_path)) if not row["is_dir"] else None
+        entry_ = FInfo(
+            name=row["name"],
+            size=row["size"] if not row["is_dir"] else (await FSExecutor.run(VFS.get_dir_size, body.path))[0],
+            is_dir=bool(row["is_dir"]),
+            modified=row["modified"],
+            file_type=row["mime"],
+            raw_path=body.path,
+            parent_dir=body.path[0:len(body.path) - len(row["name"])],
+            thumbnail=thumb
+        )
+        return with_etag(fast_json(Resp.ok_data(entry_)), etag)
+
     entry = VFS.getinfo(body.path, ["basic", "details"])
     if not entry.is_dir:
         syspath = VFS.getsyspath(body.path)
@@ -218,7 +527,7 @@ async def detail(request: Request, body: PathSchema, token) -> HTTPResponse:
 
     entry_ = FInfo(
         name=entry.name,
-        size=VFS.getsize(body.path) if not entry.is_dir else VFS.get_dir_size(body.path)[0],
+        size=await FSExecutor.run(VFS.get_path_size, body.path),
         is_dir=entry.is_dir,
         modified=entry.modified.timestamp(),
         file_type=mimetypes.guess_type(entry.name)[0],
@@ -227,7 +536,7 @@ async def detail(request: Request, body: PathSchema, token) -> HTTPResponse:
         thumbnail=thumb
     )
 
-    return json(Resp.ok_data(entry_.model_dump()))
+    return with_etag(fast_json(Resp.ok_data(entry_)), etag)
 
 
 # 移动文件/文件夹
@@ -244,21 +553,16 @@ async def move(request: Request, body: CopyAndMoveSchema, token) -> HTTPResponse
 
         files_size = 0
         for n in body.name:
-            p = body.src_dir + n
-            files_size += VFS.getsize(p) if not VFS.isdir(p) else VFS.get_dir_size(p)[0]
+            files_size += await FSExecutor.run(VFS.get_path_size, body.src_dir + n)
 
-        dst_size = files_size + VFS.get_dir_size("/" + storage.mount_name)[0]
+        dst_size = files_size + await Trash.used_space(storage.mount_name)
         if dst_size > storage.capacity:
             return json(Resp.err_msg(f"存储空间容量不足: {hum_convert(storage.capacity)}"))
 
-    for n in body.name:
-        src_path = body.src_dir + n
-        dst_path = body.dst_dir + n
-        if VFS.isdir(src_path):
-            VFS.movedir(src_path, dst_path, True)
-        else:
-            VFS.move(src_path, dst_path, True)
-    return json(Resp.ok_msg("移动文件/文件夹成功"))
+    if not body.name:
+        return json(Resp.err_msg("没有可移动的文件/文件夹"))
+    job = await JobManager.submit(JobKind.MOVE, body.src_dir, body.dst_dir, body.name)
+    return json(Resp.ok(200, {"job_id": job.job_id}, "已提交移动任务"))
 
 
 # 复制文件/文件夹
@@ -273,39 +577,98 @@ async def copy(request: Request, body: CopyAndMoveSchema, token) -> HTTPResponse
 
     files_size = 0
     for n in body.name:
-        p = body.src_dir + n
-        files_size += VFS.getsize(p) if not VFS.isdir(p) else VFS.get_dir_size(p)[0]
+        files_size += await FSExecutor.run(VFS.get_path_size, body.src_dir + n)
 
-    dst_size = files_size + VFS.get_dir_size("/" + storage.mount_name)[0]
+    dst_size = files_size + await Trash.used_space(storage.mount_name)
     if dst_size > storage.capacity:
         return json(Resp.err_msg(f"存储空间容量不足: {hum_convert(storage.capacity)}"))
 
-    for n in body.name:
-        src_path = body.src_dir + n
-        dst_path = body.dst_dir + n
-        if VFS.isdir(src_path):
-            VFS.copydir(src_path, dst_path, True)
-        else:
-            VFS.copy(src_path, dst_path, True)
-    return json(Resp.ok_msg("复制文件/文件夹成功"))
+    if not body.name:
+        return json(Resp.err_msg("没有可复制的文件/文件夹"))
+    job = await JobManager.submit(JobKind.COPY, body.src_dir, body.dst_dir, body.name)
+    return json(Resp.ok(200, {"job_id": job.job_id}, "已提交复制任务"))
 
 
-# 清理空文件夹
-@fs_b.post("/clear_empty_dir")
+# 复制/移动任务列表
+@fs_b.post("/job/list")
 @token_required(allow=[Role.Admin])
-@validate(json=(path_schema, PathSchema))
-async def clear_empty_dir(request: Request, body: PathSchema, token) -> HTTPResponse:
-    sub_fs: SubFS = VFS.opendir(body.path)
-    for s in sub_fs.walk():
-        if not sub_fs.exists(s.path):
-            continue
-        if sub_fs.isempty(s.path):
-            try:
-                sub_fs.removedir(s.path)
-            except Exception as e:
-                continue
+@validate(json=(job_list_schema, JobListSchema))
+async def job_list(request: Request, body: JobListSchema, token) -> HTTPResponse:
+    query = FsJob.filter(status=body.status) if body.status else FsJob.filter()
+    jobs = await query.order_by("-id").values()
+    return fast_json(Resp.ok_data([JobManager.view(j) for j in jobs]))
+
+
+# 复制/移动任务详情
+@fs_b.post("/job/info")
+@token_required(allow=[Role.Admin])
+@validate(json=(job_id_schema, JobIDSchema))
+async def job_info(request: Request, body: JobIDSchema, token) -> HTTPResponse:
+    job = await FsJob.get_or_none(job_id=body.job_id).values()
+    if not job:
+        return json(Resp.err_msg(f"任务不存在: {body.job_id}"))
+    return fast_json(Resp.ok_data(JobManager.view(job)))
+
+
+# 取消复制/移动任务
+@fs_b.post("/job/cancel")
+@token_required(allow=[Role.Admin])
+@validate(json=(job_id_schema, JobIDSchema))
+async def job_cancel(request: Request, body: JobIDSchema, token) -> HTTPResponse:
+    job = await FsJob.get_or_none(job_id=body.job_id)
+    if not job:
+        return json(Resp.err_msg(f"任务不存在: {body.job_id}"))
+    if not await JobManager.cancel(job):
+        return json(Resp.err_msg(f"任务未在运行: {body.job_id}"))
+    return json(Resp.ok_msg(f"取消任务: {body.job_id}"))
+
+
+# 继续已取消或失败的任务
+@fs_b.post("/job/resume")
+@token_required(allow=[Role.Admin])
+@validate(json=(job_id_schema, JobIDSchema))
+async def job_resume(request: Request, body: JobIDSchema, token) -> HTTPResponse:
+    job = await FsJob.get_or_none(job_id=body.job_id)
+    if not job:
+        return json(Resp.err_msg(f"任务不存在: {body.job_id}"))
+    if not await JobManager.resume(job):
+        return json(Resp.err_msg(f"任务无法继续: {body.job_id}"))
+    return json(Resp.ok_msg(f"继续任务: {body.job_id}"))
+
+
+# 删除已结束的任务记录
+@fs_b.post("/job/delete")
+@token_required(allow=[Role.Admin])
+@validate(json=(job_id_schema, JobIDSchema))
+async def job_delete(request: Request, body: JobIDSchema, token) -> HTTPResponse:
+    job = await FsJob.get_or_none(job_id=body.job_id)
+    if job and job.job_id not in JobManager.running:
+        await job.delete()
+        await FsJobReport.filter(job_id=job.job_id).delete()
+    return json(Resp.ok_msg(f"删除任务: {body.job_id}"))
 
-    return json(Resp.ok_msg(f"清理空文件夹成功: {body.path}"))
+
+# 清理任务删除(预览时为将删除)的空文件夹
+@fs_b.post("/job/report")
+@token_required(allow=[Role.Admin])
+@validate(json=(job_id_schema, JobIDSchema))
+async def job_report(request: Request, body: JobIDSchema, token) -> HTTPResponse:
+    report = await FsJobReport.get_or_none(job_id=body.job_id)
+    if not report:
+        return json(Resp.err_msg(f"任务报告不存在: {body.job_id}"))
+    return fast_json(Resp.ok_data(report.paths))
+
+
+# 清理空文件夹, 作为后台任务执行; 路径为存储空间根目录时清理整个存储空间
+@fs_b.post("/clear_empty_dir")
+@token_required(allow=[Role.Admin])
+@validate(json=(clear_empty_dir_schema, ClearEmptyDirSchema))
+async def clear_empty_dir(request: Request, body: ClearEmptyDirSchema, token) -> HTTPResponse:
+    if not VFS.isdir(body.path):
+        return json(Resp.err_msg(f"不是文件夹: {body.path}"))
+    kind = JobKind.CLEAN_DRY_RUN if body.dry_run else JobKind.CLEAN
+    job = await JobManager.submit(kind, body.path, body.path, [])
+    return json(Resp.ok(200, {"job_id": job.job_id}, "已提交清理空文件夹任务"))
 
 
 # 删除文件/文件夹
@@ -313,14 +676,64 @@ async def clear_empty_dir(request: Request, body: PathSchema, token) -> HTTPResp
 @token_required(allow=[Role.Admin])
 @validate(json=(name_list_one_dir_schema, NameListOneDirSchema))
 async def remove(request: Request, body: NameListOneDirSchema, token) -> HTTPResponse:
+    trashed = 0
     for n in body.name:
-        if VFS.isdir(body.src_dir + n):
-            VFS.removetree(body.src_dir + n)
-        else:
-            VFS.remove(body.src_dir + n)
+        # 开启回收站时只做重命名, 无法重命名时直接删除
+        if AppConfig.config.fs.trash and await Trash.move_in(body.src_dir + n):
+            trashed += 1
+            continue
+        await FSExecutor.run(VFS.delete, body.src_dir + n)
+        await MetaIndex.remove(body.src_dir + n)
+    if trashed:
+        return json(Resp.ok_msg(f"已移入回收站: {trashed}个文件/文件夹"))
     return json(Resp.ok_msg("删除文件/文件夹成功"))
 
 
+# 回收站列表
+@fs_b.post("/trash/list")
+@token_required(allow=[Role.Admin])
+@validate(json=(trash_list_schema, TrashListSchema))
+async def trash_list(request: Request, body: TrashListSchema, token) -> HTTPResponse:
+    query = TrashItem.filter(mount_name=body.mount_name) if body.mount_name else TrashItem.filter()
+    items = await query.order_by("-deleted").values()
+    for item in items:
+        item["raw_path"] = f"/{item['mount_name']}{item['path']}"
+    return fast_json(Resp.ok_data(items))
+
+
+# 从回收站还原
+@fs_b.post("/trash/restore")
+@token_required(allow=[Role.Admin])
+@validate(json=(trash_ids_schema, TrashIDsSchema))
+async def trash_restore(request: Request, body: TrashIDsSchema, token) -> HTTPResponse:
+    errors = []
+    for item in await TrashItem.filter(id__in=body.ids, purging=False).order_by("id"):
+        err = await Trash.restore(item)
+        if err:
+            errors.append(err)
+    if errors:
+        return json(Resp.err_msg("; ".join(errors)))
+    return json(Resp.ok_msg("还原文件/文件夹成功"))
+
+
+# 彻底删除回收站中的文件/文件夹
+@fs_b.post("/trash/delete")
+@token_required(allow=[Role.Admin])
+@validate(json=(trash_ids_schema, TrashIDsSchema))
+async def trash_delete(request: Request, body: TrashIDsSchema, token) -> HTTPResponse:
+    await Trash.purge(ids=body.ids)
+    return json(Resp.ok_msg("已提交彻底删除"))
+
+
+# 清空回收站
+@fs_b.post("/trash/empty")
+@token_required(allow=[Role.Admin])
+@validate(json=(trash_list_schema, TrashListSchema))
+async def trash_empty(request: Request, body: TrashListSchema, token) -> HTTPResponse:
+    await Trash.purge(mount_name=body.mount_name)
+    return json(Resp.ok_msg("已提交清空回收站"))
+
+
 # 下载或预览资源
 @fs_b.get("/source")
 @token_required(allow=[Role.Admin])
@@ -329,28 +742,21 @@ async def download(request: Request, query: PathSchema, token):
     skip_files = re.split(r"[,，]", AppConfig.config.fs.skip_files)
     if Path(query.path).name in skip_files:
         return json(Resp.err_msg(f"'{Path(query.path).name}'是受保护文件,跳过下载"))
-    size = VFS.getsize(query.path) if not VFS.isdir(query.path) else VFS.get_dir_size(query.path)[0]
+    size = await FSExecutor.run(VFS.get_path_size, query.path)
     if size > AppConfig.config.fs.max_download_size:
         return json(Resp.err_msg(f"下载资源大小不能超过{hum_convert(AppConfig.config.fs.max_download_size)}"))
     if VFS.getinfo(query.path).is_dir:
-        zip_path = Path("temp").joinpath(
-            shortuuid.uuid(name=f"{query.path}_{str(datetime.now())}") + ".zip"
-        ).absolute()
-        if not zip_path.exists():
-            with ReproducibleZipFile(
-                    zip_path,
-                    "w"
-            ) as zp:
-                prefix = str(query.path[0:-1]).split("/")[-1]
-                for f in VFS.walk.files(query.path):
-                    root_p = VFS.getsyspath(f)
-                    zp.write(filename=root_p, arcname=f.replace(query.path, "/" + prefix + "/"))
-            zp.close()
-        src_path = zip_path
-    else:
-        src_path = VFS.getsyspath(query.path)
+        if AppConfig.config.fs.folder_zip == "deflate":
+            return stream_folder_zip(query.path)
+        return await virtual_folder_zip(request, query.path)
+    src_path = VFS.getsyspath(query.path)
 
     file = await async_os.stat(src_path)
+    validators = file_validators(file)
+    # 文件未变化时返回304, 每次请求仍需重新验证
+    validators["Cache-Control"] = "private, no-cache"
+    if not_modified(request, validators["ETag"], file.st_mtime):
+        return empty(status=304, headers=validators)
     meta = {
         "location": src_path,
         "chunk_size": 1024 * 1024 * 2,
@@ -358,39 +764,70 @@ async def download(request: Request, query: PathSchema, token):
         "headers": {
             "X-File-Length": str(file.st_size),
             "Content-Disposition": f'Attachment; filename="{Path(src_path).name}"',
-            "Content-Type": mimetypes.guess_type(src_path)[0],
+            **validators
         },
-        "_range": None,
-        "del_file": True if VFS.getinfo(query.path).is_dir else False
+        "ranges": request_ranges(request, file.st_size, validators["ETag"], file.st_mtime)
     }
-    range_span: Union[str, None] = request.headers.get("Range")
-    if range_span:
-        stat_ = await stat_async(src_path)
-        _range = ContentRangeHandler(request, stat_)
-        meta["_range"] = _range
-
     return await my_file_stream(**meta)
 
 
+# 下载吞吐统计
+@fs_b.post("/download/metrics")
+@token_required(allow=[Role.Admin])
+async def download_metrics(request: Request, token) -> HTTPResponse:
+    return fast_json(Resp.ok_data(DownloadMetrics.snapshot()))
+
+
 # 搜索文件
 @fs_b.post("/search")
 @token_required(allow=[Role.Admin])
 @validate(json=(search_schema, SearchSchema))
 async def search(request: Request, body: SearchSchema, token):
     rs = []
-    if body.is_dir:
-        data = list(VFS.walk.dirs(body.path, filter_dirs=[body.name]))
+    if body.mode:
+        mode = SearchMode(body.mode)
+    else:
+        mode = SearchMode.Glob if any(c in body.name for c in "*[") else SearchMode.Substring
+    page_size = AppConfig.config.fs.pagination_size
+    result = MetaIndex.search(body.path, body.name, body.is_dir, mode, page_size, (body.page - 1) * page_size)
+    if result is not None:
+        total, rows = result
+        for index, row in rows:
+            raw_path = "/" + index.mount_name + row["path"]
+            rs.append({
+                "name": row["name"],
+                "parent_dir": raw_path[0: len(raw_path) - len(row["name"])],
+                "size": row["size"],
+                "is_dir": bool(row["is_dir"])
+            })
+        return fast_json(Resp.ok_data(Resp.paginate(body.page, total, rs, PaginationMode.Manual.value, paged=True)))
+
+    # 与索引一致: 子串、前缀按字面量匹配且不区分大小写(LIKE), 通配符区分大小写(GLOB)
+    keyword = body.name.lower()
+    if mode == SearchMode.Substring:
+        matches = lambda n: keyword in n.lower()
+    elif mode == SearchMode.Prefix:
+        matches = lambda n: n.lower().startswith(keyword)
     else:
-        data = list(VFS.walk.files(body.path, filter=[body.name]))
-    for p in data:
-        info = VFS.getinfo(p, namespaces=["basic", "details"])
-        rs.append({
-            "name": info.name,
-            "parent_dir": p[0: len(p) - len(info.name)],
-            "size": info.size,
-            "is_dir": info.is_dir
-        })
-    return json(Resp.ok_data(Resp.paginate(body.page, len(rs), rs, PaginationMode.Manual.value)))
+        matches = lambda n: fnmatch.fnmatchcase(n, body.name)
+
+    def walk():
+        for e in VFS.walk_entries(body.path):
+            name = basename(e.path)
+            if e.is_dir != body.is_dir or not matches(name):
+                continue
+            p = join(body.path, e.path[1:])
+            rs.append({
+                "name": name,
+                "parent_dir": p[0: len(p) - len(name)],
+                "size": e.stat.st_size,
+                "is_dir": e.is_dir
+            })
+        # 并行遍历的顺序不固定, 按路径排序保证分页稳定
+        rs.sort(key=lambda r: r["parent_dir"] + r["name"])
+
+    await FSExecutor.run(walk)
+    return fast_json(Resp.ok_data(Resp.paginate(body.page, len(rs), rs, PaginationMode.Manual.value)))
 
 
 # 获取缩略图
@@ -400,6 +837,13 @@ async def thumb_handler(
 ):
     path = Path("data/thumbnail").absolute().joinpath(str(year)).joinpath(str(month)).joinpath(ident)
     if path.exists():
+        # ident由源文件名、创建时间、类型和大小生成, 同一URL的内容不会改变, 可以长期缓存
+        validators = {
+            "ETag": f'"{Path(ident).stem}"',
+            "Cache-Control": "public, max-age=31536000, immutable",
+        }
+        if not_modified(request, validators["ETag"]):
+            return empty(status=304, headers=validators)
         return await file_stream(
             path,
             chunk_size=1024 * 1024 * 2,
@@ -407,6 +851,9 @@ async def thumb_handler(
             headers={
                 "Content-Disposition": f'filename="{ident}"',
                 "Content-Type": mimetypes.guess_type(path)[0],
+                **validators
             },
         )
+    # 缩略图文件已被删除, 清单中的记录随之失效
+    ThumbManifest.discard_url(f"/thumbnail/{year}/{month}/{ident}")
     return empty()
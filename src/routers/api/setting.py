@@ -6,6 +6,12 @@ from src.routers.resp import Resp
 from src.utils.authenticator import token_required
 from src.schemas.setting import update_setting
 from src.schemas.validator import validate
+from src.utils.filesystem.executor import FSExecutor
+from src.utils.filesystem.jobs import JobManager
+from src.utils.filesystem.trash import Trash
+from src.utils.filesystem.upload_registry import UploadRegistry
+from src.utils.filesystem.walker import TreeWalker
+from src.utils.filesystem.watcher import ChangeWatcher
 
 setting_b = Blueprint("Setting", url_prefix="/setting")
 
@@ -20,4 +26,11 @@ async def get_all_setting(request: Request, token):
 @validate(json=(update_setting, None))
 async def edit_setting(request: Request, body: dict, token):
     AppConfig.set_config(body)
+    if AppConfig.config.fs.io_workers != FSExecutor.max_workers:
+        FSExecutor.initialize(AppConfig.config.fs.io_workers)
+        TreeWalker.initialize(AppConfig.config.fs.io_workers)
+    ChangeWatcher.configure(AppConfig.config.fs.watch_mode, AppConfig.config.fs.watch_interval)
+    JobManager.configure(AppConfig.config.fs.job_parallel)
+    Trash.configure(AppConfig.config.fs.trash_retention, AppConfig.config.fs.purge_rate)
+    UploadRegistry.configure(AppConfig.config.fs.upload_flush_interval)
     return json(Resp.ok_msg("更改配置成功"))
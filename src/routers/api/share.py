@@ -1,20 +1,19 @@
 import mimetypes
 from datetime import datetime
 from pathlib import Path
-from typing import Union
 
 import shortuuid
 from sanic import Request, json, Blueprint, response
 from sanic.compat import stat_async
-from sanic.handlers import ContentRangeHandler
 
 from config import AppConfig
 from config import PaginationMode
 from src.model.share import Share, Expired
 from src.model.storage import Storage
 from src.model.user import Role
-from src.routers.api.fs import FInfo
-from src.routers.resp import Resp, file_stream as my_file_stream
+from src.routers.api.fs import FInfo, sort_entries
+from src.routers.resp import Resp, fast_json, file_stream as my_file_stream, file_validators, request_ranges
+from src.routers.resp import not_modified
 from src.schemas.share import list_share_schema, ListShareSchema
 from src.schemas.share import new_share_schema, NewShareSchema
 from src.schemas.share import public_share_schema, PublicShareSchema
@@ -137,14 +136,11 @@ async def view_share(request: Request, body: PublicShareSchema):
                     parent_dir=None,
                     thumbnail=thumb
                 )
-                file_list.append(entry_.model_dump())
+                file_list.append(entry_)
             mount_name = dir_path.split("/")[1]
             storage = await Storage.get(mount_name=mount_name, activated=True)
-            if not storage.reverse:
-                file_list.sort(key=lambda r: (-r["is_dir"], r[storage.order_field]))
-            else:
-                file_list.sort(key=lambda r: (r["is_dir"], r[storage.order_field]), reverse=True)
-            return json(Resp.ok_data(file_list))
+            sort_entries(file_list, storage)
+            return fast_json(Resp.ok_data(file_list))
         else:
             f = VFS.getinfo(dir_path, namespaces=["basic", "details"])
             if AppConfig.config.preview.thumbnail:
@@ -164,7 +160,7 @@ async def view_share(request: Request, body: PublicShareSchema):
                 parent_dir=None,
                 thumbnail=thumb
             )
-            return json(Resp.ok_data([v.model_dump()]))
+            return fast_json(Resp.ok_data([v]))
     else:
         if not VFS.exists(share.path):
             return json(Resp.err_msg("分享不存在"))
@@ -186,7 +182,7 @@ async def view_share(request: Request, body: PublicShareSchema):
             parent_dir=None,
             thumbnail=thumb
         )
-        return json(Resp.ok_data([v.model_dump()]))
+        return fast_json(Resp.ok_data([v]))
 
 
 @share_b.get("/source")
@@ -211,19 +207,21 @@ async def share_download(request: Request, query: PublicShareSchema):
     if VFS.getsize(share_path) > AppConfig.config.fs.max_download_size:
         return json(Resp.err_msg(f"下载文件的大小不能超过{hum_convert(AppConfig.config.fs.max_download_size)}"))
 
+    src_path = VFS.getsyspath(share_path)
+    file = await stat_async(src_path)
+    validators = file_validators(file)
+    validators["Cache-Control"] = "no-cache"
+    if not_modified(request, validators["ETag"], file.st_mtime):
+        return response.empty(status=304, headers=validators)
     meta = {
-        "location": VFS.getsyspath(share_path),
+        "location": src_path,
         "chunk_size": 1024 * 1024 * 2,
         "mime_type": mimetypes.guess_type(share_path)[0],
         "headers": {
             "Content-Disposition": f'Attachment; filename="{Path(share_path).name}"',
             "X-File-Type": mimetypes.guess_type(share_path)[0],
+            **validators
         },
-        "_range": None,
+        "ranges": request_ranges(request, file.st_size, validators["ETag"], file.st_mtime),
     }
-    range_span: Union[str, None] = request.headers.get("Range")
-    if range_span:
-        stat = await stat_async(share_path)
-        _range = ContentRangeHandler(request, stat)
-        meta["_range"] = _range
     return await my_file_stream(**meta)
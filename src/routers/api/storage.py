@@ -6,6 +6,8 @@ from fs.path import forcedir, abspath, normpath
 from sanic import Request, HTTPResponse, json, Blueprint
 
 from src.model.storage import Storage, OrderBy
+from src.model.file_digest import FileDigest
+from src.model.trash import TrashItem
 from src.model.user import Role
 from src.routers.resp import Resp
 from src.schemas.storage import new_storage_schema, NewStorageSchema
@@ -15,7 +17,11 @@ from src.schemas.storage import update_storage_schema, UpdateStorageSchema
 from src.schemas.validator import validate
 from src.utils.authenticator import token_required
 from src.utils.filesystem import VFS
+from src.utils.filesystem.executor import FSExecutor
+from src.utils.filesystem.index import MetaIndex
 from src.utils.filesystem.osfs import OSVFS
+from src.utils.filesystem.trash import Trash
+from src.utils.filesystem.watcher import ChangeWatcher
 
 storage_b = Blueprint("Storage", url_prefix="/storage")
 
@@ -38,7 +44,7 @@ async def create(request: Request, body: NewStorageSchema, token) -> HTTPRespons
 
     root_fs = OSVFS(str(root_path), create=True)
 
-    space_size = root_fs.get_dir_size("/")[0]
+    space_size = (await FSExecutor.run(root_fs.get_dir_size, "/"))[0]
     if space_size > body.capacity:
         return json(Resp.err_msg(f"系统文件夹大小超过存储空间容量: {space_size}>{body.capacity}"))
 
@@ -52,6 +58,9 @@ async def create(request: Request, body: NewStorageSchema, token) -> HTTPRespons
     )
     if r.activated:
         VFS.mount(r.mount_name, root_fs)
+        MetaIndex.mount(r.mount_name, r.root_path)
+        request.app.add_task(MetaIndex.build(r.mount_name))
+        ChangeWatcher.start(r.mount_name, r.root_path)
 
     return json(Resp.ok_msg(f"创建存储空间成功: {body.mount_name}"))
 
@@ -63,8 +72,10 @@ async def get_list(request: Request, token) -> HTTPResponse:
 
     async def calculate_size(s):
         if s['activated']:
-            s["space_size"] = VFS.get_dir_size(s["mount_name"])[0]
+            s["trash_size"] = await Trash.size(s["mount_name"])
+            s["space_size"] = (await FSExecutor.run(VFS.get_dir_size, s["mount_name"]))[0] + s["trash_size"]
         else:
+            s["trash_size"] = 0
             s["space_size"] = 0
         return s
 
@@ -92,7 +103,7 @@ async def update(request: Request, body: UpdateStorageSchema, token) -> HTTPResp
         return json(Resp.err_msg(f"系统文件夹不存在: {root_path}"))
 
     root_fs = OSVFS(str(root_path), create=True)
-    space_size = root_fs.get_dir_size("/")[0]
+    space_size = (await FSExecutor.run(root_fs.get_dir_size, "/"))[0]
     if space_size > body.capacity:
         return json(Resp.err_msg(f"系统文件夹大小超过存储空间容量: {space_size}>{body.capacity}"))
 
@@ -104,11 +115,19 @@ async def update(request: Request, body: UpdateStorageSchema, token) -> HTTPResp
         order_field=body.order_field,
         reverse=body.reverse
     )
+    if storage_.mount_name != body.mount_name:
+        await TrashItem.filter(mount_name=storage_.mount_name).update(mount_name=body.mount_name)
+        await FileDigest.filter(mount_name=storage_.mount_name).update(mount_name=body.mount_name)
 
     if storage_.activated:
         mount_path = forcedir(abspath(normpath(storage_.mount_name)))
         VFS.unmount(mount_path)
         VFS.mount(body.mount_name, root_fs)
+        MetaIndex.unmount(storage_.mount_name, drop=True)
+        MetaIndex.mount(body.mount_name, body.root_path)
+        request.app.add_task(MetaIndex.build(body.mount_name))
+        ChangeWatcher.stop(storage_.mount_name)
+        ChangeWatcher.start(body.mount_name, body.root_path)
 
     return json(Resp.ok_msg("更新存储空间成功"))
 
@@ -132,6 +151,9 @@ async def enable(request: Request, body: StorageIDSchema, token) -> HTTPResponse
         return json(Resp.err_msg("存储空间不存在"))
     await Storage.filter(id=body.id).update(activated=True)
     VFS.mount(storage_.mount_name, OSFS(storage_.root_path, create=True))
+    MetaIndex.mount(storage_.mount_name, storage_.root_path)
+    request.app.add_task(MetaIndex.build(storage_.mount_name))
+    ChangeWatcher.start(storage_.mount_name, storage_.root_path)
     return json(Resp.ok_msg(f"激活存储空间成功: {storage_.mount_name}"))
 
 
@@ -144,6 +166,8 @@ async def disable(request: Request, body: StorageIDSchema, token) -> HTTPRespons
         return json(Resp.err_msg("存储空间不存在"))
     await Storage.filter(id=body.id).update(activated=False)
     VFS.unmount(storage_.mount_name)
+    MetaIndex.unmount(storage_.mount_name)
+    ChangeWatcher.stop(storage_.mount_name)
     return json(Resp.ok_msg(f"关闭存储空间成功: {storage_.mount_name}"))
 
 
@@ -154,5 +178,9 @@ async def delete(request: Request, body: StorageIDSchema, token) -> HTTPResponse
     storage_ = await Storage.get_or_none(id=body.id)
     if storage_:
         VFS.unmount(storage_.mount_name)
+        MetaIndex.unmount(storage_.mount_name, drop=True)
+        ChangeWatcher.stop(storage_.mount_name)
+        await TrashItem.filter(mount_name=storage_.mount_name).delete()
+        await FileDigest.filter(mount_name=storage_.mount_name).delete()
         await storage_.delete()
     return json(Resp.ok_msg(f"删除存储空间成功: {storage_.mount_name}"))
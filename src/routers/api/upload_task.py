@@ -1,14 +1,15 @@
+import os
 from typing import Optional
 
 from sanic import Blueprint, Request, HTTPResponse, json
 
 from config import AppConfig
-from fs.path import forcedir, abspath, normpath
+from fs.path import forcedir, abspath, normpath, iteratepath
 from fs.subfs import SubFS
 from src.model.storage import Storage
 from src.model.upload_task import UploadTask, UploadStatus, UploadMode, ChunkInfo
 from src.model.user import Role
-from src.routers.resp import Resp
+from src.routers.resp import Resp, fast_json
 from src.routers.tools import cancel_task
 from src.schemas.upload_task import clear_task_schema, ClearTaskSchema
 from src.schemas.upload_task import generate_session_id
@@ -17,14 +18,42 @@ from src.schemas.upload_task import upload_task_id_schema, UploadTaskIDSchema
 # 数据校验
 from src.schemas.validator import validate
 from src.utils.authenticator import token_required
-from src.utils.cache_store import MemCache
 from src.utils.filesystem import VFS
 from src.utils.filesystem import hum_convert
+from src.utils.filesystem.chunked import preallocate, ChunkLocks
+from src.utils.filesystem.digest import DigestStore, ChunkHashers, StreamDigest, default_algos, parse_digest_header
+from src.utils.filesystem.executor import FSExecutor
+from src.utils.filesystem.index import MetaIndex, in_trash
+from src.utils.filesystem.trash import Trash
+from src.utils.filesystem.upload_registry import UploadRegistry
+from src.utils.filesystem.upload_sink import UploadSink, UploadSignals
 from src.utils.thumbnail import set_thumbnail
 
 upload_task_b = Blueprint('UploadTaskB', url_prefix='/upload_task')
 
 
+def task_uploaded(task: dict) -> int:
+    """已上传字节数: 分片任务的文件已预分配, 按位图统计; 流式任务取文件大小"""
+    if task['mode'] == UploadMode.CHUNK.value and task['chunk_info']:
+        return ChunkInfo(**task['chunk_info']).uploaded(task['size'])
+    path = forcedir(task['path']) + task['name']
+    return VFS.getsize(path) if VFS.exists(path) else 0
+
+
+async def discard_upload(task: dict, sub_fs: SubFS):
+    """任务被取消: 删除已上传的文件和任务记录"""
+    try:
+        if sub_fs.exists(task['name']):
+            sub_fs.remove(task['name'])
+    except:
+        pass
+    await UploadTask.filter(session_id=task['session_id']).delete()
+    await MetaIndex.remove(forcedir(task['path']) + task['name'])
+    UploadRegistry.remove(task['session_id'])
+    ChunkLocks.discard(task['session_id'])
+    ChunkHashers.discard(task['session_id'])
+
+
 # 创建上传任务
 @upload_task_b.post("/create")
 @token_required(allow=[Role.Admin])
@@ -38,23 +67,20 @@ async def upload_task(request: Request, body: NewUploadTaskSchema, token) -> HTT
     storage = await Storage().get_or_none(mount_name=mount_name, activated=True)
     if not storage:
         return json(Resp.err(52001, None, "存储空间不存在"))
-    if (int(body.size) + VFS.get_dir_size(body.path)[0]) > storage.capacity:
+    if (int(body.size) + await Trash.used_space(mount_name)) > storage.capacity:
         return json(Resp.err(52001, None, "存储空间容量不足"))
 
     session_id = str(generate_session_id(body))
-    task: Optional[dict] = await UploadTask.get_or_none(session_id=session_id).values()
+    task: Optional[dict] = await UploadRegistry.get(session_id)
 
     if task:
-        sub_fs: SubFS = VFS.opendir(task['path'])
-        if not sub_fs.exists(task['name']):
-            uploaded = 0
-        else:
-            uploaded = sub_fs.getsize(task['name'])
-        task['uploaded'] = uploaded
-        return json(Resp.ok_data(task))
+        task['uploaded'] = task_uploaded(task)
+        return fast_json(Resp.ok_data(task))
     else:
         web_path = forcedir(abspath(normpath(body.web_path)))[:-1]
         name_ = abspath(normpath(body.name))
+        if in_trash(forcedir(body.path) + web_path[1:]):
+            return json(Resp.err_msg(f"无法上传到回收站: {body.path}"))
         sub_fs: SubFS = VFS.opendir(body.path)
         create_folder = True if web_path != name_ else False
         if create_folder:
@@ -62,7 +88,13 @@ async def upload_task(request: Request, body: NewUploadTaskSchema, token) -> HTT
                 return json(Resp.err_msg(f"上传文件源路径'{web_path}'与名称'{body.name}'不匹配"))
             parent_dir = web_path[:-len(body.name)]
             if not sub_fs.exists(parent_dir):
+                new_dir = "/"
+                for p in iteratepath(parent_dir):
+                    new_dir = forcedir(new_dir) + p
+                    if not sub_fs.exists(new_dir):
+                        break
                 sub_fs.makedirs(parent_dir)
+                await MetaIndex.refresh(forcedir(body.path) + new_dir[1:])
             sub_fs = sub_fs.opendir(parent_dir)
             body.path = forcedir(normpath(body.path + parent_dir))
         else:
@@ -80,13 +112,32 @@ async def upload_task(request: Request, body: NewUploadTaskSchema, token) -> HTT
                     chunk_total += int(body.size / chunk_size) + 1
                 else:
                     chunk_total += int(body.size / chunk_size)
-            chunk_info = ChunkInfo(chunk_size=chunk_size, chunk_total=chunk_total, chunk_cur=0).model_dump()
+            chunk_info = ChunkInfo.new(chunk_size, chunk_total).model_dump()
         else:
             return json(Resp.err_msg(f"不正确的上传模式: ${body.mode}"))
 
         result = sub_fs.create(name_, wipe=body.wipe)
         if not result:
             return json(Resp.err_msg(f"该路径已存在同名文件: {body.name}"))
+        status = UploadStatus.UPLOADING
+        # 秒传: 已有相同内容的文件时直接在服务端生成, 不再接收数据
+        source = None
+        if body.sha256 and body.sample is not None and AppConfig.config.fs.instant_upload:
+            source = await DigestStore.find(body.sha256, body.size, body.sample)
+        if source:
+            await DigestStore.materialize(source, sub_fs.getsyspath(name_), AppConfig.config.fs.dedup_hardlink)
+            await DigestStore.record(body.path + body.name, body.sha256)
+            status = UploadStatus.SUCCESS
+            if chunk_info:
+                info = ChunkInfo(**chunk_info)
+                info.fill()
+                chunk_info = info.model_dump()
+            if AppConfig.config.preview.thumbnail:
+                request.app.add_task(set_thumbnail(sub_fs.getsyspath(name_)))
+        elif chunk_info:
+            # 分片按偏移写入, 先分配好整个文件
+            await FSExecutor.run(preallocate, sub_fs.getsyspath(name_), body.size)
+        await MetaIndex.refresh(body.path + body.name)
 
         await UploadTask.create(
             session_id=session_id,
@@ -96,21 +147,22 @@ async def upload_task(request: Request, body: NewUploadTaskSchema, token) -> HTT
             size=body.size,
             mime_type=body.mime_type,
             modified=body.modified,
-            status=UploadStatus.UPLOADING,
+            status=status,
             mode=body.mode,
             wipe=body.wipe,
             chunk_info=chunk_info
         )
-        task_ = await UploadTask.get(session_id=session_id).values()
-        task_['uploaded'] = 0
-        return json(Resp.ok_data(task_))
+        task_ = await UploadRegistry.get(session_id)
+        task_['uploaded'] = body.size if source else 0
+        task_['instant'] = bool(source)
+        return fast_json(Resp.ok_data(task_))
 
 
 # 流式上传文件
 @upload_task_b.post("/stream/<session_id:str>/", stream=True)
 @token_required(allow=[Role.Admin])
 async def upload_task_stream(request, session_id: str, token) -> HTTPResponse:
-    task = await UploadTask.get_or_none(session_id=session_id).values()
+    task = await UploadRegistry.get(session_id)
     if not task:
         return json(Resp.err(52001, None, f"上传任务不存在: {session_id}"))
     if task['mode'] != UploadMode.STREAM.value:
@@ -120,120 +172,197 @@ async def upload_task_stream(request, session_id: str, token) -> HTTPResponse:
     # 失败可以重试
     if task['status'] == UploadStatus.FAILED:
         task['status'] = UploadStatus.UPLOADING
-        await UploadTask.filter(session_id=session_id).update(status=UploadStatus.UPLOADING)
+        await UploadRegistry.update(session_id, UploadStatus.UPLOADING)
 
     if task['status'] != UploadStatus.UPLOADING:
         task['uploaded'] = sub_fs.getsize(task['name'])
-        return json(Resp.ok_data(task))
+        return fast_json(Resp.ok_data(task))
+
+    # 客户端可在请求头 X-Content-Digest 中提供整个文件的摘要, 如 "xxh3=<hex>, sha256=<hex>"
+    try:
+        expected_digest = parse_digest_header(request.headers.get("x-content-digest"))
+    except ValueError as e:
+        return json(Resp.err(52001, None, str(e)))
+    digest = StreamDigest(set(default_algos(AppConfig.config.fs.upload_sha256)) | set(expected_digest))
+    mismatch = []
 
-    # 记录任务
-    record_task = await MemCache.get_data(f"upload_{session_id}")
-    if record_task is None:
-        await MemCache.set_data(f"upload_{session_id}", task['id'])
+    # 取消信号, 删除任务时触发
+    cancelled = UploadSignals.acquire(session_id)
+    sink = None
     try:
+        # 客户端续传时从头重新发送, 跳过已写入的部分, 摘要仍按完整内容计算
+        real_size = sub_fs.getsize(task['name'])
+        sink = UploadSink(sub_fs.getsyspath(task['name']), real_size, write_behind=AppConfig.config.fs.write_behind)
         read_size = 0
         while True:
             body = await request.stream.read()
-            record_task = await MemCache.get_data(f"upload_{session_id}")
-            if record_task is None:
-                try:
-                    if sub_fs.exists(task['name']):
-                        sub_fs.remove(task['name'])
-                except:
-                    pass
-                await UploadTask.filter(session_id=session_id).delete()
+            if cancelled.is_set():
+                await sink.close(discard=True)
+                await discard_upload(task, sub_fs)
                 return json(Resp.err(52001, None, f"任务已取消"))
             if body is None:
                 break
+            digest.update(body)
             read_size += len(body)
-            real_size = sub_fs.getsize(task['name'])
             if read_size > real_size:
                 sub_size = read_size - real_size
                 if sub_size < len(body):
                     body = body[len(body) - sub_size:]
-                sub_fs.appendbytes(task['name'], body)
-            else:
-                continue
+                await sink.write(body)
+        await sink.close()
+        mismatch = digest.mismatch(expected_digest)
+        if mismatch:
+            # 内容与客户端不一致, 清空文件, 重试时重新写入
+            await FSExecutor.run(os.truncate, sub_fs.getsyspath(task['name']), 0)
+            task['status'] = UploadStatus.FAILED
+        else:
+            task['status'] = UploadStatus.SUCCESS
+            task['digests'] = digest.hexdigests()
+            # 创建缩略图
+            if AppConfig.config.preview.thumbnail:
+                request.app.add_task(set_thumbnail(sub_fs.getsyspath(task['name'])))
+            # 记录内容摘要, 供秒传和完整性检查使用
+            request.app.add_task(DigestStore.record_digests(
+                forcedir(task['path']) + task['name'], task['digests'], AppConfig.config.fs.instant_upload
+            ))
+    except Exception as e:
+        task['status'] = UploadStatus.FAILED
+    finally:
+        if sink is not None:
+            await sink.close(discard=True)
+        UploadSignals.release(session_id)
+    await UploadRegistry.update(session_id, task['status'])
+    await MetaIndex.refresh(forcedir(task['path']) + task['name'])
+    task['uploaded'] = sub_fs.getsize(task['name'])
+    if mismatch:
+        return json(Resp.err(52001, None, f"文件校验失败: {', '.join(mismatch)}"))
+    return fast_json(Resp.ok_data(task))
+
+
+async def finish_chunks(request, session_id: str, task: dict, sub_fs: SubFS):
+    """在分片锁内调用: 推进整个文件的摘要, 位图已满时完成任务.
+    是否完成只看位图, 其它分片失败留下的FAILED状态不影响"""
+    chunk_info = UploadRegistry.chunk_info(session_id)
+    digests = await ChunkHashers.catch_up(
+        session_id, sub_fs.getsyspath(task['name']), chunk_info.is_done, chunk_info.chunk_size, task['size']
+    )
+    task['chunk_info'] = chunk_info.model_dump()
+    if chunk_info.complete and task['status'] != UploadStatus.SUCCESS:
         task['status'] = UploadStatus.SUCCESS
-        await MemCache.del_data(f"upload_{session_id}")
+        task['digests'] = digests or {}
+        ChunkLocks.discard(session_id)
+        ChunkHashers.discard(session_id)
         # 创建缩略图
         if AppConfig.config.preview.thumbnail:
             request.app.add_task(set_thumbnail(sub_fs.getsyspath(task['name'])))
-    except Exception as e:
-        task['status'] = UploadStatus.FAILED
-    await UploadTask.filter(session_id=session_id).update(status=task['status'])
-    task['uploaded'] = sub_fs.getsize(task['name'])
-    return json(Resp.ok_data(task))
+        # 记录内容摘要, 供秒传和完整性检查使用
+        request.app.add_task(DigestStore.record_digests(
+            forcedir(task['path']) + task['name'], task['digests'], AppConfig.config.fs.instant_upload
+        ))
+    # 分片标记按周期写入数据库, 任务完成时立即写入
+    UploadRegistry.touch(session_id)
+    await UploadRegistry.update(session_id, task['status'])
 
 
-# 分片上传文件
+# 分片上传文件: 缺少的分片可以乱序并发上传, 各自按偏移写入
 @upload_task_b.post("/chunk/<session_id:str>/<chunk_cur:int>", stream=True)
 @token_required(allow=[Role.Admin])
 async def upload_task_chunk(request, session_id: str, chunk_cur: int, token) -> HTTPResponse:
-    task = await UploadTask.get_or_none(session_id=session_id).values()
+    task = await UploadRegistry.get(session_id)
     if not task:
         return json(Resp.err(52001, None, f"上传任务不存在: {session_id}"))
     if task['mode'] != UploadMode.CHUNK.value:
         return json(Resp.err(52001, None, f"上传模式不匹配,请删除任务后重新上传"))
-    chunk_info = ChunkInfo(**task['chunk_info'])
-    if chunk_cur != chunk_info.chunk_cur:
-        return json(Resp.err(52001, None, f"分片序号不匹配: {chunk_cur} != {chunk_info.chunk_cur}"))
-    if chunk_cur >= chunk_info.chunk_total:
-        return json(Resp.ok_data(task))
+    chunk_info = UploadRegistry.chunk_info(session_id) or ChunkInfo(**task['chunk_info'])
+    if chunk_cur < 0 or chunk_cur >= chunk_info.chunk_total:
+        return json(Resp.err(52001, None, f"分片序号超出范围: {chunk_cur}"))
 
     sub_fs: SubFS = VFS.opendir(task['path'])
 
     # 失败可以重试
     if task['status'] == UploadStatus.FAILED:
         task['status'] = UploadStatus.UPLOADING
-        await UploadTask.filter(session_id=session_id).update(status=UploadStatus.UPLOADING)
+        await UploadRegistry.update(session_id, UploadStatus.UPLOADING)
 
-    if task['status'] != UploadStatus.UPLOADING:
-        task['uploaded'] = sub_fs.getsize(task['name'])
-        return json(Resp.ok_data(task))
+    if task['status'] == UploadStatus.UPLOADING and chunk_info.complete:
+        # 位图已满但任务未完成(最后一个分片完成时任务恰好被其它分片标记为失败), 重试时补做完成处理
+        async with ChunkLocks.get(session_id):
+            current = UploadRegistry.view(session_id)
+            if current and current['status'] != UploadStatus.SUCCESS:
+                task['status'] = current['status']
+                await finish_chunks(request, session_id, task, sub_fs)
+        if task['status'] == UploadStatus.SUCCESS:
+            await MetaIndex.refresh(forcedir(task['path']) + task['name'])
+
+    if task['status'] != UploadStatus.UPLOADING or chunk_info.is_done(chunk_cur):
+        task['uploaded'] = chunk_info.uploaded(task['size'])
+        return fast_json(Resp.ok_data(task))
 
-    # 记录任务
-    record_task = await MemCache.get_data(f"upload_{session_id}")
-    if record_task is None:
-        await MemCache.set_data(f"upload_{session_id}", task['id'])
+    # 客户端可在请求头 X-Chunk-Digest 中提供分片的摘要, 如 "xxh3=<hex>, sha256=<hex>"
+    try:
+        expected_digest = parse_digest_header(request.headers.get("x-chunk-digest"))
+    except ValueError as e:
+        return json(Resp.err(52001, None, str(e)))
+    algos = default_algos(AppConfig.config.fs.upload_sha256)
+    chunk_digest = StreamDigest(set(algos) | set(expected_digest))
+    # 正好轮到该分片时, 接收的同时推进整个文件的摘要
+    file_digest = ChunkHashers.fork(session_id, chunk_cur, algos)
 
+    # 取消信号, 删除任务时触发
+    cancelled = UploadSignals.acquire(session_id)
+    offset = chunk_cur * chunk_info.chunk_size
+    expected = min(chunk_info.chunk_size, task['size'] - offset)
+    received = 0
+    sink = None
     try:
-        read_size = chunk_info.chunk_cur * chunk_info.chunk_size
+        sink = UploadSink(sub_fs.getsyspath(task['name']), offset, write_behind=AppConfig.config.fs.write_behind)
         while True:
             body = await request.stream.read()
-            record_task = await MemCache.get_data(f"upload_{session_id}")
-            if record_task is None:
-                try:
-                    if sub_fs.exists(task['name']):
-                        sub_fs.remove(task['name'])
-                except:
-                    pass
-                await UploadTask.filter(session_id=session_id).delete()
+            if cancelled.is_set():
+                await sink.close(discard=True)
+                await discard_upload(task, sub_fs)
                 return json(Resp.err(52001, None, f"任务已取消"))
             if body is None:
                 break
-            read_size += len(body)
-            real_size = sub_fs.getsize(task['name'])
-            if read_size > real_size:
-                sub_size = read_size - real_size
-                if sub_size < len(body):
-                    body = body[len(body) - sub_size:]
-                sub_fs.appendbytes(task['name'], body)
-            else:
-                continue
-        chunk_info.chunk_cur += 1
-        task['chunk_info'] = chunk_info.model_dump()
-        if chunk_info.chunk_cur == chunk_info.chunk_total:
-            task['status'] = UploadStatus.SUCCESS
-            await MemCache.del_data(f"upload_{session_id}")
-            # 创建缩略图
-            if AppConfig.config.preview.thumbnail:
-                request.app.add_task(set_thumbnail(sub_fs.getsyspath(task['name'])))
+            # 超出分片长度的数据丢弃
+            body = body[:expected - received]
+            if body:
+                chunk_digest.update(body)
+                if file_digest is not None:
+                    file_digest.update(body)
+                await sink.write(body)
+                received += len(body)
+        await sink.close()
     except Exception as e:
         task['status'] = UploadStatus.FAILED
-    await UploadTask.filter(session_id=session_id).update(status=task['status'], chunk_info=task["chunk_info"])
-    task['uploaded'] = sub_fs.getsize(task['name'])
-    return json(Resp.ok_data(task))
+        await UploadRegistry.update(session_id, task['status'])
+        task['uploaded'] = chunk_info.uploaded(task['size'])
+        return fast_json(Resp.ok_data(task))
+    finally:
+        if sink is not None:
+            await sink.close(discard=True)
+        UploadSignals.release(session_id)
+    if received < expected:
+        return json(Resp.err(52001, None, f"分片数据不完整: {received} < {expected}"))
+    mismatch = chunk_digest.mismatch(expected_digest)
+    if mismatch:
+        return json(Resp.err(52001, None, f"分片{chunk_cur}校验失败: {', '.join(mismatch)}"))
+
+    # 其它分片可能同时完成, 在锁内读取最新状态再标记
+    async with ChunkLocks.get(session_id):
+        current = UploadRegistry.view(session_id)
+        if not current:
+            return json(Resp.err(52001, None, f"任务已取消"))
+        chunk_info = UploadRegistry.chunk_info(session_id)
+        chunk_info.mark(chunk_cur)
+        chunk_info.digests[str(chunk_cur)] = chunk_digest.hexdigests()
+        ChunkHashers.commit(session_id, chunk_cur, file_digest)
+        task['status'] = current['status']
+        await finish_chunks(request, session_id, task, sub_fs)
+    if task['status'] != UploadStatus.UPLOADING:
+        await MetaIndex.refresh(forcedir(task['path']) + task['name'])
+    task['uploaded'] = chunk_info.uploaded(task['size'])
+    return fast_json(Resp.ok_data(task))
 
 
 # 获取任务列表
@@ -243,12 +372,11 @@ async def upload_task_list(request: Request, token):
     task_list = await UploadTask.filter().all().values()
     data = []
     for t in task_list:
-        if VFS.exists(forcedir(t['path']) + t['name']):
-            t['uploaded'] = VFS.getsize(forcedir(t['path']) + t['name'])
-        else:
-            t['uploaded'] = 0
+        # 进行中的任务以内存中的状态为准
+        t = UploadRegistry.view(t['session_id']) or t
+        t['uploaded'] = task_uploaded(t)
         data.append(t)
-    return json(Resp.ok_data(data))
+    return fast_json(Resp.ok_data(data))
 
 
 # 获取任务信息
@@ -256,11 +384,11 @@ async def upload_task_list(request: Request, token):
 @token_required(allow=[Role.Admin])
 @validate(json=(upload_task_id_schema, UploadTaskIDSchema))
 async def upload_task_info(request: Request, body: UploadTaskIDSchema, token) -> HTTPResponse:
-    task = await UploadTask.get_or_none(session_id=body.session_id).values()
+    task = await UploadRegistry.get(body.session_id)
     if not task:
         return json(Resp.err_msg(f"上传任务不存在: {body.session_id}"))
-    task['uploaded'] = VFS.getsize(task['path'])
-    return json(Resp.ok_data(task))
+    task['uploaded'] = task_uploaded(task)
+    return fast_json(Resp.ok_data(task))
 
 
 # 删除上传任务单
@@ -268,11 +396,13 @@ async def upload_task_info(request: Request, body: UploadTaskIDSchema, token) ->
 @token_required(allow=[Role.Admin])
 @validate(json=(upload_task_id_schema, UploadTaskIDSchema))
 async def delete_tasks(request: Request, body: UploadTaskIDSchema, token) -> HTTPResponse:
+    await UploadRegistry.flush(body.session_id)
     task = await UploadTask.get_or_none(session_id=body.session_id)
     if task:
         if task.status == UploadStatus.UPLOADING:
             await cancel_task(task.session_id)
         await task.delete()
+    UploadRegistry.remove(body.session_id)
     return json(Resp.ok_msg(f"删除任务: {body.session_id}"))
 
 
@@ -281,6 +411,7 @@ async def delete_tasks(request: Request, body: UploadTaskIDSchema, token) -> HTT
 @token_required(allow=[Role.Admin])
 @validate(json=(clear_task_schema, ClearTaskSchema))
 async def clear_task(request: Request, body: ClearTaskSchema, token) -> HTTPResponse:
+    await UploadRegistry.flush()
     tasks = await UploadTask.filter(status=body.status).all()
     if tasks:
         ids = []
@@ -291,6 +422,8 @@ async def clear_task(request: Request, body: ClearTaskSchema, token) -> HTTPResp
                 sub = VFS.opendir(task.path)
                 if sub.exists(task.name):
                     sub.remove(task.name)
+                    await MetaIndex.remove(forcedir(task.path) + task.name)
             ids.append(task.id)
+            UploadRegistry.remove(task.session_id)
         await UploadTask.filter(id__in=ids).delete()
     return json(Resp.ok_msg("清理上传任务成功"))
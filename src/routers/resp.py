@@ -1,18 +1,88 @@
+import asyncio
+import errno
+import hashlib
+import itertools
+import json
+import os as _os
+import time
+from collections import deque
+from email.utils import formatdate, parsedate_to_datetime
+from enum import Enum
 from mimetypes import guess_type
 from os import path
 from pathlib import PurePath
-from typing import TypeVar, Union, Optional, Dict
+from typing import TypeVar, Union, Optional, Dict, Any, Callable, Iterable, Iterator, List, NamedTuple, Tuple
 
 from aiofiles import os
+from sanic import HTTPResponse, Request
 from sanic.compat import open_async
-from sanic.models.protocol_types import Range
+from sanic.exceptions import RequestCancelled, RangeNotSatisfiable
 from sanic.response import ResponseStream
 
 from config import AppConfig
 from config import PaginationMode
+from src.utils.filesystem.executor import FSExecutor, iterate_in_thread
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 T = TypeVar('T')
 
+# 进程标识, 避免重启后内存计数器重复产生相同的ETag
+BOOT_TOKEN = _os.urandom(4).hex()
+
+
+def _default(obj):
+    # 没有orjson时, 把slots记录转换为dict
+    if hasattr(obj, "__slots__"):
+        return {k: getattr(obj, k) for k in obj.__slots__}
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(obj: Any) -> bytes:
+    """序列化为JSON, 优先使用orjson, 可直接编码slots数据类"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def make_etag(*parts) -> str:
+    return '"' + hashlib.sha1(repr((BOOT_TOKEN,) + parts).encode("utf-8")).hexdigest()[:20] + '"'
+
+
+def file_validators(st: _os.stat_result) -> Dict[str, str]:
+    """文件的强ETag与Last-Modified, 由inode、大小和修改时间决定, 重启后保持不变"""
+    return {
+        "ETag": f'"{st.st_ino:x}-{st.st_size:x}-{st.st_mtime_ns:x}"',
+        "Last-Modified": http_date(st.st_mtime)
+    }
+
+
+def not_modified(request: Request, etag: Optional[str], modified: Optional[float] = None) -> bool:
+    """请求头If-None-Match与当前ETag是否一致; 没有If-None-Match时按If-Modified-Since比较修改时间"""
+    value = request.headers.get("if-none-match")
+    if value:
+        if not etag:
+            return False
+        for tag in value.split(","):
+            tag = tag.strip()
+            if tag == "*" or (tag[2:] if tag.startswith("W/") else tag) == etag:
+                return True
+        return False
+    since = request.headers.get("if-modified-since")
+    if modified is None or not since:
+        return False
+    try:
+        return int(modified) <= parsedate_to_datetime(since).timestamp()
+    except (TypeError, ValueError):
+        return False
+
+
+def fast_json(body: Any, status: int = 200, headers: Optional[Dict[str, str]] = None) -> HTTPResponse:
+    return HTTPResponse(dumps(body), status=status, headers=headers, content_type="application/json")
+
 
 class Resp:
 
@@ -41,7 +111,7 @@ class Resp:
         return dict(code=code, data=data, message=message)
 
     @classmethod
-    def paginate(cls, cur, total, data, mode=None) -> dict:
+    def paginate(cls, cur, total, data, mode=None, paged=False) -> dict:
         page_size = AppConfig.config.fs.pagination_size
         total_page = int(total / page_size) if total == page_size else (int(total / page_size) + 1)
 
@@ -63,7 +133,9 @@ class Resp:
                     show_pages.extend(page_list[total_page - column: total_page])
                 pagination_list.extend(show_pages)
             page_start = (cur - 1) * page_size
-            if page_start > len(data):
+            if paged:
+                pass
+            elif page_start > len(data):
                 data = []
             else:
                 page_end = cur * page_size
@@ -77,6 +149,322 @@ class Resp:
             data=data
         )
 
+    @classmethod
+    def cursor_paginate(cls, total, data, next_cursor=None) -> dict:
+        return dict(
+            total=total,
+            next_cursor=next_cursor,
+            data=data
+        )
+
+
+class TransferMethod(str, Enum):
+    SENDFILE = "sendfile"
+    BUFFERED = "buffered"
+
+
+class DownloadRecord:
+    """单次下载的传输记录"""
+    __slots__ = ("id", "name", "client", "method", "offset", "size", "sent", "started", "finished", "error")
+
+    def __init__(self, id_: int, name: str, client: str, offset: int, size: int):
+        self.id = id_
+        self.name = name
+        self.client = client
+        self.method = TransferMethod.BUFFERED
+        self.offset = offset
+        self.size = size
+        self.sent = 0
+        self.started = time.time()
+        self.finished: Optional[float] = None
+        self.error: Optional[str] = None
+
+    @property
+    def throughput(self) -> float:
+        elapsed = (self.finished or time.time()) - self.started
+        return self.sent / elapsed if elapsed > 0 else 0.0
+
+    def view(self) -> dict:
+        return dict(
+            id=self.id, name=self.name, client=self.client, method=self.method.value, offset=self.offset,
+            size=self.size, sent=self.sent, started=self.started, finished=self.finished, error=self.error,
+            throughput=self.throughput
+        )
+
+
+class DownloadMetrics:
+    """下载吞吐统计: 进行中的下载与最近完成的下载"""
+    active: Dict[int, DownloadRecord] = {}
+    recent: deque = deque(maxlen=100)
+    total_bytes: int = 0
+    total_count: int = 0
+    _ids = itertools.count(1)
+
+    @classmethod
+    def begin(cls, name: str, request: Request, offset: int, size: int) -> DownloadRecord:
+        record = DownloadRecord(next(cls._ids), name, request.remote_addr or request.ip, offset, size)
+        cls.active[record.id] = record
+        return record
+
+    @classmethod
+    def end(cls, record: DownloadRecord, error: Optional[BaseException] = None):
+        record.finished = time.time()
+        if error is not None:
+            record.error = type(error).__name__
+        cls.active.pop(record.id, None)
+        cls.recent.append(record)
+        cls.total_bytes += record.sent
+        cls.total_count += 1
+
+    @classmethod
+    def snapshot(cls) -> dict:
+        return dict(
+            active=[r.view() for r in cls.active.values()],
+            recent=[r.view() for r in reversed(cls.recent)],
+            total_bytes=cls.total_bytes,
+            total_count=cls.total_count
+        )
+
+
+# 每次sendfile调用发送的最大字节数, 分段以便更新进度和及时响应断开
+SENDFILE_CHUNK = 16 * 1024 * 1024
+# 绕过Sanic写socket后要同步其内部的剩余字节计数(Http.response_bytes_left, 私有实现).
+# 已核对并测试的版本: sanic==23.12.1(见requirements.txt), 升级Sanic时需重新核对http1.py中
+# http1_response_normal对response_bytes_left的使用; 属性不存在时不使用sendfile, 退回缓冲读取
+
+
+def tracks_response_bytes(http) -> bool:
+    return isinstance(getattr(http, "response_bytes_left", None), int) and hasattr(http, "http1_response_normal")
+
+
+def consume_response_bytes(http, n: int):
+    """告知Sanic已有n字节由sendfile发出, 之后的eof才能正常结束响应"""
+    http.response_bytes_left -= n
+
+
+def can_sendfile(request: Request) -> bool:
+    """明文HTTP/1.1且响应按Content-Length发送时才能绕过Sanic直接写socket"""
+    transport = request.transport
+    http = request.stream
+    if not AppConfig.config.fs.sendfile or not hasattr(_os, "sendfile"):
+        return False
+    if transport is None or transport.is_closing() or transport.get_extra_info("sslcontext") is not None:
+        return False
+    if transport.get_extra_info("socket") is None:
+        return False
+    if not tracks_response_bytes(http):
+        return False
+    return getattr(http, "response_func", None) == getattr(http, "http1_response_normal", False)
+
+
+async def wait_writable(fd: int):
+    loop = asyncio.get_running_loop()
+    fut = loop.create_future()
+    loop.add_writer(fd, lambda: fut.done() or fut.set_result(None))
+    try:
+        await fut
+    finally:
+        loop.remove_writer(fd)
+
+
+async def drain(response: ResponseStream):
+    """等待传输层缓冲区完全写出: 临时把写缓冲水位设为0, 协议在缓冲区非空时暂停写入,
+    再经Sanic的发送流程等待协议恢复可写, 不用轮询"""
+    transport = response.request.transport
+    if not transport.get_write_buffer_size():
+        return
+    low, high = transport.get_write_buffer_limits()
+    transport.set_write_buffer_limits(high=0, low=0)
+    try:
+        await response.write(b"")
+    finally:
+        transport.set_write_buffer_limits(high=high, low=low)
+
+
+async def send_zero_copy(response: ResponseStream, location: str, offset: int, size: int, record: DownloadRecord) -> int:
+    """用os.sendfile把文件内容由内核直接写入socket, 返回已发送的字节数, 失败时余下部分由缓冲读取补齐.
+    uvloop不支持loop.sendfile, 也不允许对传输层占用的fd注册写事件, 因此复制一个fd用于发送和等待可写"""
+    request = response.request
+    http = request.stream
+    transport = request.transport
+    # 响应头可能还在传输层缓冲区中, 等其写完再直接写socket
+    await drain(response)
+    if transport.is_closing():
+        return 0
+    sock_fd = _os.dup(transport.get_extra_info("socket").fileno())
+    sent = 0
+    try:
+        with open(location, "rb") as f:
+            while sent < size:
+                if transport.is_closing():
+                    raise RequestCancelled()
+                try:
+                    # 磁盘读取可能阻塞, 在线程池中调用; socket为非阻塞, 发送缓冲区满时立即返回
+                    n = await FSExecutor.run(
+                        _os.sendfile, sock_fd, f.fileno(), offset + sent, min(SENDFILE_CHUNK, size - sent)
+                    )
+                except BlockingIOError:
+                    await wait_writable(sock_fd)
+                    continue
+                except (BrokenPipeError, ConnectionResetError):
+                    raise RequestCancelled()
+                except OSError as e:
+                    if e.errno in (errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP) and sent == 0:
+                        break
+                    raise
+                if n == 0:
+                    break
+                sent += n
+                record.sent += n
+                record.method = TransferMethod.SENDFILE
+                consume_response_bytes(http, n)
+    finally:
+        _os.close(sock_fd)
+    return sent
+
+
+# 单个请求最多处理的区间数, 超出时忽略Range返回完整内容, 避免大量小区间消耗资源
+MAX_RANGES = 32
+
+
+class ByteRange(NamedTuple):
+    """字节区间, end包含在内"""
+    start: int
+    end: int
+
+    @property
+    def size(self) -> int:
+        return self.end - self.start + 1
+
+
+def parse_range(value: str, total: int) -> Optional[List[ByteRange]]:
+    """解析Range请求头(RFC 7233), 返回排序并合并重叠/相邻区间后的列表.
+    格式错误、非bytes单位或区间过多时返回None(忽略Range), 没有可满足的区间时返回空列表"""
+    unit, _, spec = value.partition("=")
+    if unit.strip().lower() != "bytes" or not spec.strip():
+        return None
+    specs = spec.split(",")
+    if len(specs) > MAX_RANGES:
+        return None
+    ranges = []
+    for item in specs:
+        first, sep, last = item.strip().partition("-")
+        if not sep or not (first or last) or (first and not first.isdigit()) or (last and not last.isdigit()):
+            return None
+        if not first:
+            # 后缀区间: 最后n个字节
+            n = int(last)
+            if n > 0 and total > 0:
+                ranges.append(ByteRange(max(total - n, 0), total - 1))
+            continue
+        start = int(first)
+        if last and int(last) < start:
+            return None
+        if start < total:
+            ranges.append(ByteRange(start, min(int(last), total - 1) if last else total - 1))
+    ranges.sort()
+    merged: List[ByteRange] = []
+    for r in ranges:
+        if merged and r.start <= merged[-1].end + 1:
+            merged[-1] = ByteRange(merged[-1].start, max(merged[-1].end, r.end))
+        else:
+            merged.append(r)
+    return merged
+
+
+def http_date(timestamp: float) -> str:
+    return formatdate(timestamp, usegmt=True)
+
+
+def if_range_matches(request: Request, etag: Optional[str], modified: Optional[float]) -> bool:
+    """If-Range与当前资源一致时才按区间返回: ETag须强匹配, 日期须与Last-Modified完全相同"""
+    value = request.headers.get("if-range")
+    if not value:
+        return True
+    value = value.strip()
+    if value.startswith('"') or value.startswith("W/"):
+        return etag is not None and value == etag
+    if modified is None:
+        return False
+    try:
+        return parsedate_to_datetime(value).timestamp() == int(modified)
+    except (TypeError, ValueError):
+        return False
+
+
+def request_ranges(
+        request: Request, total: int, etag: Optional[str] = None, modified: Optional[float] = None
+) -> Optional[List[ByteRange]]:
+    """按Range和If-Range请求头计算要返回的区间, None表示返回完整内容; 没有可满足的区间时抛出416"""
+    value = request.headers.get("range")
+    if not value or not if_range_matches(request, etag, modified):
+        return None
+    ranges = parse_range(value, total)
+    if ranges is None:
+        return None
+    if not ranges:
+        raise RangeNotSatisfiable("Requested range not satisfiable", headers={"Content-Range": f"bytes */{total}"})
+    return ranges
+
+
+class MultipartRanges:
+    """multipart/byteranges响应体的布局, 各部分的头部与总长度在发送前算出"""
+
+    def __init__(self, ranges: List[ByteRange], total: int, content_type: str):
+        boundary = _os.urandom(12).hex()
+        self.content_type = f"multipart/byteranges; boundary={boundary}"
+        self.parts = [
+            (r, (f"\r\n--{boundary}\r\nContent-Type: {content_type}\r\n"
+                 f"Content-Range: bytes {r.start}-{r.end}/{total}\r\n\r\n").encode("latin-1"))
+            for r in ranges
+        ]
+        self.tail = f"\r\n--{boundary}--\r\n".encode("latin-1")
+        self.length = sum(len(head) + r.size for r, head in self.parts) + len(self.tail)
+
+    def chunks(self, read: Callable[[int, int], Iterable[bytes]]) -> Iterator[bytes]:
+        """read(start, end)按[start, end)读取内容"""
+        for r, head in self.parts:
+            yield head
+            yield from read(r.start, r.end + 1)
+        yield self.tail
+
+
+def apply_ranges(
+        ranges: Optional[List[ByteRange]], total: int, content_type: str, headers: Dict[str, str]
+) -> Tuple[int, str, Optional[MultipartRanges]]:
+    """设置Content-Length/Content-Range, 返回状态码、Content-Type, 多区间时返回multipart布局"""
+    headers["Accept-Ranges"] = "bytes"
+    if not ranges:
+        headers["Content-Length"] = str(total)
+        return 200, content_type, None
+    if len(ranges) == 1:
+        r = ranges[0]
+        headers["Content-Range"] = f"bytes {r.start}-{r.end}/{total}"
+        headers["Content-Length"] = str(r.size)
+        return 206, content_type, None
+    multipart = MultipartRanges(ranges, total, content_type)
+    headers["Content-Length"] = str(multipart.length)
+    return 206, multipart.content_type, multipart
+
+
+async def send_span(response: ResponseStream, location: str, offset: int, size: int, chunk_size: int,
+                    record: DownloadRecord):
+    """发送文件的一段, 能用sendfile时零拷贝, 余下部分缓冲读取"""
+    sent = 0
+    if size and can_sendfile(response.request):
+        sent = await send_zero_copy(response, location, offset, size, record)
+    if sent < size:
+        async with await open_async(location, mode="rb") as f:
+            await f.seek(offset + sent)
+            to_send = size - sent
+            while to_send > 0:
+                content = await f.read(min(to_send, chunk_size))
+                if len(content) < 1:
+                    break
+                to_send -= len(content)
+                record.sent += len(content)
+                await response.write(content)
+
 
 async def file_stream(
         location: Union[str, PurePath],
@@ -85,9 +473,11 @@ async def file_stream(
         mime_type: Optional[str] = None,
         headers: Optional[Dict[str, str]] = None,
         filename: Optional[str] = None,
-        _range: Optional[Range] = None,
+        ranges: Optional[List[ByteRange]] = None,
         del_file: bool = False
 ) -> ResponseStream:
+    """发送文件, 明文连接使用sendfile零拷贝, TLS等其它情况按chunk_size缓冲读取.
+    ranges由request_ranges得到, 一个区间返回206, 多个区间以multipart/byteranges返回"""
     headers = headers or {}
     if filename:
         headers.setdefault(
@@ -95,38 +485,73 @@ async def file_stream(
         )
     filename = filename or path.split(location)[-1]
     mime_type = mime_type or guess_type(filename)[0] or "text/plain"
-    if _range:
-        start = _range.start
-        end = _range.end
-        total = _range.total
-
-        headers["Content-Range"] = f"bytes {start}-{end}/{total}"
-        status = 206
+    total = (await os.stat(location)).st_size
+    status, content_type, multipart = apply_ranges(ranges, total, mime_type, headers)
+    start = ranges[0].start if ranges else 0
+    size = int(headers["Content-Length"])
 
     async def _streaming_fn(response):
-        async with await open_async(location, mode="rb") as f:
-            if _range:
-                await f.seek(_range.start)
-                to_send = _range.size
-                while to_send > 0:
-                    content = await f.read(min((_range.size, chunk_size)))
-                    if len(content) < 1:
-                        break
-                    to_send -= len(content)
-                    await response.write(content)
+        if response.request.method == "HEAD":
+            if del_file:
+                await os.remove(location)
+            return
+        record = DownloadMetrics.begin(filename, response.request, start, size)
+        error = None
+        try:
+            # 先发送响应头
+            await response.write(b"")
+            if multipart is None:
+                await send_span(response, str(location), start, size, chunk_size, record)
             else:
-                while True:
-                    content = await f.read(chunk_size)
-                    if len(content) < 1 or content is None:
-                        break
-                    await response.write(content)
-
-        if del_file:
-            await os.remove(location)
+                for r, head in multipart.parts:
+                    record.sent += len(head)
+                    await response.write(head)
+                    await send_span(response, str(location), r.start, r.size, chunk_size, record)
+                record.sent += len(multipart.tail)
+                await response.write(multipart.tail)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            DownloadMetrics.end(record, error)
+            if del_file:
+                await os.remove(location)
 
     return ResponseStream(
         streaming_fn=_streaming_fn,
         status=status,
         headers=headers,
-        content_type=mime_type,
+        content_type=content_type,
     )
+
+
+def chunk_stream(
+        name: str,
+        factory: Callable[[], Iterable[bytes]],
+        status: int = 200,
+        headers: Optional[Dict[str, str]] = None,
+        content_type: str = "application/octet-stream",
+        offset: int = 0,
+        size: int = 0
+) -> ResponseStream:
+    """在独立线程中迭代阻塞的数据块生成器并逐块发送, 客户端断开时停止生成; 记录下载统计"""
+
+    async def _streaming_fn(response):
+        if response.request.method == "HEAD":
+            return
+        record = DownloadMetrics.begin(name, response.request, offset, size)
+        chunks = iterate_in_thread(factory, batch=1, maxsize=8)
+        error = None
+        try:
+            async for items in chunks:
+                for chunk in items:
+                    record.sent += len(chunk)
+                    await response.write(chunk)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            await chunks.aclose()
+            DownloadMetrics.end(record, error)
+
+    return ResponseStream(streaming_fn=_streaming_fn, status=status, headers=headers, content_type=content_type)
@@ -1,7 +1,6 @@
-from src.utils.cache_store import MemCache
+from src.utils.filesystem.upload_sink import UploadSignals
 
 
 async def cancel_task(session_id):
-    record_task = await MemCache.get_data(f"upload_{session_id}")
-    if record_task is not None:
-        await MemCache.del_data(f"upload_{session_id}")
\ No newline at end of file
+    # 通知进行中的上传请求停止并清理
+    UploadSignals.cancel(session_id)
@@ -4,6 +4,7 @@ from fs.path import forcedir, normpath, abspath
 from voluptuous import All, Strip, Length, Match, Invalid
 
 from src.utils.filesystem import VFS
+from src.utils.filesystem.index import in_trash
 
 def parse(v):
     if isinstance(v, list):
@@ -23,7 +24,7 @@ def validate_name(name: str) -> str:
 
 def regular_path(path: str) -> str:
     path_ = abspath(forcedir(normpath(path)))
-    if not VFS.exists(path):
+    if in_trash(path_) or not VFS.exists(path):
         raise Invalid(f"路径不存在: {path_}")
     if VFS.isfile(path_):
         if path_.endswith("/"):
@@ -1,13 +1,24 @@
-from voluptuous import Schema, All, Required, Object, Range, Strip, Length, Invalid
+from voluptuous import Schema, All, Required, Optional, Object, Range, Strip, Length, Invalid, Any, In
 
+from src.model.fs_job import JobStatus
 from src.utils.filesystem import VFS
+from src.utils.filesystem.index import decode_cursor, SearchMode, in_trash
 from .common import path_rule, name_rule, regular_path, operate_path, parse
 
 
 class ListsSchema:
-    def __init__(self, path: str, page: int):
+    def __init__(self, path: str, page: int, cursor: str = None, limit: int = None):
         self.path = path
         self.page = page
+        self.cursor = cursor
+        self.limit = limit
+
+
+def parse_cursor(cursor: str) -> tuple:
+    try:
+        return decode_cursor(cursor)
+    except ValueError as e:
+        raise Invalid(str(e))
 
 
 lists_schema = Schema(
@@ -18,7 +29,9 @@ lists_schema = Schema(
             Required('page', default=1): All(
                 int,
                 Range(min=1, max=200, msg=r"页码范围为1~200")
-            )
+            ),
+            Optional("cursor"): Any(None, All(str, parse_cursor)),
+            Optional("limit"): Any(None, All(int, Range(min=1, max=1000, msg=r"分页大小范围为1~1000")))
         },
         cls=ListsSchema
     )
@@ -77,6 +90,8 @@ def parse_cm(n: CopyAndMoveSchema):
     names = []
     names_1 = []
     for name_ in n.name:
+        if in_trash(n.src_dir + name_) or in_trash(n.dst_dir + name_):
+            continue
         if VFS.exists(n.src_dir + name_):
             names.append(name_)
         if not VFS.exists(n.dst_dir + name_):
@@ -118,7 +133,7 @@ class NameListOneDirSchema:
 def parse_one_l(n: NameListOneDirSchema):
     names = []
     for name_ in n.name:
-        if VFS.exists(n.src_dir + name_):
+        if VFS.exists(n.src_dir + name_) and not in_trash(n.src_dir + name_):
             names.append(name_)
     n.name = names
     return n
@@ -144,11 +159,12 @@ name_list_one_dir_schema = Schema(
 
 
 class SearchSchema:
-    def __init__(self, path=None, name=None, is_dir=None, page=None):
+    def __init__(self, path=None, name=None, is_dir=None, page=None, mode=None):
         self.path = path
         self.name = name
         self.is_dir = is_dir
         self.page = page
+        self.mode = mode
 
 
 def validate_search_name(name: str) -> str:
@@ -176,8 +192,68 @@ search_schema = Schema(
             Required('page', default=1): All(
                 int,
                 Range(min=1, max=200, msg=r"页码范围为1~200")
-            )
+            ),
+            Optional("mode"): Any(None, In(
+                container=[m.value for m in list(SearchMode)],
+                msg=f"值必须为其中之一: {[m.value for m in list(SearchMode)]}"
+            ))
         },
         cls=SearchSchema
     )
 )
+
+
+class JobIDSchema:
+    def __init__(self, job_id=None):
+        self.job_id = job_id
+
+
+job_id_schema = Schema(Object({
+    Required("job_id"): str
+}, cls=JobIDSchema))
+
+
+class JobListSchema:
+    def __init__(self, status=None):
+        self.status = status
+
+
+job_list_schema = Schema(Object({
+    Optional("status"): Any(None, In([st.value for st in list(JobStatus)])),
+}, cls=JobListSchema))
+
+
+class TrashListSchema:
+    def __init__(self, mount_name=None):
+        self.mount_name = mount_name
+
+
+trash_list_schema = Schema(Object({
+    Optional("mount_name"): Any(None, str),
+}, cls=TrashListSchema))
+
+
+class TrashIDsSchema:
+    def __init__(self, ids=None):
+        self.ids = ids
+
+
+trash_ids_schema = Schema(Object({
+    Required("ids", msg="回收站条目不能为空"): [int]
+}, cls=TrashIDsSchema))
+
+
+class ClearEmptyDirSchema:
+    def __init__(self, path=None, dry_run=False):
+        self.path = path
+        self.dry_run = dry_run
+
+
+clear_empty_dir_schema = Schema(Object({
+    Required("path", msg="路径不能为空"): All(
+        path_rule,
+        regular_path,
+        operate_path
+    ),
+    Optional("dry_run", default=False): bool
+}, cls=ClearEmptyDirSchema))
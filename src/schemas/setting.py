@@ -27,6 +27,21 @@ update_setting = Schema({
         Required("max_download_size"): All(Coerce(int), Range(max=1024 * 1024 * 1024 * 30)),
         Required("max_parallel"): All(Coerce(int), Range(min=1, max=10)),
         Required("chunk_size"): All(Coerce(int), Range(max=1024 * 1024 * 100)),
-        Required("skip_files"): All(str, Match(match))
+        Required("skip_files"): All(str, Match(match)),
+        Optional("io_workers"): All(Coerce(int), Range(min=1, max=64)),
+        Optional("index_rebuild_interval"): All(Coerce(int), Range(min=0, max=86400 * 7)),
+        Optional("watch_mode"): In(["auto", "inotify", "poll", "off"]),
+        Optional("watch_interval"): All(Coerce(int), Range(min=5, max=3600)),
+        Optional("job_parallel"): All(Coerce(int), Range(min=1, max=8)),
+        Optional("trash"): bool,
+        Optional("trash_retention"): All(Coerce(int), Range(min=0, max=3650)),
+        Optional("purge_rate"): All(Coerce(int), Range(min=10, max=100000)),
+        Optional("sendfile"): bool,
+        Optional("folder_zip"): In(["store", "deflate"]),
+        Optional("write_behind"): bool,
+        Optional("instant_upload"): bool,
+        Optional("dedup_hardlink"): bool,
+        Optional("upload_sha256"): bool,
+        Optional("upload_flush_interval"): All(Coerce(int), Range(min=1, max=60))
     }
 })
@@ -1,14 +1,14 @@
 import uuid
 from uuid import uuid3, UUID
 
-from voluptuous import Schema, Object, Required, In, Optional, All
+from voluptuous import Schema, Object, Required, In, Optional, All, Lower, Match, Length
 
 from src.model.upload_task import UploadStatus, UploadMode
 from .common import path_rule, name_rule, regular_path, operate_path
 
 
 class NewUploadTaskSchema:
-    def __init__(self, path, web_path, name, size, modified, mime_type, mode, wipe):
+    def __init__(self, path, web_path, name, size, modified, mime_type, mode, wipe, sha256=None, sample=None):
         self.path = path
         self.web_path = web_path
         self.name = name
@@ -17,6 +17,8 @@ class NewUploadTaskSchema:
         self.mime_type = mime_type
         self.mode = mode
         self.wipe = wipe
+        self.sha256 = sha256
+        self.sample = sample
 
 
 new_upload_task_schema = Schema(Object({
@@ -31,7 +33,10 @@ new_upload_task_schema = Schema(Object({
     Required("modified", "修改日期不能为空"): int,
     Required("mime_type", "文件类型不能为空"): str,
     Required("mode"): In([UploadMode.STREAM.value, UploadMode.CHUNK.value]),
-    Required("wipe"): bool
+    Required("wipe"): bool,
+    # 秒传: 文件的SHA-256与抽样块的SHA-256列表(见 src.utils.filesystem.digest.sample_offsets)
+    Optional("sha256"): All(str, Lower, Match(r"^[0-9a-f]{64}$", msg="sha256格式不正确")),
+    Optional("sample"): All([All(str, Lower, Match(r"^[0-9a-f]{64}$", msg="抽样摘要格式不正确"))], Length(max=64))
 }, cls=NewUploadTaskSchema))
 
 
@@ -0,0 +1,43 @@
+import asyncio
+import os
+from typing import Dict
+
+
+def preallocate(syspath: str, size: int):
+    """为分片上传预分配文件空间, 文件系统不支持时退回到设置文件长度(稀疏文件)"""
+    fd = os.open(syspath, os.O_WRONLY)
+    try:
+        if size > 0 and hasattr(os, "posix_fallocate"):
+            try:
+                os.posix_fallocate(fd, 0, size)
+                return
+            except OSError:
+                pass
+        os.ftruncate(fd, size)
+    finally:
+        os.close(fd)
+
+
+def pwrite_all(fd: int, data: bytes, offset: int):
+    """在offset处写入全部数据, 不改变文件偏移, 多个分片可以并发写同一文件"""
+    view = memoryview(data)
+    while view:
+        n = os.pwrite(fd, view, offset)
+        view = view[n:]
+        offset += n
+
+
+class ChunkLocks:
+    """每个上传任务一把锁, 串行化分片位图的读-改-写"""
+    locks: Dict[str, asyncio.Lock] = {}
+
+    @classmethod
+    def get(cls, session_id: str) -> asyncio.Lock:
+        lock = cls.locks.get(session_id)
+        if lock is None:
+            lock = cls.locks[session_id] = asyncio.Lock()
+        return lock
+
+    @classmethod
+    def discard(cls, session_id: str):
+        cls.locks.pop(session_id, None)
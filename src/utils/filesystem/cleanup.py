@@ -0,0 +1,69 @@
+import os
+from typing import Dict, List, Iterable, Tuple
+
+from fs.errors import FSError
+from fs.path import abspath, dirname, forcedir, join, normpath
+
+from . import VFS
+from .index import MetaIndex
+
+
+def find_empty_dirs(dirs: Iterable[str], counts: Dict[str, int]) -> List[str]:
+    """后序计算可删除的空目录, 由深到浅返回.
+    counts为各目录(以/结尾)的直接子项数; 目录判定为空后, 父目录的子项数减一, 嵌套的空目录树一次算出"""
+    remaining = dict(counts)
+    result = []
+    for d in sorted(dirs, key=lambda p: p.count("/"), reverse=True):
+        if remaining.get(forcedir(d), 0) == 0:
+            result.append(d)
+            parent = forcedir(dirname(d))
+            remaining[parent] = remaining.get(parent, 0) - 1
+    return result
+
+
+def collect(path: str) -> Tuple[List[str], Dict[str, int]]:
+    """path下的目录与子项数(路径相对path), 索引就绪时直接读取索引, 否则遍历一次目录树"""
+    index, index_path = MetaIndex.ready(path)
+    if index:
+        dirs, counts = index.child_counts(index_path)
+        base = len(abspath(normpath(index_path)).rstrip("/"))
+        return [d[base:] for d in dirs], {k[base:]: v for k, v in counts.items()}
+    dirs = []
+    counts: Dict[str, int] = {}
+    for e in VFS.walk_entries(path):
+        parent = forcedir(dirname(e.path))
+        counts[parent] = counts.get(parent, 0) + 1
+        if e.is_dir:
+            dirs.append(e.path)
+    return dirs, counts
+
+
+def clean_empty_dirs(path: str, dry_run: bool, progress) -> List[str]:
+    """删除path下所有空目录(不含path自身), 返回已删除(预览时为将删除)的VFS路径.
+    索引可能滞后, 删除时以rmdir结果为准: 非空目录删除失败直接跳过"""
+    dirs, counts = collect(path)
+    targets = find_empty_dirs(dirs, counts)
+    progress.files_total = len(targets)
+    if dry_run:
+        progress.files_done = len(targets)
+        return [join(path, d[1:]) for d in targets]
+    sys_root = VFS.syspath_or_none(path)
+    removed = []
+    for d in targets:
+        progress.check()
+        try:
+            if sys_root:
+                os.rmdir(os.path.join(sys_root, d[1:]))
+            else:
+                VFS.removedir(join(path, d[1:]))
+        except (OSError, FSError):
+            continue
+        removed.append(join(path, d[1:]))
+        progress.files_done += 1
+    return removed
+
+
+def top_paths(paths: List[str]) -> List[str]:
+    """去掉父目录也在列表中的路径"""
+    found = set(paths)
+    return [p for p in paths if dirname(p) not in found]
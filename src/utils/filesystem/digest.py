@@ -0,0 +1,235 @@
+import hashlib
+import os
+import time
+from typing import List, Optional, Dict, Iterable, Tuple
+
+from fs.path import abspath, normpath
+
+from src.model.file_digest import FileDigest
+from . import VFS
+from .executor import FSExecutor
+from .fastcopy import copy_file, CopyMethod
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+# 抽样校验: 首尾各一块, 中间均匀取块, 每块单独计算SHA-256
+SAMPLE_SIZE = 64 * 1024
+SAMPLE_COUNT = 8
+READ_SIZE = 1024 * 1024
+
+
+def sample_offsets(size: int) -> List[int]:
+    """抽样块的起始位置, 文件不足SAMPLE_COUNT块时按块连续覆盖整个文件"""
+    if size <= SAMPLE_SIZE * SAMPLE_COUNT:
+        return list(range(0, size, SAMPLE_SIZE)) or [0]
+    step = (size - SAMPLE_SIZE) / (SAMPLE_COUNT - 1)
+    return [int(i * step) for i in range(SAMPLE_COUNT)]
+
+
+def sample_hashes(syspath: str, size: int) -> List[str]:
+    fd = os.open(syspath, os.O_RDONLY)
+    try:
+        return [hashlib.sha256(os.pread(fd, SAMPLE_SIZE, offset)).hexdigest() for offset in sample_offsets(size)]
+    finally:
+        os.close(fd)
+
+
+def file_sha256(syspath: str) -> str:
+    h = hashlib.sha256()
+    with open(syspath, "rb", buffering=0) as f:
+        while chunk := f.read(READ_SIZE):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def new_hash(algo: str):
+    if algo == "xxh3":
+        if xxhash is None:
+            raise ValueError("服务端未安装xxhash, 不支持xxh3校验")
+        return xxhash.xxh3_128()
+    if algo == "sha256":
+        return hashlib.sha256()
+    raise ValueError(f"不支持的校验算法: {algo}")
+
+
+def default_algos(sha256: bool) -> List[str]:
+    """上传时计算的摘要: 有xxhash时计算xxh3, sha256为True或没有xxhash时计算SHA-256"""
+    algos = ["xxh3"] if xxhash is not None else []
+    if sha256 or not algos:
+        algos.append("sha256")
+    return algos
+
+
+def parse_digest_header(value: Optional[str]) -> Dict[str, str]:
+    """解析 'xxh3=<hex>, sha256=<hex>' 形式的摘要请求头"""
+    result = {}
+    for item in (value or "").split(","):
+        algo, sep, digest = item.strip().partition("=")
+        if not sep:
+            continue
+        algo = algo.strip().lower()
+        new_hash(algo)
+        result[algo] = digest.strip().lower()
+    return result
+
+
+class StreamDigest:
+    """边接收边计算的多种摘要"""
+
+    def __init__(self, algos: Iterable[str]):
+        self.hashes = {algo: new_hash(algo) for algo in algos}
+
+    def update(self, data: bytes):
+        for h in self.hashes.values():
+            h.update(data)
+
+    def copy(self) -> "StreamDigest":
+        other = StreamDigest(())
+        other.hashes = {algo: h.copy() for algo, h in self.hashes.items()}
+        return other
+
+    def hexdigests(self) -> Dict[str, str]:
+        return {algo: h.hexdigest() for algo, h in self.hashes.items()}
+
+    def mismatch(self, expected: Dict[str, str]) -> List[str]:
+        """与客户端提供的摘要不一致的算法"""
+        digests = self.hexdigests()
+        return [algo for algo, value in expected.items() if digests.get(algo) != value]
+
+
+def read_range_into(digest: StreamDigest, syspath: str, offset: int, size: int):
+    fd = os.open(syspath, os.O_RDONLY)
+    try:
+        end = offset + size
+        while offset < end:
+            data = os.pread(fd, min(READ_SIZE, end - offset), offset)
+            if not data:
+                break
+            digest.update(data)
+            offset += len(data)
+    finally:
+        os.close(fd)
+
+
+class ChunkHashers:
+    """分片上传的整文件摘要: 按分片顺序推进, 正好轮到的分片在接收时直接计算,
+    乱序到达的分片等前面的分片完成后从磁盘(通常仍在页缓存中)补算. 只保存在内存中, 服务重启后改为上传完成后整体计算"""
+    hashers: Dict[str, Tuple[int, StreamDigest]] = {}
+
+    @classmethod
+    def fork(cls, session_id: str, index: int, algos: List[str]) -> Optional[StreamDigest]:
+        """正好轮到index时返回当前摘要的副本, 供接收分片时计算, 分片失败时直接丢弃"""
+        if index == 0 and session_id not in cls.hashers:
+            cls.hashers[session_id] = (0, StreamDigest(algos))
+        state = cls.hashers.get(session_id)
+        if state is None or state[0] != index:
+            return None
+        return state[1].copy()
+
+    @classmethod
+    def commit(cls, session_id: str, index: int, digest: Optional[StreamDigest]):
+        state = cls.hashers.get(session_id)
+        if digest is not None and state is not None and state[0] == index:
+            cls.hashers[session_id] = (index + 1, digest)
+
+    @classmethod
+    async def catch_up(cls, session_id: str, syspath: str, done, chunk_size: int, size: int) -> Optional[Dict[str, str]]:
+        """补算已完成的后续分片, 全部完成时返回整文件摘要; done(i)判断第i个分片是否完成"""
+        state = cls.hashers.get(session_id)
+        if state is None:
+            return None
+        index, digest = state
+        total = max(1, (size + chunk_size - 1) // chunk_size)
+        while index < total and done(index):
+            offset = index * chunk_size
+            await FSExecutor.run(read_range_into, digest, syspath, offset, min(chunk_size, size - offset))
+            index += 1
+        cls.hashers[session_id] = (index, digest)
+        if index < total:
+            return None
+        cls.hashers.pop(session_id, None)
+        return digest.hexdigests()
+
+    @classmethod
+    def discard(cls, session_id: str):
+        cls.hashers.pop(session_id, None)
+
+
+class DigestStore:
+    """文件内容摘要索引, 用于秒传: 客户端提供SHA-256与抽样块摘要, 已有相同内容时直接在服务端生成文件.
+    记录可能因文件被修改、移动而过期, 使用前按大小、修改时间和抽样块重新校验, 过期的记录随即删除"""
+
+    @classmethod
+    def split(cls, vfs_path: str):
+        parts = abspath(normpath(vfs_path)).split("/")
+        return parts[1], abspath("/".join(parts[2:]))
+
+    @classmethod
+    async def record(cls, vfs_path: str, sha256: Optional[str], xxh3: Optional[str] = None):
+        syspath = VFS.syspath_or_none(vfs_path)
+        if not syspath:
+            return
+        st = await FSExecutor.run(os.stat, syspath)
+        mount_name, path = cls.split(vfs_path)
+        await FileDigest.update_or_create(
+            {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": sha256, "xxh3": xxh3, "created": time.time()},
+            mount_name=mount_name, path=path
+        )
+
+    @classmethod
+    async def record_digests(cls, vfs_path: str, digests: Dict[str, str], need_sha256: bool):
+        """记录上传时计算的摘要; 秒传需要SHA-256而上传时没有算出(服务重启等)时, 重新读取文件计算"""
+        if need_sha256 and "sha256" not in digests:
+            await cls.index_file(vfs_path)
+        elif digests:
+            await cls.record(vfs_path, digests.get("sha256"), digests.get("xxh3"))
+
+    @classmethod
+    async def index_file(cls, vfs_path: str):
+        """计算并记录文件摘要, 上传完成后在后台调用"""
+        syspath = VFS.syspath_or_none(vfs_path)
+        if not syspath:
+            return
+        try:
+            sha256 = await FSExecutor.run(file_sha256, syspath)
+        except OSError:
+            return
+        await cls.record(vfs_path, sha256)
+
+    @classmethod
+    async def find(cls, sha256: str, size: int, sample: List[str]) -> Optional[str]:
+        """查找内容相同的文件, 返回其真实路径"""
+        for item in await FileDigest.filter(sha256=sha256, size=size).order_by("-id"):
+            syspath = VFS.syspath_or_none(f"/{item.mount_name}{item.path}")
+            if syspath is None:
+                # 存储空间未挂载, 记录保留
+                continue
+            try:
+                st = await FSExecutor.run(os.stat, syspath)
+                if st.st_size != size or st.st_mtime_ns != item.mtime_ns:
+                    raise FileNotFoundError(syspath)
+                if await FSExecutor.run(sample_hashes, syspath, size) != sample:
+                    continue
+            except OSError:
+                await item.delete()
+                continue
+            return syspath
+        return None
+
+    @classmethod
+    async def materialize(cls, src: str, dst: str, hardlink: bool = False) -> CopyMethod:
+        """用已有文件生成目标文件: 优先reflink/copy_file_range复制; hardlink为True且在同一设备时创建硬链接,
+        两个文件共用同一份数据, 修改其一会影响另一个"""
+
+        def run() -> CopyMethod:
+            if hardlink and os.stat(src).st_dev == os.stat(os.path.dirname(dst)).st_dev:
+                tmp = f"{dst}.{os.getpid()}.link"
+                os.link(src, tmp)
+                os.replace(tmp, dst)
+                return CopyMethod.HARDLINK
+            return copy_file(src, dst)
+
+        return await FSExecutor.run(run)
@@ -0,0 +1,87 @@
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from typing import Optional, Callable, Any, Iterable, AsyncIterator
+
+
+class FSExecutor:
+    """文件系统阻塞操作的专用线程池, 并发数由 fs.io_workers 配置"""
+    pool: Optional[ThreadPoolExecutor] = None
+    semaphore: Optional[asyncio.Semaphore] = None
+    max_workers: int = 8
+
+    @classmethod
+    def initialize(cls, max_workers: int):
+        old = cls.pool
+        cls.max_workers = max_workers
+        cls.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="vfs")
+        cls.semaphore = asyncio.Semaphore(max_workers)
+        if old:
+            old.shutdown(wait=False)
+
+    @classmethod
+    def shutdown(cls):
+        if cls.pool:
+            cls.pool.shutdown(wait=True, cancel_futures=True)
+        cls.pool = None
+        cls.semaphore = None
+
+    @classmethod
+    async def run(cls, func: Callable, *args, **kwargs) -> Any:
+        if cls.pool is None:
+            cls.initialize(cls.max_workers)
+        loop = asyncio.get_running_loop()
+        async with cls.semaphore:
+            return await loop.run_in_executor(cls.pool, functools.partial(func, *args, **kwargs))
+
+
+async def iterate_in_thread(factory: Callable[[], Iterable], batch: int = 256, maxsize: int = 4) -> AsyncIterator[list]:
+    """在独立线程中迭代阻塞的生成器, 经有界队列按批交给事件循环.
+    队列满时生产线程等待(背压), 消费方退出后生产线程随之停止.
+    长时间的遍历不占用 FSExecutor 的有限线程."""
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=maxsize)
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        fut = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+        while True:
+            try:
+                fut.result(timeout=0.5)
+                return True
+            except TimeoutError:
+                if stop.is_set():
+                    fut.cancel()
+                    return False
+
+    def produce():
+        items = []
+        try:
+            for item in factory():
+                if stop.is_set():
+                    return
+                items.append(item)
+                if len(items) >= batch:
+                    if not put(items):
+                        return
+                    items = []
+            if items:
+                put(items)
+        except Exception as e:
+            put(e)
+        finally:
+            if not stop.is_set():
+                put(None)
+
+    threading.Thread(target=produce, name="vfs-iter", daemon=True).start()
+    try:
+        while True:
+            items = await queue.get()
+            if items is None:
+                return
+            if isinstance(items, Exception):
+                raise items
+            yield items
+    finally:
+        stop.set()
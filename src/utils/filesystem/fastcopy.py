@@ -0,0 +1,138 @@
+import errno
+import os
+from enum import Enum
+from typing import Callable, Optional
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# linux/fs.h: _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+CHUNK_SIZE = 64 * 1024 * 1024
+BUFFER_SIZE = 1024 * 1024
+
+# 这些错误表示当前方式不可用, 换下一种方式继续复制
+FALLBACK_ERRNO = {
+    errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.ENOTTY, errno.EBADF, errno.EPERM,
+    getattr(errno, "EOPNOTSUPP", errno.ENOTSUP), errno.ENOTSUP
+}
+
+
+class CopyMethod(str, Enum):
+    REFLINK = "reflink"
+    COPY_FILE_RANGE = "copy_file_range"
+    SENDFILE = "sendfile"
+    BUFFERED = "buffered"
+    # 只用于秒传, 复制任务不会创建硬链接
+    HARDLINK = "hardlink"
+
+
+def _reflink(src_fd: int, dst_fd: int, offset: int, size: int, on_progress: Callable[[int], None]) -> int:
+    # 写时复制克隆, 只能从头克隆整个文件
+    if fcntl is None or offset != 0:
+        raise OSError(errno.ENOTSUP, "reflink unavailable")
+    fcntl.ioctl(dst_fd, FICLONE, src_fd)
+    on_progress(size)
+    return size
+
+
+def _copy_file_range(src_fd: int, dst_fd: int, offset: int, size: int, on_progress: Callable[[int], None]) -> int:
+    if not hasattr(os, "copy_file_range"):
+        raise OSError(errno.ENOSYS, "copy_file_range unavailable")
+    while offset < size:
+        n = os.copy_file_range(src_fd, dst_fd, min(CHUNK_SIZE, size - offset), offset, offset)
+        if n == 0:
+            break
+        offset += n
+        on_progress(n)
+    return offset
+
+
+def _sendfile(src_fd: int, dst_fd: int, offset: int, size: int, on_progress: Callable[[int], None]) -> int:
+    os.lseek(dst_fd, offset, os.SEEK_SET)
+    while offset < size:
+        n = os.sendfile(dst_fd, src_fd, offset, min(CHUNK_SIZE, size - offset))
+        if n == 0:
+            break
+        offset += n
+        on_progress(n)
+    return offset
+
+
+def _buffered(src_fd: int, dst_fd: int, offset: int, size: int, on_progress: Callable[[int], None]) -> int:
+    os.lseek(src_fd, offset, os.SEEK_SET)
+    os.lseek(dst_fd, offset, os.SEEK_SET)
+    buf = bytearray(BUFFER_SIZE)
+    view = memoryview(buf)
+    while True:
+        n = os.readv(src_fd, [buf])
+        if n == 0:
+            break
+        written = 0
+        while written < n:
+            written += os.write(dst_fd, view[written:n])
+        offset += n
+        on_progress(n)
+    return offset
+
+
+METHODS = (
+    (CopyMethod.REFLINK, _reflink),
+    (CopyMethod.COPY_FILE_RANGE, _copy_file_range),
+    (CopyMethod.SENDFILE, _sendfile),
+    (CopyMethod.BUFFERED, _buffered),
+)
+
+
+def fast_copy(src: str, dst: str, on_progress: Optional[Callable[[int], None]] = None) -> CopyMethod:
+    """复制单个文件, 依次尝试 reflink -> copy_file_range -> sendfile -> 缓冲复制, 返回实际使用的方式.
+    reflink只在同一设备上尝试; 某种方式中途失败或提前返回0时从已复制的位置换下一种继续.
+    on_progress在每块完成后调用, 可抛出异常中断复制."""
+    copied = [0]
+
+    def progress(n: int):
+        copied[0] += n
+        if on_progress:
+            on_progress(n)
+
+    src_fd = os.open(src, os.O_RDONLY)
+    try:
+        st = os.fstat(src_fd)
+        dst_fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, st.st_mode & 0o777)
+        try:
+            same_dev = os.fstat(dst_fd).st_dev == st.st_dev
+            offset = 0
+            for method, func in METHODS:
+                if method == CopyMethod.REFLINK and not same_dev:
+                    continue
+                try:
+                    offset = func(src_fd, dst_fd, offset, st.st_size, progress)
+                except OSError as e:
+                    if e.errno not in FALLBACK_ERRNO or method == CopyMethod.BUFFERED:
+                        raise
+                    offset = copied[0]
+                    continue
+                if method != CopyMethod.BUFFERED:
+                    # 部分文件系统(FUSE、procfs、某些NFS/overlay)未复制任何数据也返回0, 换下一种方式继续
+                    if offset < st.st_size:
+                        continue
+                    # 文件在复制过程中变大时, 余下部分用缓冲方式补齐
+                    offset = _buffered(src_fd, dst_fd, offset, st.st_size, progress)
+                # 只有缓冲复制读到真正的文件末尾后才截断
+                os.ftruncate(dst_fd, offset)
+                return method
+        finally:
+            os.close(dst_fd)
+    finally:
+        os.close(src_fd)
+
+
+def copy_file(src: str, dst: str, on_progress: Optional[Callable[[int], None]] = None) -> CopyMethod:
+    """复制文件内容与权限、修改时间, 相当于shutil.copy2"""
+    method = fast_copy(src, dst, on_progress)
+    st = os.stat(src)
+    os.utime(dst, ns=(st.st_atime_ns, st.st_mtime_ns))
+    os.chmod(dst, st.st_mode & 0o7777)
+    return method
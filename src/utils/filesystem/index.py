@@ -0,0 +1,635 @@
+import asyncio
+import base64
+import json
+import mimetypes
+import os
+import re
+import sqlite3
+import stat
+import threading
+from enum import Enum
+from pathlib import Path
+from typing import Dict, Optional, Tuple, List, Iterable
+
+from fs.path import abspath, normpath, forcedir, basename, dirname
+
+from .executor import FSExecutor
+from .walker import TreeWalker
+from .watcher import ChangeEvent
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entry (
+    path TEXT PRIMARY KEY,
+    parent TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    modified REAL NOT NULL,
+    created REAL NOT NULL,
+    is_dir INTEGER NOT NULL,
+    mime TEXT,
+    dev INTEGER NOT NULL,
+    ino INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_entry_parent ON entry(parent, is_dir, name, path);
+CREATE INDEX IF NOT EXISTS idx_entry_parent_size ON entry(parent, is_dir, size, path);
+CREATE INDEX IF NOT EXISTS idx_entry_parent_modified ON entry(parent, is_dir, modified, path);
+CREATE INDEX IF NOT EXISTS idx_entry_parent_created ON entry(parent, is_dir, created, path);
+CREATE INDEX IF NOT EXISTS idx_entry_parent_mime ON entry(parent, is_dir, COALESCE(mime, ''), path);
+CREATE TABLE IF NOT EXISTS dir_size (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    num INTEGER NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS name_fts USING fts5(
+    name, content='entry', content_rowid='rowid', tokenize='trigram'
+);
+CREATE TRIGGER IF NOT EXISTS entry_ai AFTER INSERT ON entry BEGIN
+    INSERT INTO name_fts (rowid, name) VALUES (new.rowid, new.name);
+END;
+CREATE TRIGGER IF NOT EXISTS entry_ad AFTER DELETE ON entry BEGIN
+    INSERT INTO name_fts (name_fts, rowid, name) VALUES ('delete', old.rowid, old.name);
+END;
+CREATE TRIGGER IF NOT EXISTS entry_au AFTER UPDATE ON entry BEGIN
+    INSERT INTO name_fts (name_fts, rowid, name) VALUES ('delete', old.rowid, old.name);
+    INSERT INTO name_fts (rowid, name) VALUES (new.rowid, new.name);
+END;
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+SCHEMA_VERSION = "3"
+
+# 索引表结构变化时需要清除的旧表
+DROP_SCHEMA = """
+DROP TRIGGER IF EXISTS entry_ai;
+DROP TRIGGER IF EXISTS entry_ad;
+DROP TRIGGER IF EXISTS entry_au;
+DROP TABLE IF EXISTS name_fts;
+DROP TABLE IF EXISTS entry;
+DROP TABLE IF EXISTS dir_size;
+DELETE FROM meta;
+"""
+
+COLUMNS = "path, parent, name, size, modified, created, is_dir, mime, dev, ino"
+
+# 排序字段 -> 索引列
+ORDER_COLUMNS = {
+    "name": "name",
+    "size": "size",
+    "modified": "modified",
+    "created": "created",
+    "file_type": "COALESCE(mime, '')",
+}
+
+
+class SearchMode(str, Enum):
+    Glob = "glob"
+    Substring = "substring"
+    Prefix = "prefix"
+
+
+def escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def search_clause(name: str, mode: str) -> Tuple[str, str, bool]:
+    """返回(条件, 参数, 是否使用三元组索引), 少于3个连续字符时三元组索引无法命中"""
+    if mode == SearchMode.Glob:
+        literal = max((len(p) for p in re.split(r"[*?\[\]]", name)), default=0)
+        return "name GLOB ?", name, literal >= 3
+    if mode == SearchMode.Prefix:
+        return "name LIKE ? ESCAPE '\\'", escape_like(name) + "%", len(name) >= 3
+    return "name LIKE ? ESCAPE '\\'", "%" + escape_like(name) + "%", len(name) >= 3
+
+
+def subtree_range(path: str) -> Tuple[str, str]:
+    """路径子树的主键范围: '/a/' <= p < '/a0'"""
+    prefix = forcedir(path)
+    return prefix, prefix[:-1] + chr(ord("/") + 1)
+
+
+def sort_value(row, order_field: str):
+    if order_field == "file_type":
+        return row["mime"] or ""
+    return row[order_field]
+
+
+def encode_cursor(row, order_field: str) -> str:
+    data = json.dumps([row["is_dir"], sort_value(row, order_field), row["path"]], ensure_ascii=False)
+    return base64.urlsafe_b64encode(data.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        is_dir, key, path = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        is_dir = int(is_dir)
+    except (ValueError, TypeError):
+        raise ValueError(f"分页游标无效: {cursor}")
+    # 排序键为名称、类型(字符串)或大小、时间(数字)
+    if is_dir not in (0, 1) or not isinstance(key, (str, int, float)) or isinstance(key, bool) \
+            or not isinstance(path, str):
+        raise ValueError(f"分页游标无效: {cursor}")
+    return is_dir, key, path
+
+
+def page_rows(rows: list, order_field: str, reverse: bool, limit: int, cursor: Optional[tuple] = None) -> list:
+    """与StorageIndex.list_page相同的键集分页, 用于未建立索引的目录"""
+    rows = sorted(rows, key=lambda r: (sort_value(r, order_field), r["path"]), reverse=reverse)
+    rows.sort(key=lambda r: -r["is_dir"])
+    if cursor:
+        c_dir, c_key, c_path = cursor
+
+        def after(r) -> bool:
+            if r["is_dir"] != c_dir:
+                return r["is_dir"] < c_dir
+            key = (sort_value(r, order_field), r["path"])
+            try:
+                return key < (c_key, c_path) if reverse else key > (c_key, c_path)
+            except TypeError:
+                # 游标来自其它排序方式, 与当前排序键无法比较
+                return False
+
+        rows = [r for r in rows if after(r)]
+    return rows[:limit]
+
+
+# 存储空间根目录下的回收站, 不进入索引与列表
+TRASH_DIR = "/.trash"
+
+
+def is_hidden(path: str) -> bool:
+    """path为相对存储空间根目录的路径"""
+    return path == TRASH_DIR or path.startswith(TRASH_DIR + "/")
+
+
+def in_trash(vfs_path: str) -> bool:
+    """VFS路径(/挂载名称/...)是否位于存储空间的回收站中"""
+    parts = abspath(normpath(vfs_path)).split("/")
+    return is_hidden(abspath("/".join(parts[2:])))
+
+
+def scan_dir(syspath: str, path: str) -> List[dict]:
+    """直接读取单层目录, 生成与索引相同结构的行"""
+    rows = []
+    keys = COLUMNS.split(", ")
+    with os.scandir(syspath) as it:
+        for entry in it:
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            child = forcedir(path) + entry.name
+            if is_hidden(child):
+                continue
+            row = StorageIndex.make_row(child, st, stat.S_ISDIR(st.st_mode))
+            rows.append(dict(zip(keys, row)))
+    return rows
+
+
+class StorageIndex:
+    """单个存储空间的元数据索引, 路径均相对于存储根目录"""
+
+    def __init__(self, mount_name: str, root_path: str, db_path: str):
+        self.mount_name = mount_name
+        self.root_path = os.path.abspath(root_path)
+        self.db_path = db_path
+        # 每个实例随机的标识与修改计数, 一起作为列表的校验值
+        self.token = os.urandom(4).hex()
+        self.generation = 0
+        self._building = False
+        self._pending = set()
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA recursive_triggers=ON")
+        self._conn.executescript(SCHEMA)
+        version = self._get_meta("version")
+        if version is not None and version != SCHEMA_VERSION:
+            self._conn.executescript(DROP_SCHEMA)
+            self._conn.executescript(SCHEMA)
+        self.ready = self._get_meta("built") == "1" and self._get_meta("version") == SCHEMA_VERSION
+
+    def close(self):
+        with self._lock:
+            self.ready = False
+            self._conn.close()
+
+    def _get_meta(self, key: str) -> Optional[str]:
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row["value"] if row else None
+
+    def _set_meta(self, key: str, value: str):
+        self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def getsyspath(self, path: str) -> str:
+        return os.path.join(self.root_path, normpath(path).lstrip("/"))
+
+    @staticmethod
+    def make_row(path: str, st: os.stat_result, is_dir: bool) -> tuple:
+        name = basename(path)
+        return (
+            path,
+            forcedir(dirname(path)),
+            name,
+            st.st_size,
+            st.st_mtime,
+            st.st_ctime,
+            int(is_dir),
+            None if is_dir else mimetypes.guess_type(name)[0],
+            st.st_dev,
+            st.st_ino
+        )
+
+    def scan(self, path: str) -> Iterable[tuple]:
+        """遍历目录下所有子项, 生成索引行"""
+        for e in TreeWalker.walk(self.getsyspath(path), path, prune=lambda e_: is_hidden(e_.path)):
+            if is_hidden(e.path):
+                continue
+            # 如果文件无法写入，则设置写入权限
+            if not e.is_dir and not e.stat.st_mode & stat.S_IWUSR:
+                try:
+                    os.chmod(e.syspath, e.stat.st_mode | stat.S_IWUSR)
+                except OSError:
+                    pass
+            yield self.make_row(e.path, e.stat, e.is_dir)
+
+    def _delete(self, path: str):
+        if path == "/":
+            self._conn.execute("DELETE FROM entry")
+            self._conn.execute("DELETE FROM dir_size")
+            return
+        low, high = subtree_range(path)
+        for table in ("entry", "dir_size"):
+            self._conn.execute(f"DELETE FROM {table} WHERE path = ?", (path,))
+            self._conn.execute(f"DELETE FROM {table} WHERE path >= ? AND path < ?", (low, high))
+
+    def _insert(self, rows: Iterable[tuple]):
+        self._conn.executemany(f"INSERT OR REPLACE INTO entry ({COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def _touch(self, path: str):
+        """更新单个目录项(不含子项)"""
+        try:
+            st = os.stat(self.getsyspath(path))
+        except OSError:
+            return
+        if path == "/":
+            self._set_meta("root_mtime", repr(st.st_mtime))
+            return
+        self._insert([self.make_row(path, st, stat.S_ISDIR(st.st_mode))])
+
+    @staticmethod
+    def _rollup(path: str, rows: List[tuple]) -> Dict[str, List[int]]:
+        """汇总path及其子目录的文件大小与数量"""
+        sizes = {path: [0, 0]}
+        for r in rows:
+            if r[6]:
+                sizes.setdefault(r[0], [0, 0])
+        for r in rows:
+            if r[6] or r[0] == path:
+                continue
+            p = r[0]
+            while p != path and p != "/":
+                p = dirname(p)
+                sizes[p][0] += r[3]
+                sizes[p][1] += 1
+        return sizes
+
+    def _subtree_total(self, path: str) -> Tuple[int, int]:
+        row = self._conn.execute("SELECT size, num FROM dir_size WHERE path = ?", (path,)).fetchone()
+        if row:
+            return row["size"], row["num"]
+        row = self._conn.execute("SELECT size, is_dir FROM entry WHERE path = ?", (path,)).fetchone()
+        if row and not row["is_dir"]:
+            return row["size"], 1
+        return 0, 0
+
+    def _apply_delta(self, path: str, size: int, num: int):
+        """将子树大小的变化累加到所有上级目录"""
+        if not size and not num:
+            return
+        p = path
+        while p != "/":
+            p = dirname(p)
+            self._conn.execute("UPDATE dir_size SET size = size + ?, num = num + ? WHERE path = ?", (size, num, p))
+
+    def _write_subtree(self, path: str, rows: List[tuple]):
+        old_size, old_num = self._subtree_total(path)
+        self._delete(path)
+        self._insert(rows)
+        if rows and rows[0][0] == path and not rows[0][6]:
+            new_size, new_num = rows[0][3], 1
+        else:
+            sizes = self._rollup(path, rows)
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO dir_size (path, size, num) VALUES (?, ?, ?)",
+                [(k, v[0], v[1]) for k, v in sizes.items()]
+            )
+            new_size, new_num = sizes[path]
+        self._apply_delta(path, new_size - old_size, new_num - old_num)
+
+    def build(self):
+        with self._lock:
+            self._building = True
+            self._pending.clear()
+        try:
+            rows = list(self.scan("/"))
+            with self._lock, self._conn:
+                self._write_subtree("/", rows)
+                self._touch("/")
+                self._set_meta("built", "1")
+                self._set_meta("version", SCHEMA_VERSION)
+                self.generation += 1
+                self.ready = True
+        finally:
+            with self._lock:
+                self._building = False
+                pending = list(self._pending)
+                self._pending.clear()
+        for p in pending:
+            self.refresh(p)
+
+    def refresh(self, path: str):
+        """按磁盘状态重新同步路径及其子树, 并把大小变化累加到上级目录"""
+        path = abspath(normpath(path))
+        if path == "/":
+            return self.build()
+        if is_hidden(path):
+            return
+        with self._lock:
+            if self._building:
+                self._pending.add(path)
+        try:
+            st = os.stat(self.getsyspath(path))
+        except OSError:
+            return self.remove(path)
+        is_dir = stat.S_ISDIR(st.st_mode)
+        rows = [self.make_row(path, st, is_dir)]
+        if is_dir:
+            rows.extend(self.scan(path))
+        with self._lock, self._conn:
+            self._write_subtree(path, rows)
+            self._touch(dirname(path))
+            self.generation += 1
+
+    def remove(self, path: str):
+        path = abspath(normpath(path))
+        with self._lock:
+            if self._building:
+                self._pending.add(path)
+        with self._lock, self._conn:
+            old_size, old_num = self._subtree_total(path)
+            self._delete(path)
+            self._apply_delta(path, -old_size, -old_num)
+            self._touch(dirname(path))
+            self.generation += 1
+
+    def _dir_mtime(self, path: str) -> Optional[float]:
+        if path == "/":
+            value = self._get_meta("root_mtime")
+            return float(value) if value else None
+        row = self._conn.execute("SELECT modified FROM entry WHERE path = ?", (path,)).fetchone()
+        return row["modified"] if row else None
+
+    def sync_dir(self, path: str):
+        """只比对单层目录, 同步新增/删除/变化的子项"""
+        path = abspath(normpath(path))
+        if is_hidden(path):
+            return
+        try:
+            disk = {r["name"]: r for r in scan_dir(self.getsyspath(path), path)}
+        except OSError:
+            return self.remove(path)
+        indexed = {r["name"]: r for r in self.list_dir(path)}
+        for name in indexed.keys() - disk.keys():
+            self.remove(indexed[name]["path"])
+        for name, r in disk.items():
+            old = indexed.get(name)
+            if old is None or old["is_dir"] != r["is_dir"]:
+                self.refresh(r["path"])
+            elif not r["is_dir"] and (old["size"] != r["size"] or old["modified"] != r["modified"]):
+                self.refresh(r["path"])
+        with self._lock, self._conn:
+            self._touch(path)
+            self.generation += 1
+
+    def dir_size(self, path: str) -> Optional[Tuple[int, int]]:
+        """目录下所有文件的总大小与数量, 目录本身有变化时先同步该层"""
+        path = abspath(normpath(path))
+        with self._lock:
+            mtime = self._dir_mtime(path)
+        try:
+            st = os.stat(self.getsyspath(path))
+        except OSError:
+            return None
+        if mtime is not None and mtime != st.st_mtime:
+            self.sync_dir(path)
+        with self._lock:
+            row = self._conn.execute("SELECT size, num FROM dir_size WHERE path = ?", (path,)).fetchone()
+        return (row["size"], row["num"]) if row else None
+
+    def get(self, path: str) -> Optional[sqlite3.Row]:
+        path = abspath(normpath(path))
+        with self._lock:
+            return self._conn.execute(f"SELECT {COLUMNS} FROM entry WHERE path = ?", (path,)).fetchone()
+
+    def list_dir(self, path: str) -> List[sqlite3.Row]:
+        with self._lock:
+            return self._conn.execute(
+                f"SELECT {COLUMNS} FROM entry WHERE parent = ?", (forcedir(abspath(normpath(path))),)
+            ).fetchall()
+
+    def count_dir(self, path: str, dirs_only: bool = False) -> int:
+        sql = "SELECT COUNT(*) FROM entry WHERE parent = ?"
+        if dirs_only:
+            sql += " AND is_dir = 1"
+        with self._lock:
+            return self._conn.execute(sql, (forcedir(abspath(normpath(path))),)).fetchone()[0]
+
+    def list_page(
+            self, path: str, order_field: str, reverse: bool, limit: int,
+            cursor: Optional[tuple] = None, dirs_only: bool = False
+    ) -> List[sqlite3.Row]:
+        """按(is_dir, 排序字段, path)键集分页, 目录始终在前"""
+        column = ORDER_COLUMNS[order_field]
+        op, direction = ("<", "DESC") if reverse else (">", "ASC")
+        sql = f"SELECT {COLUMNS} FROM entry WHERE parent = ?"
+        args = [forcedir(abspath(normpath(path)))]
+        if dirs_only:
+            sql += " AND is_dir = 1"
+        if cursor:
+            c_dir, c_key, c_path = cursor
+            sql += f" AND (is_dir < ? OR (is_dir = ? AND ({column} {op} ? OR ({column} = ? AND path {op} ?))))"
+            args.extend([c_dir, c_dir, c_key, c_key, c_path])
+        sql += f" ORDER BY is_dir DESC, {column} {direction}, path {direction} LIMIT ?"
+        args.append(limit)
+        with self._lock:
+            return self._conn.execute(sql, args).fetchall()
+
+    def files(self, path: str) -> List[sqlite3.Row]:
+        low, high = subtree_range(abspath(normpath(path)))
+        with self._lock:
+            return self._conn.execute(
+                f"SELECT {COLUMNS} FROM entry WHERE path >= ? AND path < ? AND is_dir = 0 ORDER BY path",
+                (low, high)
+            ).fetchall()
+
+    def child_counts(self, path: str) -> Tuple[List[str], Dict[str, int]]:
+        """子树下的所有目录, 以及每个目录(以/结尾)的直接子项数"""
+        low, high = subtree_range(abspath(normpath(path)))
+        with self._lock:
+            dirs = [r[0] for r in self._conn.execute(
+                "SELECT path FROM entry WHERE path >= ? AND path < ? AND is_dir = 1", (low, high)
+            )]
+            counts = dict(self._conn.execute(
+                "SELECT parent, COUNT(*) FROM entry WHERE path >= ? AND path < ? GROUP BY parent", (low, high)
+            ).fetchall())
+        return dirs, counts
+
+    def iter_files(self, path: str, batch: int = 1000) -> Iterable[sqlite3.Row]:
+        """按路径键集分批读取子树下的文件, 不长时间持有锁"""
+        low, high = subtree_range(abspath(normpath(path)))
+        op = ">="
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    f"SELECT {COLUMNS} FROM entry WHERE path {op} ? AND path < ? AND is_dir = 0 ORDER BY path LIMIT ?",
+                    (low, high, batch)
+                ).fetchall()
+            yield from rows
+            if len(rows) < batch:
+                return
+            low, op = rows[-1]["path"], ">"
+
+    def _search_sql(self, select: str, path: str, name: str, is_dir: bool, mode: str) -> Tuple[str, list]:
+        low, high = subtree_range(abspath(normpath(path)))
+        clause, arg, use_fts = search_clause(name, mode)
+        if use_fts:
+            sql = f"SELECT {select} FROM name_fts f JOIN entry e ON e.rowid = f.rowid WHERE f.{clause}"
+        else:
+            sql = f"SELECT {select} FROM entry e WHERE e.{clause}"
+        sql += " AND e.path >= ? AND e.path < ? AND e.is_dir = ?"
+        return sql, [arg, low, high, int(is_dir)]
+
+    def search_count(self, path: str, name: str, is_dir: bool, mode: str) -> int:
+        sql, args = self._search_sql("COUNT(*)", path, name, is_dir, mode)
+        with self._lock:
+            return self._conn.execute(sql, args).fetchone()[0]
+
+    def search(
+            self, path: str, name: str, is_dir: bool, mode: str = SearchMode.Glob,
+            limit: int = -1, offset: int = 0
+    ) -> List[sqlite3.Row]:
+        select = ", ".join(f"e.{c}" for c in COLUMNS.split(", "))
+        sql, args = self._search_sql(select, path, name, is_dir, mode)
+        sql += " ORDER BY e.path LIMIT ? OFFSET ?"
+        with self._lock:
+            return self._conn.execute(sql, args + [limit, offset]).fetchall()
+
+
+class MetaIndex:
+    """挂载存储空间的元数据索引注册表, 路径均为VFS路径"""
+    indexes: Dict[str, StorageIndex] = {}
+    index_dir: str = "data/index"
+
+    @classmethod
+    def db_path(cls, mount_name: str) -> str:
+        return str(Path(cls.index_dir).joinpath(f"{mount_name}.db").absolute())
+
+    @classmethod
+    def mount(cls, mount_name: str, root_path: str) -> StorageIndex:
+        cls.unmount(mount_name)
+        Path(cls.index_dir).mkdir(parents=True, exist_ok=True)
+        index = StorageIndex(mount_name, root_path, cls.db_path(mount_name))
+        cls.indexes[mount_name] = index
+        return index
+
+    @classmethod
+    def unmount(cls, mount_name: str, drop: bool = False):
+        index = cls.indexes.pop(mount_name, None)
+        if index:
+            index.close()
+        if drop:
+            for suffix in ("", "-wal", "-shm"):
+                Path(cls.db_path(mount_name) + suffix).unlink(missing_ok=True)
+
+    @classmethod
+    def lookup(cls, path: str) -> Tuple[Optional[StorageIndex], str]:
+        parts = abspath(normpath(path)).split("/")
+        if len(parts) < 2 or not parts[1]:
+            return None, "/"
+        return cls.indexes.get(parts[1]), abspath("/".join(parts[2:]))
+
+    @classmethod
+    def ready(cls, path: str) -> Tuple[Optional[StorageIndex], str]:
+        index, path_ = cls.lookup(path)
+        if index and index.ready:
+            return index, path_
+        return None, path_
+
+    @classmethod
+    def search(
+            cls, path: str, name: str, is_dir: bool, mode: str, limit: int, offset: int
+    ) -> Optional[Tuple[int, List[Tuple[StorageIndex, sqlite3.Row]]]]:
+        """在一个或全部存储空间的索引中搜索, 任一索引未就绪时返回None"""
+        if abspath(normpath(path)) == "/":
+            targets = [(cls.indexes[k], "/") for k in sorted(cls.indexes.keys())]
+        else:
+            targets = [cls.lookup(path)]
+        if any(index is None or not index.ready for index, _ in targets):
+            return None
+        total = 0
+        results = []
+        for index, path_ in targets:
+            count = index.search_count(path_, name, is_dir, mode)
+            total += count
+            if offset >= count:
+                offset -= count
+                continue
+            if len(results) < limit:
+                rows = index.search(path_, name, is_dir, mode, limit - len(results), offset)
+                results.extend((index, r) for r in rows)
+            offset = 0
+        return total, results
+
+    @classmethod
+    async def build(cls, mount_name: str):
+        index = cls.indexes.get(mount_name)
+        if index:
+            await FSExecutor.run(index.build)
+
+    @classmethod
+    async def rebuild_forever(cls, interval: int):
+        """定期全量重建索引, 修正应用外部对文件的修改"""
+        while interval > 0:
+            await asyncio.sleep(interval)
+            for mount_name in list(cls.indexes.keys()):
+                await cls.build(mount_name)
+
+    @classmethod
+    async def on_change(cls, event: ChangeEvent):
+        """外部修改: 逐层同步变化的目录, 事件丢失时全量重建"""
+        index = cls.indexes.get(event.mount_name)
+        if index is None:
+            return
+        if event.overflow:
+            return await FSExecutor.run(index.build)
+        for path in sorted(event.paths, key=lambda p: (p.count("/"), p)):
+            await FSExecutor.run(index.sync_dir, path)
+
+    @classmethod
+    async def refresh(cls, *paths: str):
+        for p in paths:
+            index, path_ = cls.lookup(p)
+            if index:
+                await FSExecutor.run(index.refresh, path_)
+
+    @classmethod
+    async def remove(cls, *paths: str):
+        for p in paths:
+            index, path_ = cls.lookup(p)
+            if index:
+                await FSExecutor.run(index.remove, path_)
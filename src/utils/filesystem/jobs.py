@@ -0,0 +1,318 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import AsyncExitStack
+from typing import Dict, Optional, List, Set
+
+import shortuuid
+from fs.path import forcedir, join
+
+from src.model.fs_job import FsJob, FsJobReport, JobKind, JobStatus
+from . import VFS, fastcopy
+from .cleanup import clean_empty_dirs, top_paths
+from .index import MetaIndex
+from .walker import TreeWalker
+
+
+class JobCanceled(Exception):
+    """任务被用户取消"""
+
+
+class JobInterrupted(Exception):
+    """服务停止, 任务保持原状态等待重启后继续"""
+
+
+class JobProgress:
+    """运行中任务的进度, 由复制线程更新, 事件循环定期写入数据库"""
+    __slots__ = (
+        "bytes_total", "bytes_done", "files_total", "files_done", "methods", "report", "started", "cancel", "interrupt"
+    )
+
+    def __init__(self):
+        self.bytes_total = 0
+        self.bytes_done = 0
+        self.files_total = 0
+        self.files_done = 0
+        # 各复制方式处理的文件数
+        self.methods: Dict[str, int] = {}
+        # 清理任务删除(预览时为将删除)的文件夹
+        self.report: List[str] = []
+        self.started = time.monotonic()
+        self.cancel = threading.Event()
+        self.interrupt = threading.Event()
+
+    @property
+    def throughput(self) -> float:
+        elapsed = time.monotonic() - self.started
+        return self.bytes_done / elapsed if elapsed > 0 else 0.0
+
+    def check(self):
+        if self.cancel.is_set():
+            raise JobCanceled()
+        if self.interrupt.is_set():
+            raise JobInterrupted()
+
+
+def copy_file(src: str, dst: str, progress: JobProgress):
+    st = os.stat(src)
+    # 重启后继续: 大小和修改时间一致的文件视为已完成
+    try:
+        dst_st = os.stat(dst)
+        if dst_st.st_size == st.st_size and dst_st.st_mtime_ns == st.st_mtime_ns:
+            progress.bytes_done += st.st_size
+            progress.files_done += 1
+            return
+    except OSError:
+        pass
+
+    def on_progress(n: int):
+        progress.bytes_done += n
+        progress.check()
+
+    progress.check()
+    method = fastcopy.copy_file(src, dst, on_progress)
+    progress.methods[method.value] = progress.methods.get(method.value, 0) + 1
+    progress.files_done += 1
+
+
+def same_device(src: str, dst_dir: str) -> bool:
+    try:
+        return os.stat(src).st_dev == os.stat(dst_dir).st_dev
+    except OSError:
+        return False
+
+
+def transfer_tree(src: str, dst: str, move: bool, progress: JobProgress):
+    """逐个文件复制/移动目录, 移动时最后自底向上删除已清空的源目录"""
+    os.makedirs(dst, exist_ok=True)
+    dirs = []
+    for e in TreeWalker.walk(src):
+        progress.check()
+        target = os.path.join(dst, e.path[1:])
+        if e.is_dir:
+            os.makedirs(target, exist_ok=True)
+            dirs.append(e.syspath)
+            continue
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        copy_file(e.syspath, target, progress)
+        if move:
+            os.remove(e.syspath)
+    if move:
+        for d in sorted(dirs, key=lambda p: p.count(os.sep), reverse=True) + [src]:
+            try:
+                os.rmdir(d)
+            except OSError:
+                continue
+
+
+CLEAN_KINDS = (JobKind.CLEAN, JobKind.CLEAN_DRY_RUN)
+
+
+def run_job(kind: JobKind, src_dir: str, dst_dir: str, names: List[str], progress: JobProgress):
+    """在线程中执行复制/移动, 已完成的文件在重启后跳过"""
+    if kind in CLEAN_KINDS:
+        progress.report = clean_empty_dirs(src_dir, kind == JobKind.CLEAN_DRY_RUN, progress)
+        return
+    move = kind == JobKind.MOVE
+    items = []
+    for n in names:
+        src_path, dst_path = forcedir(src_dir) + n, forcedir(dst_dir) + n
+        items.append((src_path, dst_path, VFS.syspath_or_none(src_path), VFS.syspath_or_none(dst_path)))
+
+    for src_path, _, src_sys, _ in items:
+        if src_sys is None:
+            continue
+        if os.path.isdir(src_sys):
+            for e in TreeWalker.files(src_sys):
+                progress.bytes_total += e.stat.st_size
+                progress.files_total += 1
+        elif os.path.exists(src_sys):
+            progress.bytes_total += os.path.getsize(src_sys)
+            progress.files_total += 1
+
+    for src_path, dst_path, src_sys, dst_sys in items:
+        progress.check()
+        if src_sys is None or dst_sys is None:
+            # 非本地文件系统, 整体交给VFS处理
+            if VFS.exists(src_path):
+                VFS.transfer(src_path, dst_path, move=move)
+            continue
+        if not os.path.exists(src_sys):
+            continue
+        if move and not os.path.exists(dst_sys) and same_device(src_sys, os.path.dirname(dst_sys)):
+            # 同一设备直接重命名
+            if os.path.isdir(src_sys):
+                size, num = TreeWalker.dir_size(src_sys)
+            else:
+                size, num = os.path.getsize(src_sys), 1
+            os.rename(src_sys, dst_sys)
+            progress.bytes_done += size
+            progress.files_done += num
+        elif os.path.isdir(src_sys):
+            transfer_tree(src_sys, dst_sys, move, progress)
+        else:
+            copy_file(src_sys, dst_sys, progress)
+            if move:
+                os.remove(src_sys)
+
+
+class JobManager:
+    """复制/移动任务队列, 同一存储空间同时运行的任务数由 fs.job_parallel 限制"""
+    pool: Optional[ThreadPoolExecutor] = None
+    running: Dict[str, JobProgress] = {}
+    semaphores: Dict[str, asyncio.Semaphore] = {}
+    tasks: Set[asyncio.Task] = set()
+    parallel: int = 1
+    report_interval: float = 2
+
+    @classmethod
+    def configure(cls, parallel: int):
+        if parallel != cls.parallel:
+            cls.parallel = parallel
+            cls.semaphores = {}
+
+    @classmethod
+    def semaphore(cls, mount_name: str) -> asyncio.Semaphore:
+        if mount_name not in cls.semaphores:
+            cls.semaphores[mount_name] = asyncio.Semaphore(cls.parallel)
+        return cls.semaphores[mount_name]
+
+    @classmethod
+    def schedule(cls, job_id: str):
+        cls.running[job_id] = JobProgress()
+        task = asyncio.get_running_loop().create_task(cls.execute(job_id))
+        cls.tasks.add(task)
+        task.add_done_callback(cls.tasks.discard)
+
+    @classmethod
+    async def submit(cls, kind: JobKind, src_dir: str, dst_dir: str, names: List[str]) -> FsJob:
+        job = await FsJob.create(
+            job_id=shortuuid.uuid(),
+            kind=kind,
+            status=JobStatus.PENDING,
+            src_dir=src_dir,
+            dst_dir=dst_dir,
+            names=names,
+            created=time.time()
+        )
+        cls.schedule(job.job_id)
+        return job
+
+    @classmethod
+    def sync_progress(cls, job: FsJob, progress: JobProgress):
+        job.bytes_total = progress.bytes_total
+        job.bytes_done = progress.bytes_done
+        job.files_total = progress.files_total
+        job.files_done = progress.files_done
+        job.throughput = progress.throughput
+
+    @classmethod
+    async def report(cls, job: FsJob, progress: JobProgress):
+        while True:
+            await asyncio.sleep(cls.report_interval)
+            cls.sync_progress(job, progress)
+            await job.save(update_fields=["bytes_total", "bytes_done", "files_total", "files_done", "throughput"])
+
+    @classmethod
+    async def execute(cls, job_id: str):
+        progress = cls.running[job_id]
+        job = await FsJob.get(job_id=job_id)
+        mounts = sorted({job.src_dir.split("/")[1], job.dst_dir.split("/")[1]})
+        interrupted = False
+        try:
+            async with AsyncExitStack() as stack:
+                for m in mounts:
+                    await stack.enter_async_context(cls.semaphore(m))
+                progress.check()
+                progress.started = time.monotonic()
+                job.status = JobStatus.RUNNING
+                await job.save(update_fields=["status"])
+                reporter = asyncio.get_running_loop().create_task(cls.report(job, progress))
+                try:
+                    if cls.pool is None:
+                        cls.pool = ThreadPoolExecutor(thread_name_prefix="job")
+                    await asyncio.get_running_loop().run_in_executor(
+                        cls.pool, run_job, job.kind, job.src_dir, job.dst_dir, job.names, progress
+                    )
+                finally:
+                    reporter.cancel()
+            job.status = JobStatus.SUCCESS
+            if job.kind in CLEAN_KINDS:
+                job.message = f"空文件夹: {len(progress.report)}"
+            else:
+                job.message = ", ".join(f"{k}: {v}" for k, v in progress.methods.items()) or None
+        except JobCanceled:
+            job.status = JobStatus.CANCELED
+        except JobInterrupted:
+            interrupted = True
+        except Exception as e:
+            job.status = JobStatus.FAILED
+            job.message = str(e)[:500]
+        finally:
+            cls.running.pop(job_id, None)
+        cls.sync_progress(job, progress)
+        if not interrupted:
+            job.finished = time.time()
+        await job.save()
+        if job.kind in CLEAN_KINDS:
+            await FsJobReport.update_or_create(job_id=job.job_id, defaults={"paths": progress.report})
+            if job.kind == JobKind.CLEAN:
+                await MetaIndex.remove(*top_paths(progress.report))
+            return
+        # 部分完成的任务也需要同步索引
+        for n in job.names:
+            if job.kind == JobKind.MOVE:
+                await MetaIndex.refresh(join(job.src_dir, n))
+            await MetaIndex.refresh(join(job.dst_dir, n))
+
+    @classmethod
+    async def cancel(cls, job: FsJob) -> bool:
+        progress = cls.running.get(job.job_id)
+        if progress is None:
+            return False
+        progress.cancel.set()
+        if job.status == JobStatus.PENDING:
+            job.status = JobStatus.CANCELED
+            await job.save(update_fields=["status"])
+        return True
+
+    @classmethod
+    async def resume(cls, job: FsJob) -> bool:
+        if job.job_id in cls.running or job.status == JobStatus.SUCCESS:
+            return False
+        job.status = JobStatus.PENDING
+        job.message = None
+        job.finished = None
+        await job.save(update_fields=["status", "message", "finished"])
+        cls.schedule(job.job_id)
+        return True
+
+    @classmethod
+    async def resume_all(cls):
+        """服务启动时继续未完成的任务"""
+        for job in await FsJob.filter(status__in=[JobStatus.PENDING, JobStatus.RUNNING]).order_by("id"):
+            cls.schedule(job.job_id)
+
+    @classmethod
+    def shutdown(cls):
+        for progress in cls.running.values():
+            progress.interrupt.set()
+        if cls.pool:
+            cls.pool.shutdown(wait=True, cancel_futures=True)
+        cls.pool = None
+
+    @classmethod
+    def view(cls, job: dict) -> dict:
+        progress = cls.running.get(job["job_id"])
+        if progress is not None and job["status"] == JobStatus.RUNNING:
+            job.update(
+                bytes_total=progress.bytes_total,
+                bytes_done=progress.bytes_done,
+                files_total=progress.files_total,
+                files_done=progress.files_done,
+                throughput=progress.throughput,
+                methods=progress.methods
+            )
+        return job
@@ -1,8 +1,19 @@
+import os
+import shutil
+import stat
 from dataclasses import dataclass
+from typing import Optional, Iterator
 
+from fs.copy import copy_dir, copy_file
+from fs.errors import NoSysPath
 from fs.mountfs import MountFS
+from fs.move import move_dir, move_file
 from fs.path import forcedir, abspath
 
+from . import fastcopy
+from .index import MetaIndex, is_hidden
+from .walker import TreeWalker, WalkEntry
+
 
 class UnMountError(Exception):
     """Thrown when mounts conflict."""
@@ -24,16 +35,104 @@ class MountVFS(MountFS):
 
     def get_dir_size(self, path: str):
         self.check()
-        fs, path_ = self._delegate(path)
+        index, index_path = MetaIndex.ready(path)
+        if index:
+            cached = index.dir_size(index_path)
+            if cached is not None:
+                return cached
         size = 0
         num = 0
-        for f in fs.walk.info(path_, namespaces=['basic', 'details', 'access']):
-            if not f[1].is_dir:
-                size += f[1].size
+        for e in self.walk_entries(path):
+            if not e.is_dir:
+                size += e.stat.st_size
                 num += 1
 
         return size, num
 
+    def walk_entries(self, path: str) -> Iterator[WalkEntry]:
+        """遍历目录树, 本地存储使用并行scandir, 其它文件系统退回PyFilesystem遍历"""
+        sys_path = self.syspath_or_none(path)
+        if sys_path:
+            # 跳过存储空间根目录下的回收站
+            _, rel = MetaIndex.lookup(path)
+            base = rel.rstrip("/")
+            for e in TreeWalker.walk(sys_path, prune=lambda e_: is_hidden(base + e_.path)):
+                if not is_hidden(base + e.path):
+                    yield e
+            return
+        fs, path_ = self._delegate(path)
+        if fs is self.default_fs:
+            # 根目录等挂载点之上的路径: 默认文件系统中只有挂载点占位目录, 逐个遍历其下的存储空间
+            yield from self._walk_mounts(path)
+            return
+        base = len(forcedir(path_)) - 1
+        for p, info in fs.walk.info(path_, namespaces=["basic", "details"]):
+            mode = (stat.S_IFDIR | 0o755) if info.is_dir else (stat.S_IFREG | 0o644)
+            mtime = info.modified.timestamp() if info.modified else 0
+            st = os.stat_result((mode, 0, 0, 1, 0, 0, info.size or 0, mtime, mtime, mtime))
+            yield WalkEntry(p[base:], "", st, info.is_dir)
+
+    def _walk_mounts(self, path: str) -> Iterator[WalkEntry]:
+        prefix = forcedir(abspath(path))
+        for mount_path, _ in list(self.mounts):
+            if not mount_path.startswith(prefix):
+                continue
+            rel = mount_path[len(prefix) - 1:].rstrip("/")
+            sys_path = self.syspath_or_none(mount_path)
+            try:
+                st = os.stat(sys_path) if sys_path else None
+            except OSError:
+                st = None
+            if st is None:
+                st = os.stat_result((stat.S_IFDIR | 0o755, 0, 0, 1, 0, 0, 0, 0, 0, 0))
+            yield WalkEntry(rel, sys_path or "", st, True)
+            for e in self.walk_entries(mount_path):
+                yield e._replace(path=rel + e.path)
+
+    def get_path_size(self, path: str) -> int:
+        return self.getsize(path) if not self.isdir(path) else self.get_dir_size(path)[0]
+
+    def syspath_or_none(self, path: str) -> Optional[str]:
+        self.check()
+        fs, path_ = self._delegate(path)
+        try:
+            return fs.getsyspath(path_)
+        except NoSysPath:
+            return None
+
+    # 以下操作在线程池中执行, 直接作用于挂载的文件系统, 不持有VFS全局锁
+    def transfer(self, src_path: str, dst_path: str, move: bool = False):
+        src_sys = self.syspath_or_none(src_path)
+        dst_sys = self.syspath_or_none(dst_path)
+        if src_sys and dst_sys:
+            if move:
+                shutil.move(src_sys, dst_sys, copy_function=fastcopy.copy_file)
+            elif os.path.isdir(src_sys):
+                shutil.copytree(src_sys, dst_sys, copy_function=fastcopy.copy_file, dirs_exist_ok=True)
+            else:
+                fastcopy.copy_file(src_sys, dst_sys)
+            return
+        src_fs, src_ = self._delegate(src_path)
+        dst_fs, dst_ = self._delegate(dst_path)
+        if src_fs.isdir(src_):
+            (move_dir if move else copy_dir)(src_fs, src_, dst_fs, dst_)
+        else:
+            (move_file if move else copy_file)(src_fs, src_, dst_fs, dst_)
+
+    def delete(self, path: str):
+        sys_path = self.syspath_or_none(path)
+        if sys_path:
+            if os.path.isdir(sys_path) and not os.path.islink(sys_path):
+                shutil.rmtree(sys_path)
+            else:
+                os.remove(sys_path)
+            return
+        fs, path_ = self._delegate(path)
+        if fs.isdir(path_):
+            fs.removetree(path_)
+        else:
+            fs.remove(path_)
+
 
 @dataclass
 class FS:
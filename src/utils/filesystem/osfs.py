@@ -2,7 +2,8 @@ import stat
 
 from fs.osfs import OSFS
 import os
-from os.path import getsize, join
+
+from .walker import TreeWalker
 
 
 class OSVFS(OSFS):
@@ -10,12 +11,6 @@ class OSVFS(OSFS):
     def get_dir_size(self, path: str):
         self.check()
         path_ = self.validatepath(path)
-        syspath = self._to_sys_path(path_)
+        syspath = self.getsyspath(path_)
         os.chmod(syspath, stat.S_IRWXU+stat.S_IRWXG+stat.S_IRWXO)
-        size = 0
-        num = 0
-        for root, _, files in os.walk(syspath):
-            size += sum(getsize(join(root, name)) for name in files)
-            num = len(files)
-
-        return size, num
+        return TreeWalker.dir_size(syspath)
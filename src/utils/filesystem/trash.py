@@ -0,0 +1,231 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, List, Set, Tuple
+
+import shortuuid
+from fs.path import abspath, normpath
+from tortoise.expressions import Q
+
+from src.model.trash import TrashItem
+from . import VFS
+from .executor import FSExecutor
+from .index import MetaIndex, TRASH_DIR
+from .walker import TreeWalker
+
+
+class Trash:
+    """存储空间回收站: 删除即重命名到 <根目录>/.trash, 后台按限速彻底删除"""
+    pool: Optional[ThreadPoolExecutor] = None
+    wakeup: Optional[asyncio.Event] = None
+    stop = threading.Event()
+    # 后台统计目录大小的任务
+    tasks: Set[asyncio.Task] = set()
+    # 保留天数, 0表示不自动清理
+    retention: int = 30
+    # 每秒彻底删除的文件数
+    rate: int = 1000
+
+    @classmethod
+    def configure(cls, retention: int, rate: int):
+        cls.retention = retention
+        cls.rate = rate
+        cls.notify()
+
+    @classmethod
+    def notify(cls):
+        if cls.wakeup:
+            cls.wakeup.set()
+
+    @classmethod
+    def split(cls, path: str):
+        parts = abspath(normpath(path)).split("/")
+        return parts[1], abspath("/".join(parts[2:]))
+
+    @classmethod
+    def item_syspath(cls, item: TrashItem) -> Optional[str]:
+        return VFS.syspath_or_none(f"/{item.mount_name}{TRASH_DIR}/{item.trash_id}")
+
+    @classmethod
+    def indexed_size(cls, path: str) -> Optional[Tuple[int, int]]:
+        """索引就绪时从索引读取目录大小, 不遍历目录"""
+        index, index_path = MetaIndex.ready(path)
+        return index.dir_size(index_path) if index else None
+
+    @classmethod
+    async def measure(cls, item: TrashItem):
+        """统计已移入回收站的目录大小, 统计完成前按0计算"""
+        syspath = cls.item_syspath(item)
+        if not syspath:
+            return
+        try:
+            size, num = await FSExecutor.run(TreeWalker.dir_size, syspath)
+        except OSError:
+            return
+        await TrashItem.filter(id=item.id).update(size=size, num=num)
+
+    @classmethod
+    async def move_in(cls, path: str) -> bool:
+        """把文件/文件夹移入回收站, 无法重命名(跨设备等)时返回False.
+        只做一次重命名, 索引中没有大小的目录在移入后由后台任务统计"""
+        mount_name, rel = cls.split(path)
+        src = VFS.syspath_or_none(path)
+        root = VFS.syspath_or_none(f"/{mount_name}/")
+        if not src or not root or rel == "/":
+            return False
+        is_dir = os.path.isdir(src) and not os.path.islink(src)
+        known = True
+        if is_dir:
+            sized = await FSExecutor.run(cls.indexed_size, path)
+            known = sized is not None
+            size, num = sized or (0, 0)
+        else:
+            size, num = os.lstat(src).st_size, 1
+        # 先写记录再重命名, 中途失败时不会留下无记录的文件
+        item = await TrashItem.create(
+            trash_id=shortuuid.uuid(),
+            mount_name=mount_name,
+            path=rel,
+            name=os.path.basename(src),
+            is_dir=is_dir,
+            size=size,
+            num=num,
+            deleted=time.time()
+        )
+        trash_root = os.path.join(root, TRASH_DIR[1:])
+
+        def rename():
+            os.makedirs(trash_root, exist_ok=True)
+            os.rename(src, os.path.join(trash_root, item.trash_id))
+
+        try:
+            await FSExecutor.run(rename)
+        except OSError:
+            await item.delete()
+            return False
+        await MetaIndex.remove(path)
+        if not known:
+            task = asyncio.get_running_loop().create_task(cls.measure(item))
+            cls.tasks.add(task)
+            task.add_done_callback(cls.tasks.discard)
+        return True
+
+    @classmethod
+    async def restore(cls, item: TrashItem) -> Optional[str]:
+        """还原到原路径, 失败时返回原因"""
+        src = cls.item_syspath(item)
+        vfs_path = f"/{item.mount_name}{item.path}"
+        if not src or not os.path.lexists(src):
+            await item.delete()
+            return f"回收站中的文件已不存在: {item.name}"
+        dst = VFS.syspath_or_none(vfs_path)
+        if not dst:
+            return f"存储空间不可用: {item.mount_name}"
+        if os.path.lexists(dst):
+            return f"原位置已存在同名文件/文件夹: {vfs_path}"
+
+        def rename():
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            os.rename(src, dst)
+
+        try:
+            await FSExecutor.run(rename)
+        except OSError as e:
+            return f"还原失败: {item.name}: {e.strerror or e}"
+        await item.delete()
+        await MetaIndex.refresh(vfs_path)
+        return None
+
+    @classmethod
+    async def purge(cls, ids: Optional[List[int]] = None, mount_name: Optional[str] = None):
+        """标记为彻底删除, 由后台任务限速执行"""
+        query = TrashItem.filter()
+        if ids is not None:
+            query = query.filter(id__in=ids)
+        if mount_name:
+            query = query.filter(mount_name=mount_name)
+        await query.update(purging=True)
+        cls.notify()
+
+    @classmethod
+    async def size(cls, mount_name: str) -> int:
+        return sum(await TrashItem.filter(mount_name=mount_name).values_list("size", flat=True))
+
+    @classmethod
+    async def used_space(cls, mount_name: str) -> int:
+        """存储空间已用容量, 包含回收站"""
+        return (await FSExecutor.run(VFS.get_dir_size, "/" + mount_name))[0] + await cls.size(mount_name)
+
+    @classmethod
+    def remove_tree(cls, syspath: str) -> bool:
+        """自底向上删除, 每秒不超过rate个文件; 服务停止时中断并返回False"""
+        batch = max(1, cls.rate // 10)
+        count = 0
+        started = time.monotonic()
+
+        def throttle():
+            nonlocal count
+            count += 1
+            if count % batch == 0:
+                delay = count / cls.rate - (time.monotonic() - started)
+                if delay > 0:
+                    cls.stop.wait(delay)
+            return not cls.stop.is_set()
+
+        if not os.path.isdir(syspath) or os.path.islink(syspath):
+            os.remove(syspath)
+            return True
+        for root, dirs, files in os.walk(syspath, topdown=False):
+            for name in files:
+                os.remove(os.path.join(root, name))
+                if not throttle():
+                    return False
+            for name in dirs:
+                p = os.path.join(root, name)
+                if os.path.islink(p):
+                    os.remove(p)
+                else:
+                    os.rmdir(p)
+        os.rmdir(syspath)
+        return True
+
+    @classmethod
+    async def purge_forever(cls, interval: int = 3600):
+        """后台清理: 处理已标记及超过保留期的回收站条目"""
+        cls.wakeup = asyncio.Event()
+        cls.stop.clear()
+        if cls.pool is None:
+            cls.pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="purge")
+        loop = asyncio.get_running_loop()
+        while not cls.stop.is_set():
+            cls.wakeup.clear()
+            condition = Q(purging=True)
+            if cls.retention > 0:
+                condition = condition | Q(deleted__lt=time.time() - cls.retention * 86400)
+            for item in await TrashItem.filter(condition).order_by("id"):
+                syspath = cls.item_syspath(item)
+                if syspath and os.path.lexists(syspath):
+                    try:
+                        if not await loop.run_in_executor(cls.pool, cls.remove_tree, syspath):
+                            return
+                    except OSError as e:
+                        print(f"清理回收站失败 {syspath}: {e}")
+                        continue
+                elif syspath is None:
+                    # 存储空间未挂载, 稍后再处理
+                    continue
+                await item.delete()
+            try:
+                await asyncio.wait_for(cls.wakeup.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+
+    @classmethod
+    def shutdown(cls):
+        cls.stop.set()
+        cls.notify()
+        if cls.pool:
+            cls.pool.shutdown(wait=True, cancel_futures=True)
+        cls.pool = None
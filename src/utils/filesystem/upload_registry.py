@@ -0,0 +1,146 @@
+import asyncio
+import os
+from typing import Dict, Optional, Set, List
+
+from fs.path import forcedir
+from tortoise.transactions import in_transaction
+
+from src.model.upload_task import UploadTask, UploadStatus, ChunkInfo
+from . import VFS
+from .executor import FSExecutor
+
+
+def sync_files(syspaths: List[str]):
+    for syspath in syspaths:
+        try:
+            fd = os.open(syspath, os.O_RDONLY)
+        except OSError:
+            continue
+        try:
+            getattr(os, "fdatasync", os.fsync)(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+
+class UploadRegistry:
+    """进行中的上传任务的内存状态: 上传请求只读写内存, 变更按周期批量写入数据库, 任务结束时立即写入.
+    进程崩溃时最多丢失一个周期内的分片标记, 这些分片在数据库中仍为未完成, 客户端重传后按偏移覆盖, 结果不变;
+    写入数据库前先把文件数据落盘, 数据库中标记完成的分片断电后也不会丢失"""
+    tasks: Dict[str, dict] = {}
+    chunks: Dict[str, ChunkInfo] = {}
+    dirty: Set[str] = set()
+    interval: int = 2
+    stop: Optional[asyncio.Event] = None
+    _lock: Optional[asyncio.Lock] = None
+
+    @classmethod
+    def configure(cls, interval: int):
+        cls.interval = interval
+
+    @classmethod
+    def view(cls, session_id: str) -> Optional[dict]:
+        """内存中的任务副本, 未加载时返回None"""
+        task = cls.tasks.get(session_id)
+        if task is None:
+            return None
+        task = dict(task)
+        chunk = cls.chunks.get(session_id)
+        if chunk is not None:
+            task['chunk_info'] = chunk.model_dump()
+        return task
+
+    @classmethod
+    async def get(cls, session_id: str) -> Optional[dict]:
+        if session_id not in cls.tasks:
+            task = await UploadTask.get_or_none(session_id=session_id).values()
+            if task is None:
+                return None
+            # 已完成的任务不会再变化, 直接返回数据库中的记录
+            if task['status'] == UploadStatus.SUCCESS:
+                return task
+            # 并发请求可能同时加载, 以先放入的为准
+            if session_id not in cls.tasks:
+                cls.tasks[session_id] = task
+                if task['chunk_info']:
+                    cls.chunks[session_id] = ChunkInfo(**task['chunk_info'])
+        return cls.view(session_id)
+
+    @classmethod
+    def chunk_info(cls, session_id: str) -> Optional[ChunkInfo]:
+        """分片状态对象, 修改后调用touch"""
+        return cls.chunks.get(session_id)
+
+    @classmethod
+    def touch(cls, session_id: str):
+        if session_id in cls.tasks:
+            cls.dirty.add(session_id)
+
+    @classmethod
+    async def update(cls, session_id: str, status: UploadStatus):
+        task = cls.tasks.get(session_id)
+        if task is None:
+            return
+        task['status'] = status
+        cls.dirty.add(session_id)
+        if status != UploadStatus.UPLOADING:
+            await cls.flush(session_id)
+
+    @classmethod
+    def remove(cls, session_id: str):
+        cls.tasks.pop(session_id, None)
+        cls.chunks.pop(session_id, None)
+        cls.dirty.discard(session_id)
+
+    @classmethod
+    async def flush(cls, *session_ids: str):
+        """把指定(默认全部)有变更的任务写入数据库"""
+        if cls._lock is None:
+            cls._lock = asyncio.Lock()
+        async with cls._lock:
+            rows = []
+            for session_id in session_ids or list(cls.dirty):
+                task = cls.tasks.get(session_id)
+                if session_id not in cls.dirty or task is None:
+                    continue
+                cls.dirty.discard(session_id)
+                chunk = cls.chunks.get(session_id)
+                rows.append((session_id, task['status'], chunk.model_dump() if chunk else task['chunk_info'], task))
+            if not rows:
+                return
+            syspaths = [
+                VFS.syspath_or_none(forcedir(task['path']) + task['name'])
+                for _, status, chunk_info, task in rows if chunk_info or status == UploadStatus.SUCCESS
+            ]
+            try:
+                await FSExecutor.run(sync_files, [p for p in syspaths if p])
+                async with in_transaction():
+                    for session_id, status, chunk_info, _ in rows:
+                        await UploadTask.filter(session_id=session_id).update(status=status, chunk_info=chunk_info)
+            except Exception:
+                cls.dirty.update(row[0] for row in rows)
+                raise
+            # 已完成的任务不再保留在内存中
+            for session_id, status, _, _ in rows:
+                if status == UploadStatus.SUCCESS and session_id not in cls.dirty:
+                    cls.remove(session_id)
+
+    @classmethod
+    async def flush_forever(cls):
+        cls.stop = asyncio.Event()
+        while not cls.stop.is_set():
+            try:
+                await asyncio.wait_for(cls.stop.wait(), timeout=cls.interval)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await cls.flush()
+            except Exception as e:
+                print(f"上传任务状态写入失败: {e}")
+
+    @classmethod
+    async def shutdown(cls):
+        if cls.stop:
+            cls.stop.set()
+        await cls.flush()
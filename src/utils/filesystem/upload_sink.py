@@ -0,0 +1,108 @@
+import asyncio
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+from .chunked import pwrite_all
+from .executor import FSExecutor
+
+# 请求体片段合并到该大小后再落盘
+BUFFER_SIZE = 4 * 1024 * 1024
+# 写入块的结束位置对齐到页大小
+ALIGN = 4096
+# 后台写入时允许排队的块数, 超出后等待, 内存占用不超过 BUFFER_SIZE * MAX_PENDING
+MAX_PENDING = 4
+
+
+class UploadSink:
+    """上传请求的写入端: 整个请求只打开一次文件, 把请求体片段合并成大块按偏移写入.
+    write_behind为True时由独立线程按顺序落盘, 事件循环继续接收后续数据"""
+
+    def __init__(self, syspath: str, offset: int = 0, buffer_size: int = BUFFER_SIZE, write_behind: bool = False):
+        self.fd: Optional[int] = os.open(syspath, os.O_WRONLY | getattr(os, "O_CLOEXEC", 0))
+        self.offset = offset
+        self.buffer = bytearray()
+        self.buffer_size = buffer_size
+        self.pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="upload") if write_behind else None
+        self.pending: deque = deque()
+
+    async def write(self, data: bytes):
+        self.buffer += data
+        if len(self.buffer) >= self.buffer_size:
+            # 只写到对齐位置, 余下的留到下一块, 之后的写入都从页边界开始
+            n = len(self.buffer) - (self.offset + len(self.buffer)) % ALIGN
+            await self._submit(n if n > 0 else len(self.buffer))
+
+    async def _submit(self, n: int):
+        block = bytes(self.buffer[:n])
+        del self.buffer[:n]
+        offset = self.offset
+        self.offset += n
+        if self.pool is None:
+            await FSExecutor.run(pwrite_all, self.fd, block, offset)
+            return
+        self.pending.append(asyncio.get_running_loop().run_in_executor(self.pool, pwrite_all, self.fd, block, offset))
+        # 已完成的写入先取结果, 出错时尽早抛出
+        while self.pending and (len(self.pending) > MAX_PENDING or self.pending[0].done()):
+            await self.pending.popleft()
+
+    async def flush(self):
+        if self.buffer:
+            await self._submit(len(self.buffer))
+        while self.pending:
+            await self.pending.popleft()
+
+    async def close(self, discard: bool = False):
+        """写完缓冲区并关闭文件; discard为True时丢弃未写入的数据, 只等待已提交的写入结束"""
+        if self.fd is None:
+            return
+        try:
+            if discard:
+                self.buffer.clear()
+            else:
+                await self.flush()
+        finally:
+            try:
+                while self.pending:
+                    try:
+                        await self.pending.popleft()
+                    except OSError:
+                        pass
+            finally:
+                # 写入线程结束后才能关闭文件描述符, 正常情况下此时已没有排队的写入
+                if self.pool is not None:
+                    self.pool.shutdown(wait=True)
+                os.close(self.fd)
+                self.fd = None
+
+
+class UploadSignals:
+    """进行中的上传请求的取消信号, 同一任务的并发请求共用一个Event"""
+    events: Dict[str, asyncio.Event] = {}
+    refs: Dict[str, int] = {}
+
+    @classmethod
+    def acquire(cls, session_id: str) -> asyncio.Event:
+        event = cls.events.get(session_id)
+        if event is None:
+            event = cls.events[session_id] = asyncio.Event()
+        cls.refs[session_id] = cls.refs.get(session_id, 0) + 1
+        return event
+
+    @classmethod
+    def release(cls, session_id: str):
+        count = cls.refs.get(session_id, 0) - 1
+        if count > 0:
+            cls.refs[session_id] = count
+        else:
+            cls.refs.pop(session_id, None)
+            cls.events.pop(session_id, None)
+
+    @classmethod
+    def cancel(cls, session_id: str) -> bool:
+        event = cls.events.get(session_id)
+        if event is None:
+            return False
+        event.set()
+        return True
@@ -0,0 +1,194 @@
+import bisect
+import hashlib
+import sqlite3
+import threading
+import zlib
+from pathlib import Path
+from typing import Iterator, List, NamedTuple, Callable, BinaryIO, Optional, Tuple, Dict
+
+from .zipstream import (
+    CentralRecord, FLAG_DESCRIPTOR, FLAG_UTF8, STORED, ZIP64_LIMIT, CHUNK_SIZE,
+    dos_datetime, local_header, data_descriptor, central_header, end_records
+)
+
+CRC_SCHEMA = """
+CREATE TABLE IF NOT EXISTS crc (
+    dev INTEGER NOT NULL,
+    ino INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    crc INTEGER NOT NULL,
+    PRIMARY KEY (dev, ino)
+);
+"""
+
+
+class CrcCache:
+    """文件CRC32的持久缓存, 以(设备号, inode)为键, 大小或修改时间变化即失效"""
+    db_path: str = "data/zip_crc.db"
+    _conn: Optional[sqlite3.Connection] = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def _connect(cls) -> sqlite3.Connection:
+        if cls._conn is None:
+            Path(cls.db_path).parent.mkdir(parents=True, exist_ok=True)
+            cls._conn = sqlite3.connect(cls.db_path, check_same_thread=False)
+            cls._conn.execute("PRAGMA journal_mode=WAL")
+            cls._conn.execute("PRAGMA synchronous=NORMAL")
+            cls._conn.executescript(CRC_SCHEMA)
+        return cls._conn
+
+    @classmethod
+    def get(cls, key: Tuple[int, int, int, int]) -> Optional[int]:
+        dev, ino, size, mtime_ns = key
+        if not ino:
+            return None
+        with cls._lock:
+            row = cls._connect().execute(
+                "SELECT crc FROM crc WHERE dev = ? AND ino = ? AND size = ? AND mtime_ns = ?", key
+            ).fetchone()
+        return row[0] if row else None
+
+    @classmethod
+    def put(cls, key: Tuple[int, int, int, int], crc: int):
+        if not key[1]:
+            return
+        with cls._lock, cls._connect():
+            cls._conn.execute("INSERT OR REPLACE INTO crc (dev, ino, size, mtime_ns, crc) VALUES (?, ?, ?, ?, ?)",
+                              (*key, crc))
+
+
+class VirtualEntry(NamedTuple):
+    """虚拟压缩包中的文件: key为(设备号, inode, 大小, 修改时间ns), 用于CRC缓存"""
+    arcname: str
+    size: int
+    mtime: float
+    key: Tuple[int, int, int, int]
+    open: Callable[[], BinaryIO]
+
+
+class VirtualZip:
+    """字节布局完全由排序后的文件列表与stat决定的STORE压缩包, 不落盘即可按任意区间读取.
+    CRC写在每个文件数据后的描述符和中央目录中, 顺序下载时边读边算并写入缓存,
+    区间请求只为落在区间内的描述符和中央目录补算缺少的CRC"""
+
+    def __init__(self, entries: List[VirtualEntry]):
+        self.entries = sorted(entries, key=lambda e: e.arcname)
+        self.names = [e.arcname.encode("utf-8") for e in self.entries]
+        self.times = [dos_datetime(e.mtime) for e in self.entries]
+        self.crcs: Dict[int, int] = {}
+        self.offsets: List[int] = []
+        self.header_sizes: List[int] = []
+        offset = 0
+        for i, e in enumerate(self.entries):
+            self.offsets.append(offset)
+            header_size = len(self.header(i))
+            self.header_sizes.append(header_size)
+            offset += header_size + e.size + (24 if self.zip64(i) else 16)
+        self.cd_offset = offset
+        # 中央目录的长度与CRC无关, 可以先算出总长度
+        self.cd_size = sum(len(central_header(self.record(i, 0))) for i in range(len(self.entries)))
+        self.size = self.cd_offset + self.cd_size + len(end_records(len(self.entries), self.cd_offset, self.cd_size))
+        self._central: Optional[bytes] = None
+
+    @property
+    def digest(self) -> str:
+        """布局摘要, 文件列表或任一文件的大小、修改时间变化时改变"""
+        h = hashlib.sha1()
+        for e in self.entries:
+            h.update(repr((e.arcname, e.size, e.key[3])).encode("utf-8"))
+        return h.hexdigest()
+
+    def zip64(self, i: int) -> bool:
+        return self.entries[i].size >= ZIP64_LIMIT
+
+    def header(self, i: int) -> bytes:
+        e = self.entries[i]
+        dostime, dosdate = self.times[i]
+        return local_header(
+            self.names[i], FLAG_DESCRIPTOR | FLAG_UTF8, STORED, dostime, dosdate, 0, e.size, e.size, self.zip64(i)
+        )
+
+    def record(self, i: int, crc: int) -> CentralRecord:
+        e = self.entries[i]
+        dostime, dosdate = self.times[i]
+        return CentralRecord(
+            self.names[i], FLAG_DESCRIPTOR | FLAG_UTF8, STORED, dostime, dosdate, crc, e.size, e.size, self.offsets[i]
+        )
+
+    def read_data(self, i: int, start: int, end: int) -> Iterator[bytes]:
+        """读取文件[start, end)区间, 文件变短或无法读取时用0补齐, 保证布局不变"""
+        pos = start
+        try:
+            with self.entries[i].open() as f:
+                f.seek(start)
+                while pos < end:
+                    chunk = f.read(min(CHUNK_SIZE, end - pos))
+                    if not chunk:
+                        break
+                    pos += len(chunk)
+                    yield chunk
+        except OSError:
+            pass
+        while pos < end:
+            n = min(CHUNK_SIZE, end - pos)
+            pos += n
+            yield bytes(n)
+
+    def crc(self, i: int) -> int:
+        if i in self.crcs:
+            return self.crcs[i]
+        key = self.entries[i].key
+        crc = CrcCache.get(key)
+        if crc is None:
+            crc = 0
+            for chunk in self.read_data(i, 0, self.entries[i].size):
+                crc = zlib.crc32(chunk, crc)
+            CrcCache.put(key, crc)
+        self.crcs[i] = crc
+        return crc
+
+    def central(self) -> bytes:
+        if self._central is None:
+            self._central = b"".join(
+                central_header(self.record(i, self.crc(i))) for i in range(len(self.entries))
+            ) + end_records(len(self.entries), self.cd_offset, self.cd_size)
+        return self._central
+
+    def read(self, start: int, end: int) -> Iterator[bytes]:
+        """按偏移读取[start, end)区间的压缩包内容"""
+        pos = start
+        i = max(bisect.bisect_right(self.offsets, start) - 1, 0)
+        while pos < end and i < len(self.entries) and pos < self.cd_offset:
+            e = self.entries[i]
+            base = self.offsets[i]
+            header_end = base + self.header_sizes[i]
+            data_end = header_end + e.size
+            entry_end = data_end + (24 if self.zip64(i) else 16)
+            if pos < header_end:
+                stop = min(end, header_end)
+                yield self.header(i)[pos - base:stop - base]
+                pos = stop
+            if pos < end and pos < data_end:
+                stop = min(end, data_end)
+                # 从头读完整个文件时顺便计算CRC
+                whole = pos == header_end and stop == data_end and i not in self.crcs
+                crc = 0
+                for chunk in self.read_data(i, pos - header_end, stop - header_end):
+                    if whole:
+                        crc = zlib.crc32(chunk, crc)
+                    yield chunk
+                if whole:
+                    self.crcs[i] = crc
+                    CrcCache.put(e.key, crc)
+                pos = stop
+            if pos < end and pos < entry_end:
+                stop = min(end, entry_end)
+                yield data_descriptor(self.crc(i), e.size, e.size, self.zip64(i))[pos - data_end:stop - data_end]
+                pos = stop
+            i += 1
+        if pos < end:
+            central = self.central()
+            for p in range(pos, end, CHUNK_SIZE):
+                yield central[p - self.cd_offset:min(end, p + CHUNK_SIZE) - self.cd_offset]
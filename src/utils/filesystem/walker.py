@@ -0,0 +1,91 @@
+import os
+import stat
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from typing import Optional, Iterator, List, Tuple, NamedTuple, Callable, Set
+
+from fs.path import forcedir
+
+
+class WalkEntry(NamedTuple):
+    """遍历记录: path 为相对遍历起点的路径(以/开头)"""
+    path: str
+    syspath: str
+    stat: os.stat_result
+    is_dir: bool
+
+
+def scan_one(syspath: str, path: str) -> Tuple[List[WalkEntry], List[WalkEntry]]:
+    """读取单层目录, 返回该层记录与待遍历的子目录; DirEntry已缓存类型, 每项只stat一次"""
+    entries = []
+    subdirs = []
+    try:
+        it = os.scandir(syspath)
+    except OSError:
+        return entries, subdirs
+    with it:
+        for entry in it:
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            is_dir = stat.S_ISDIR(st.st_mode)
+            record = WalkEntry(forcedir(path) + entry.name, entry.path, st, is_dir)
+            entries.append(record)
+            if is_dir and not entry.is_symlink():
+                subdirs.append(record)
+    return entries, subdirs
+
+
+class TreeWalker:
+    """基于os.scandir的目录树遍历, 子目录分发到独立线程池并行读取, 结果以流的方式返回"""
+    pool: Optional[ThreadPoolExecutor] = None
+    max_workers: int = 8
+
+    @classmethod
+    def initialize(cls, max_workers: int):
+        old = cls.pool
+        cls.max_workers = max_workers
+        cls.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="walk")
+        if old:
+            old.shutdown(wait=False)
+
+    @classmethod
+    def shutdown(cls):
+        if cls.pool:
+            cls.pool.shutdown(wait=True, cancel_futures=True)
+        cls.pool = None
+
+    @classmethod
+    def walk(cls, syspath: str, path: str = "/", prune: Callable[[WalkEntry], bool] = None) -> Iterator[WalkEntry]:
+        """遍历syspath下所有子项(不含自身), 顺序不固定; prune返回True的目录不再深入"""
+        if cls.pool is None:
+            cls.initialize(cls.max_workers)
+        pending: List[Tuple[str, str]] = [(syspath, path)]
+        running: Set[Future] = set()
+        try:
+            while pending or running:
+                # 同时进行的目录读取不超过线程数的两倍, 其余子目录排队
+                while pending and len(running) < cls.max_workers * 2:
+                    running.add(cls.pool.submit(scan_one, *pending.pop()))
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    entries, subdirs = fut.result()
+                    for entry in entries:
+                        yield entry
+                    pending.extend((e.syspath, e.path) for e in subdirs if not (prune and prune(e)))
+        finally:
+            for fut in running:
+                fut.cancel()
+
+    @classmethod
+    def files(cls, syspath: str, path: str = "/") -> Iterator[WalkEntry]:
+        return (e for e in cls.walk(syspath, path) if not e.is_dir)
+
+    @classmethod
+    def dir_size(cls, syspath: str) -> Tuple[int, int]:
+        size = 0
+        num = 0
+        for e in cls.files(syspath):
+            size += e.stat.st_size
+            num += 1
+        return size, num
@@ -0,0 +1,261 @@
+import asyncio
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from inspect import isawaitable
+from typing import Dict, Set, List, Callable, Optional
+
+from fs.path import abspath, normpath
+
+from .walker import TreeWalker
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+EVENT_HEADER = struct.Struct("iIII")
+
+
+@dataclass
+class ChangeEvent:
+    """一段时间内合并后的变化: paths 为内容发生变化的目录(相对存储根目录), overflow 表示需要全量重建"""
+    mount_name: str
+    paths: Set[str] = field(default_factory=set)
+    overflow: bool = False
+
+
+class BaseWatcher(threading.Thread):
+
+    def __init__(self, mount_name: str, root_path: str, publish: Callable[[ChangeEvent], None], delay: float):
+        super().__init__(name=f"watcher-{mount_name}", daemon=True)
+        self.mount_name = mount_name
+        self.root_path = os.path.abspath(root_path)
+        self.publish = publish
+        self.delay = delay
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def to_path(self, syspath: str) -> str:
+        rel = os.path.relpath(syspath, self.root_path)
+        return "/" if rel == "." else abspath(normpath(rel.replace(os.sep, "/")))
+
+
+class InotifyWatcher(BaseWatcher):
+    """基于inotify递归监听整个存储目录"""
+    _libc = None
+
+    @classmethod
+    def libc(cls):
+        if cls._libc is None:
+            cls._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        return cls._libc
+
+    def __init__(self, mount_name: str, root_path: str, publish: Callable[[ChangeEvent], None],
+                 delay: float, interval: float):
+        super().__init__(mount_name, root_path, publish, delay)
+        # 改用轮询时的间隔
+        self.interval = interval
+        self.wds: Dict[int, str] = {}
+        self.fd = self.libc().inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+    def add_watch(self, syspath: str):
+        wd = self.libc().inotify_add_watch(self.fd, os.fsencode(syspath), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err in (errno.ENOENT, errno.ENOTDIR, errno.EACCES):
+                return
+            raise OSError(err, f"inotify_add_watch failed: {syspath}")
+        self.wds[wd] = syspath
+
+    def add_tree(self, syspath: str):
+        self.add_watch(syspath)
+        for root, dirs, _ in os.walk(syspath):
+            for d in dirs:
+                self.add_watch(os.path.join(root, d))
+
+    def read_events(self, event: ChangeEvent):
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            name = data[offset + EVENT_HEADER.size: offset + EVENT_HEADER.size + length].rstrip(b"\0")
+            offset += EVENT_HEADER.size + length
+            if mask & IN_Q_OVERFLOW:
+                event.overflow = True
+                continue
+            dir_syspath = self.wds.get(wd)
+            if dir_syspath is None:
+                continue
+            if mask & IN_IGNORED:
+                self.wds.pop(wd, None)
+                continue
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                continue
+            event.paths.add(self.to_path(dir_syspath))
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                child = os.path.join(dir_syspath, os.fsdecode(name))
+                try:
+                    self.add_tree(child)
+                except OSError:
+                    event.overflow = True
+                # 新目录在添加监听前可能已有内容
+                event.paths.add(self.to_path(child))
+
+    def run(self):
+        # 遍历目录添加监听可能很久, 在线程中进行; 监听数量不足等失败时在本线程内改用轮询
+        try:
+            self.add_tree(self.root_path)
+        except OSError as e:
+            os.close(self.fd)
+            print(f"inotify不可用, 使用轮询监听 {self.mount_name}: {e}")
+            fallback = PollingWatcher(self.mount_name, self.root_path, self.publish, self.delay, self.interval)
+            fallback._stop_event = self._stop_event
+            fallback.run()
+            return
+        poller = select.poll()
+        poller.register(self.fd, select.POLLIN)
+        event = ChangeEvent(self.mount_name)
+        first = None
+        try:
+            while not self._stop_event.is_set():
+                timeout = 1000 if first is None else max(0, int((first + self.delay - time.monotonic()) * 1000))
+                if poller.poll(timeout):
+                    self.read_events(event)
+                    if first is None and (event.paths or event.overflow):
+                        first = time.monotonic()
+                if first is not None and time.monotonic() - first >= self.delay:
+                    self.publish(event)
+                    event = ChangeEvent(self.mount_name)
+                    first = None
+        finally:
+            os.close(self.fd)
+
+
+class PollingWatcher(BaseWatcher):
+    """定期比对目录修改时间, 用于不支持inotify或监听数量不足的环境"""
+
+    def __init__(self, mount_name: str, root_path: str, publish: Callable[[ChangeEvent], None],
+                 delay: float, interval: float):
+        super().__init__(mount_name, root_path, publish, delay)
+        self.interval = interval
+        self.snapshot: Dict[str, int] = {}
+
+    def take_snapshot(self) -> Dict[str, int]:
+        snapshot = {"/": os.stat(self.root_path).st_mtime_ns}
+        for e in TreeWalker.walk(self.root_path):
+            if e.is_dir:
+                snapshot[e.path] = e.stat.st_mtime_ns
+        return snapshot
+
+    def run(self):
+        # 初始快照需要遍历整个目录, 在线程中进行
+        self.snapshot = self.take_snapshot()
+        while not self._stop_event.wait(self.interval):
+            snapshot = self.take_snapshot()
+            event = ChangeEvent(self.mount_name)
+            for path, mtime in snapshot.items():
+                if self.snapshot.get(path) != mtime:
+                    event.paths.add(path)
+            for path in self.snapshot.keys() - snapshot.keys():
+                event.paths.add(path)
+            self.snapshot = snapshot
+            if event.paths:
+                self.publish(event)
+
+
+class ChangeWatcher:
+    """存储目录变化监听注册表, 变化事件在事件循环中分发给订阅者"""
+    watchers: Dict[str, BaseWatcher] = {}
+    roots: Dict[str, str] = {}
+    subscribers: List[Callable] = []
+    loop: Optional[asyncio.AbstractEventLoop] = None
+    mode: str = "auto"
+    delay: float = 1.0
+    interval: float = 30
+
+    @classmethod
+    def configure(cls, mode: str, interval: float):
+        """修改监听方式, 已启动的监听按新配置重启"""
+        if (mode, interval) == (cls.mode, cls.interval):
+            return
+        cls.mode = mode
+        cls.interval = interval
+        for mount_name, root_path in list(cls.roots.items()):
+            cls.start(mount_name, root_path)
+
+    @classmethod
+    def subscribe(cls, callback: Callable):
+        if callback not in cls.subscribers:
+            cls.subscribers.append(callback)
+
+    @classmethod
+    def start(cls, mount_name: str, root_path: str):
+        cls.stop(mount_name)
+        cls.roots[mount_name] = root_path
+        if cls.mode == "off":
+            return
+        cls.loop = asyncio.get_running_loop()
+        watcher = None
+        if cls.mode in ("auto", "inotify") and sys.platform.startswith("linux"):
+            try:
+                watcher = InotifyWatcher(mount_name, root_path, cls._publish, cls.delay, cls.interval)
+            except (OSError, AttributeError) as e:
+                print(f"inotify不可用, 使用轮询监听 {mount_name}: {e}")
+        if watcher is None:
+            watcher = PollingWatcher(mount_name, root_path, cls._publish, cls.delay, cls.interval)
+        cls.watchers[mount_name] = watcher
+        watcher.start()
+
+    @classmethod
+    def stop(cls, mount_name: str):
+        cls.roots.pop(mount_name, None)
+        watcher = cls.watchers.pop(mount_name, None)
+        if watcher:
+            watcher.stop()
+
+    @classmethod
+    def stop_all(cls):
+        for mount_name in list(cls.roots.keys()):
+            cls.stop(mount_name)
+
+    @classmethod
+    def _publish(cls, event: ChangeEvent):
+        if cls.loop and not cls.loop.is_closed():
+            cls.loop.call_soon_threadsafe(cls._dispatch, event)
+
+    @classmethod
+    def _dispatch(cls, event: ChangeEvent):
+        if event.mount_name not in cls.watchers:
+            return
+        for callback in cls.subscribers:
+            result = callback(event)
+            if isawaitable(result):
+                cls.loop.create_task(result)
@@ -0,0 +1,167 @@
+import os
+import struct
+import time
+import zlib
+from typing import Iterator, Iterable, Tuple, List, NamedTuple, Callable, BinaryIO
+
+ZIP64_LIMIT = 0xFFFFFFFF
+# 压缩后可能略大于原文件, 接近4GB的文件也按ZIP64处理
+ZIP64_THRESHOLD = ZIP64_LIMIT - 0x1000000
+STORED = 0
+DEFLATED = 8
+# 第3位: 大小与CRC在数据后的描述符中; 第11位: 文件名为UTF-8
+FLAG_DESCRIPTOR = 0x08
+FLAG_UTF8 = 0x800
+CHUNK_SIZE = 1024 * 1024
+
+# 已压缩的格式再压缩几乎没有收益, 直接存储
+STORED_SUFFIXES = {
+    ".jpg", ".jpeg", ".png", ".gif", ".webp", ".heic", ".avif",
+    ".mp4", ".mkv", ".mov", ".avi", ".wmv", ".flv", ".webm", ".m4v", ".ts",
+    ".mp3", ".aac", ".m4a", ".flac", ".ogg", ".opus", ".wma",
+    ".zip", ".rar", ".7z", ".gz", ".tgz", ".bz2", ".xz", ".zst", ".lz4", ".br",
+    ".jar", ".apk", ".ipa", ".docx", ".xlsx", ".pptx", ".epub", ".pdf", ".iso", ".dmg",
+}
+
+
+class ZipSource(NamedTuple):
+    """压缩包中的一个文件: arcname为包内路径, open返回二进制只读文件"""
+    arcname: str
+    size: int
+    mtime: float
+    open: Callable[[], BinaryIO]
+
+
+class CentralRecord(NamedTuple):
+    name: bytes
+    flags: int
+    method: int
+    dostime: int
+    dosdate: int
+    crc: int
+    csize: int
+    usize: int
+    offset: int
+
+
+def should_store(arcname: str) -> bool:
+    return os.path.splitext(arcname)[1].lower() in STORED_SUFFIXES
+
+
+def dos_datetime(mtime: float) -> Tuple[int, int]:
+    t = time.localtime(mtime)
+    if t.tm_year < 1980:
+        return 0, (1 << 5) | 1
+    return (
+        (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2),
+        ((min(t.tm_year, 2107) - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+    )
+
+
+def local_header(
+        name: bytes, flags: int, method: int, dostime: int, dosdate: int,
+        crc: int, csize: int, usize: int, zip64: bool
+) -> bytes:
+    extra = b""
+    if zip64:
+        extra = struct.pack("<HHQQ", 0x0001, 16, usize, csize)
+        csize = usize = ZIP64_LIMIT
+    return struct.pack(
+        "<IHHHHHIIIHH", 0x04034b50, 45 if zip64 else 20, flags, method, dostime, dosdate,
+        crc, csize, usize, len(name), len(extra)
+    ) + name + extra
+
+
+def data_descriptor(crc: int, csize: int, usize: int, zip64: bool) -> bytes:
+    if zip64:
+        return struct.pack("<IIQQ", 0x08074b50, crc, csize, usize)
+    return struct.pack("<IIII", 0x08074b50, crc, csize, usize)
+
+
+def central_header(r: CentralRecord) -> bytes:
+    values = []
+    usize, csize, offset = r.usize, r.csize, r.offset
+    if usize >= ZIP64_LIMIT:
+        values.append(usize)
+        usize = ZIP64_LIMIT
+    if csize >= ZIP64_LIMIT:
+        values.append(csize)
+        csize = ZIP64_LIMIT
+    if offset >= ZIP64_LIMIT:
+        values.append(offset)
+        offset = ZIP64_LIMIT
+    extra = struct.pack(f"<HH{len(values)}Q", 0x0001, 8 * len(values), *values) if values else b""
+    version = 45 if values else 20
+    return struct.pack(
+        "<IHHHHHHIIIHHHHHII", 0x02014b50, (3 << 8) | version, version, r.flags, r.method, r.dostime, r.dosdate,
+        r.crc, csize, usize, len(r.name), len(extra), 0, 0, 0, (0o100644 << 16), offset
+    ) + r.name + extra
+
+
+def end_records(count: int, cd_offset: int, cd_size: int) -> bytes:
+    """中央目录结束记录, 条目数或偏移超出范围时加上ZIP64结束记录与定位器"""
+    out = b""
+    if count >= 0xFFFF or cd_offset >= ZIP64_LIMIT or cd_size >= ZIP64_LIMIT:
+        out += struct.pack(
+            "<IQHHIIQQQQ", 0x06064b50, 44, 45, 45, 0, 0, count, count, cd_size, cd_offset
+        )
+        out += struct.pack("<IIQI", 0x07064b50, 0, cd_offset + cd_size, 1)
+    return out + struct.pack(
+        "<IHHHHIIH", 0x06054b50, 0, 0, min(count, 0xFFFF), min(count, 0xFFFF),
+        min(cd_size, ZIP64_LIMIT), min(cd_offset, ZIP64_LIMIT), 0
+    )
+
+
+def stream_zip(sources: Iterable[ZipSource], level: int = 6, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """边读边输出ZIP数据, 不生成临时文件, 内存占用与目录大小无关(中央目录记录除外).
+    已压缩格式使用STORE, 其余使用DEFLATE; 每个文件只读取遍历时的大小, 读取期间变大的部分忽略"""
+    offset = 0
+    records: List[CentralRecord] = []
+    for src in sources:
+        try:
+            f = src.open()
+        except OSError:
+            continue
+        with f:
+            name = src.arcname.encode("utf-8")
+            flags = FLAG_DESCRIPTOR | FLAG_UTF8
+            method = STORED if should_store(src.arcname) else DEFLATED
+            zip64 = src.size >= ZIP64_THRESHOLD
+            dostime, dosdate = dos_datetime(src.mtime)
+            header = local_header(name, flags, method, dostime, dosdate, 0, 0, 0, zip64)
+            yield header
+            compressor = zlib.compressobj(level, zlib.DEFLATED, -15) if method == DEFLATED else None
+            crc = usize = csize = 0
+            remaining = src.size
+            while remaining > 0:
+                chunk = f.read(min(chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                crc = zlib.crc32(chunk, crc)
+                usize += len(chunk)
+                if compressor:
+                    chunk = compressor.compress(chunk)
+                    if not chunk:
+                        continue
+                csize += len(chunk)
+                yield chunk
+            if compressor:
+                tail = compressor.flush()
+                csize += len(tail)
+                yield tail
+            yield data_descriptor(crc, csize, usize, zip64)
+        records.append(CentralRecord(name, flags, method, dostime, dosdate, crc, csize, usize, offset))
+        offset += len(header) + csize + (24 if zip64 else 16)
+
+    # 中央目录按块合并输出
+    cd_size = 0
+    buf = bytearray()
+    for r in records:
+        buf += central_header(r)
+        if len(buf) >= chunk_size:
+            cd_size += len(buf)
+            yield bytes(buf)
+            buf.clear()
+    cd_size += len(buf)
+    yield bytes(buf) + end_records(len(records), offset, cd_size)
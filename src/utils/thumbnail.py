@@ -1,3 +1,6 @@
+import sqlite3
+import stat
+import threading
 import uuid
 from datetime import datetime
 import mimetypes
@@ -5,65 +8,204 @@ from pathlib import Path
 from PIL import Image
 import cv2
 import os
-from typing import Union
+from typing import Union, Optional, Tuple, Dict, List, Callable, Iterable
+
+from cachetools import LRUCache
+
+from config import AppConfig
+from src.utils.filesystem.executor import FSExecutor
+from src.utils.filesystem.index import is_hidden
+from src.utils.filesystem.watcher import ChangeEvent, ChangeWatcher
+
+# 缩略图清单的键: (设备号, inode, 修改时间, 大小)
+ThumbKey = Tuple[int, int, float, int]
+
+
+def can_thumbnail(mime_type: Optional[str]) -> bool:
+    return bool(mime_type) and (mime_type.startswith("image/") or mime_type.startswith("video/"))
+
+
+def thumbnail_path(syspath: str, st: os.stat_result, mime_type: str) -> str:
+    """缩略图相对 data/ 的路径, 标识由文件名、创建时间、类型和大小生成"""
+    create_time: datetime = datetime.fromtimestamp(st.st_ctime)
+    ident = str(uuid.uuid3(uuid.NAMESPACE_OID, f"{Path(syspath).name}_{create_time}_{mime_type}_{st.st_size}"))
+    suffix = Path(syspath).suffix if mime_type.startswith("image/") else ".jpg"
+    return f"thumbnail/{str(create_time.year)}/{str(create_time.month)}/{ident}{suffix}"
+
+
+class ThumbManifest:
+    """缩略图清单: 内存LRU + SQLite持久化, 列表页可一次批量查出整个目录的缩略图"""
+    db_path: str = "data/thumbnail/manifest.db"
+    generation: int = 0
+    # 各目录(系统路径)最近一次生成缩略图时的generation, 用于目录列表的ETag
+    dir_generations: Dict[str, int] = {}
+    # 最近一次删除缩略图记录时的generation, 删除很少发生, 不区分目录
+    discarded: int = 0
+    _conn: Optional[sqlite3.Connection] = None
+    _lock = threading.RLock()
+    _cache: LRUCache = LRUCache(maxsize=100000)
+    _pending: set = set()
+
+    @classmethod
+    def _get_conn(cls) -> sqlite3.Connection:
+        if cls._conn is None:
+            Path(cls.db_path).parent.mkdir(parents=True, exist_ok=True)
+            cls._conn = sqlite3.connect(cls.db_path, check_same_thread=False)
+            cls._conn.execute("PRAGMA journal_mode=WAL")
+            cls._conn.execute(
+                "CREATE TABLE IF NOT EXISTS thumb ("
+                "dev INTEGER NOT NULL, ino INTEGER NOT NULL, mtime REAL NOT NULL, size INTEGER NOT NULL, "
+                "url TEXT NOT NULL, PRIMARY KEY (dev, ino, mtime, size))"
+            )
+            cls._conn.execute("CREATE INDEX IF NOT EXISTS idx_thumb_url ON thumb(url)")
+        return cls._conn
+
+    @classmethod
+    def lookup_many(cls, keys: Iterable[ThumbKey]) -> Dict[ThumbKey, str]:
+        found = {}
+        missing = []
+        with cls._lock:
+            for k in keys:
+                url = cls._cache.get(k)
+                if url is None:
+                    missing.append(k)
+                else:
+                    found[k] = url
+            conn = cls._get_conn()
+            for i in range(0, len(missing), 200):
+                part = missing[i:i + 200]
+                values = ", ".join(["(?, ?, ?, ?)"] * len(part))
+                rows = conn.execute(
+                    f"SELECT dev, ino, mtime, size, url FROM thumb WHERE (dev, ino, mtime, size) IN (VALUES {values})",
+                    [v for k in part for v in k]
+                ).fetchall()
+                for dev, ino, mtime, size, url in rows:
+                    cls._cache[(dev, ino, mtime, size)] = url
+                    found[(dev, ino, mtime, size)] = url
+        return found
+
+    @classmethod
+    def record(cls, key: ThumbKey, url: str, syspath: str):
+        with cls._lock:
+            conn = cls._get_conn()
+            with conn:
+                conn.execute("INSERT OR REPLACE INTO thumb (dev, ino, mtime, size, url) VALUES (?, ?, ?, ?, ?)",
+                             (*key, url))
+            cls._cache[key] = url
+            cls.generation += 1
+            cls.dir_generations[os.path.dirname(os.path.abspath(syspath))] = cls.generation
+
+    @classmethod
+    def discard_url(cls, url: str):
+        with cls._lock:
+            conn = cls._get_conn()
+            with conn:
+                conn.execute("DELETE FROM thumb WHERE url = ?", (url,))
+            for k in [k for k, v in cls._cache.items() if v == url]:
+                cls._cache.pop(k, None)
+            cls.generation += 1
+            cls.discarded = cls.generation
+
+    @classmethod
+    def dir_version(cls, dir_syspath: str) -> Tuple[int, int]:
+        """目录中文件的缩略图版本, 只在该目录生成缩略图或任意缩略图记录被删除时变化"""
+        return cls.dir_generations.get(os.path.abspath(dir_syspath), 0), cls.discarded
+
+
+def stat_key(st: os.stat_result) -> ThumbKey:
+    return st.st_dev, st.st_ino, st.st_mtime, st.st_size
+
+
+def row_key(row) -> ThumbKey:
+    return row["dev"], row["ino"], row["modified"], row["size"]
+
+
+def _make_thumbnail(syspath: str):
+    try:
+        st = os.stat(syspath)
+    except OSError:
+        return
+    if not stat.S_ISREG(st.st_mode):
+        return
+    mime_type: str = mimetypes.guess_type(syspath)[0]
+    if not can_thumbnail(mime_type) or ThumbManifest.lookup_many([stat_key(st)]):
+        return
+    url = thumbnail_path(syspath, st, mime_type)
+    file_path = Path("data").joinpath(url).absolute()
+    if not file_path.parent.exists():
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+    if not file_path.exists() and st.st_size > 0:
+        if mime_type.startswith("image/"):
+            try:
+                img = Image.open(syspath)
+                img.thumbnail((800, 800))
+                img.save(str(file_path))
+            except:
+                pass
+        if mime_type.startswith("video/"):
+            video = cv2.VideoCapture(syspath)
+            frame_count: float = video.get(cv2.CAP_PROP_FRAME_COUNT)
+            frame_pos = int(frame_count / 4)
+            video.set(cv2.CAP_PROP_POS_FRAMES, frame_pos)
+            success, image = video.read()
+            if success:
+                img = Image.fromarray(image.astype("uint8")).convert("RGB")
+                img.thumbnail((800, 800))
+                img.save(str(file_path))
+    if file_path.exists():
+        ThumbManifest.record(stat_key(st), "/" + url, syspath)
 
 
 async def set_thumbnail(syspath: str, **kwargs):
-    if Path(syspath).exists() and Path(syspath).is_file():
-        create_time: float = os.path.getctime(syspath)
-        create_time: datetime = datetime.fromtimestamp(create_time)
-        mime_type: str = mimetypes.guess_type(syspath)[0]
-        size = os.path.getsize(syspath)
-        dir_path: Path = Path("data/thumbnail").joinpath(str(create_time.year)).joinpath(str(create_time.month)).absolute()
-        if not dir_path.exists():
-            dir_path.mkdir(parents=True, exist_ok=True)
-        if mime_type:
-            ident = str(uuid.uuid3(uuid.NAMESPACE_OID, f"{Path(syspath).name}_{create_time}_{mime_type}_{size}"))
-            if mime_type.startswith("image/"):
-                suffix: str = Path(syspath).suffix
-                file_path: str = f"{dir_path.joinpath(ident)}{suffix}"
-                if not Path(file_path).exists() and size > 0:
-                    try:
-                        img = Image.open(syspath)
-                        img.thumbnail((800, 800))
-                        img.save(file_path)
-                    except:
-                        pass
-            if mime_type.startswith("video/"):
-                file_path = f"{dir_path.joinpath(ident)}.jpg"
-                if not Path(file_path).exists() and size > 0:
-                    video = cv2.VideoCapture(syspath)
-                    frame_count: float = video.get(cv2.CAP_PROP_FRAME_COUNT)
-                    frame_pos = int(frame_count / 4)
-                    video.set(cv2.CAP_PROP_POS_FRAMES, frame_pos)
-                    success, image = video.read()
-                    if success:
-                        img = Image.fromarray(image.astype("uint8")).convert("RGB")
-                        img.thumbnail((800, 800))
-                        img.save(file_path)
+    # 同一文件只排队一次, 生成过程在线程池中执行
+    if syspath in ThumbManifest._pending:
+        return
+    ThumbManifest._pending.add(syspath)
+    try:
+        await FSExecutor.run(_make_thumbnail, syspath)
+    finally:
+        ThumbManifest._pending.discard(syspath)
 
 
-async def get_thumbnail(syspath: str, **kwargs) -> Union[str, None]:
-    if Path(syspath).exists() and Path(syspath).is_file():
-        create_time: float = os.path.getctime(syspath)
-        create_time: datetime = datetime.fromtimestamp(create_time)
-        mime_type: str = mimetypes.guess_type(syspath)[0]
-        size = os.path.getsize(syspath)
-        if mime_type:
-            ident = str(uuid.uuid3(uuid.NAMESPACE_OID, f"{Path(syspath).name}_{create_time}_{mime_type}_{size}"))
-            worker = os.path.abspath(".")
-            if mime_type.startswith("image/"):
-                suffix: str = Path(syspath).suffix
-                dir_path: str = f"thumbnail/{str(create_time.year)}/{str(create_time.month)}/{ident}{suffix}"
-                if not Path(worker).joinpath("data/" + dir_path).exists():
-                    return None
-                return "/" + dir_path
-            elif mime_type.startswith("video/"):
-                dir_path: str = f"thumbnail/{str(create_time.year)}/{str(create_time.month)}/{ident}.jpg"
-                if not Path(worker).joinpath("data/" + dir_path).exists():
-                    return None
-                return "/" + dir_path
-            else:
-                return None
+async def on_change(event: ChangeEvent):
+    # 应用外部写入的媒体文件提前生成缩略图
+    root_path = ChangeWatcher.roots.get(event.mount_name)
+    if not root_path or not AppConfig.config.preview.thumbnail:
+        return
+    for path in event.paths:
+        if is_hidden(path):
+            continue
+        dir_syspath = os.path.join(root_path, path.lstrip("/"))
+        try:
+            names = await FSExecutor.run(os.listdir, dir_syspath)
+        except OSError:
+            continue
+        for name in names:
+            if can_thumbnail(mimetypes.guess_type(name)[0]):
+                await set_thumbnail(os.path.join(dir_syspath, name))
+
+
+def resolve_thumbnails(
+        rows: List, syspath_of: Callable, on_missing: Callable[[str], None]
+) -> Dict[str, str]:
+    """按索引行批量查询缩略图, 返回 {path: url}; 不访问文件系统, 缺失的交给on_missing生成"""
+    candidates = [r for r in rows if not r["is_dir"] and can_thumbnail(r["mime"])]
+    found = ThumbManifest.lookup_many([row_key(r) for r in candidates])
+    result = {}
+    for r in candidates:
+        url = found.get(row_key(r))
+        if url is None:
+            on_missing(syspath_of(r))
         else:
-            return None
+            result[r["path"]] = url
+    return result
+
+
+async def get_thumbnail(syspath: str, **kwargs) -> Union[str, None]:
+    try:
+        st = os.stat(syspath)
+    except OSError:
+        return None
+    if not stat.S_ISREG(st.st_mode) or not can_thumbnail(mimetypes.guess_type(syspath)[0]):
+        return None
+    return ThumbManifest.lookup_many([stat_key(st)]).get(stat_key(st))